@@ -0,0 +1,93 @@
+import os
+from flask import Blueprint, current_app, request, jsonify, send_from_directory
+from utils.decorators import require_role
+from utils.query_stats import get_stats
+from utils import profiler
+from config import PROFILE_ENABLED, PROFILE_DIR
+
+admin_bp = Blueprint('admin', __name__)
+
+QUERY_STATS_SORTS = ("total_s", "count", "max_s", "mean_s", "slow", "n_plus_one", "rows")
+
+
+@admin_bp.get('/admin/query_stats')
+@require_role('admin')
+def query_stats():
+    """Per-fingerprint statement stats for the worker that serves this request.
+
+    Query params: sort (total_s, count, max_s, mean_s, slow, n_plus_one, rows), limit (default 50)
+    """
+    sort = request.args.get('sort', 'total_s')
+    if sort not in QUERY_STATS_SORTS:
+        return jsonify({"error": f"sort must be one of {', '.join(QUERY_STATS_SORTS)}"}), 400
+    try:
+        limit = max(1, int(request.args.get('limit', 50)))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    stats = get_stats()
+    return jsonify({"pid": os.getpid(), "summary": stats.snapshot(), "queries": stats.top(sort, limit)}), 200
+
+
+@admin_bp.delete('/admin/query_stats')
+@require_role('admin')
+def reset_query_stats():
+    get_stats().reset()
+    return jsonify({"message": "query stats reset", "pid": os.getpid()}), 200
+
+
+def _profiling_disabled():
+    return jsonify({"error": "Profiling is disabled; start the workers with PROFILE_ENABLED=true"}), 404
+
+
+@admin_bp.get('/admin/profile')
+@require_role('admin')
+def profile_status():
+    """Current arming state plus the captures available for download (newest first)."""
+    if not PROFILE_ENABLED:
+        return _profiling_disabled()
+    return jsonify({"armed": profiler.armed(), "captures": profiler.list_captures()}), 200
+
+
+@admin_bp.post('/admin/profile')
+@require_role('admin')
+def arm_profile():
+    """Profile the next N requests to an endpoint across all workers.
+
+    Expected JSON: {"endpoint": "cards.list_cards", "count": 5, "mode": "stack"|"cprofile", "ttl": 600}
+    """
+    if not PROFILE_ENABLED:
+        return _profiling_disabled()
+    d = request.json or {}
+    endpoint = d.get('endpoint')
+    if endpoint not in current_app.view_functions:
+        return jsonify({"error": "endpoint must be a registered endpoint name, e.g. cards.list_cards"}), 400
+    mode = d.get('mode', profiler.PROFILE_MODE)
+    if mode not in profiler.MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(profiler.MODES)}"}), 400
+    try:
+        count = int(d.get('count', 1))
+        ttl = int(d.get('ttl', 600))
+    except (TypeError, ValueError):
+        return jsonify({"error": "count and ttl must be integers"}), 400
+    if count < 1 or ttl < 1:
+        return jsonify({"error": "count and ttl must be positive"}), 400
+    return jsonify({"armed": profiler.arm(endpoint, count, mode, ttl)}), 200
+
+
+@admin_bp.delete('/admin/profile')
+@require_role('admin')
+def disarm_profile():
+    if not PROFILE_ENABLED:
+        return _profiling_disabled()
+    profiler.disarm()
+    return jsonify({"message": "profiling disarmed"}), 200
+
+
+@admin_bp.get('/admin/profile/<name>')
+@require_role('admin')
+def download_profile(name):
+    if not PROFILE_ENABLED:
+        return _profiling_disabled()
+    if not name.endswith(profiler.EXTENSIONS):
+        return jsonify({"error": "Not a profile capture"}), 404
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True)
@@ -1,16 +1,25 @@
+import hmac
 import os
 import time
-from flask import Flask, request, session, jsonify
+from flask import Flask, Response, request, session, jsonify, abort, g
 from auth import auth_bp, hash_password
 from merchants import merchants_bp
 from customers import customers_bp
 from cards import cards_bp
 from transactions import transactions_bp
 from audit import audit_bp
+from admin import admin_bp
+from changes import changes_bp
+from reports import reports_bp
 from flask_cors import CORS
-from db import get_db
+from db import get_db, pool_stats, replica_stats, remember_write
+from utils.keystore import dek_cache_stats
+from utils.logger import audit_stats
+from utils.idempotency import idempotency_cache_stats
+from utils import metrics, query_stats, profiler, shards
+from utils.list_cache import list_cache_stats
 
-from config import SECRET_KEY, SAFE_DB_INFO
+from config import SECRET_KEY, SAFE_DB_INFO, METRICS_TOKEN, LOGIN_DEBUG_TIMINGS, SHARD_MAP_TTL
 
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
@@ -44,9 +53,18 @@ CORS(app,
      supports_credentials=True,
      origins=allowed_origins,
      allow_headers=["Content-Type", "Authorization"],
-     expose_headers=["Content-Type"],
+     expose_headers=["Content-Type", "Server-Timing", "X-Query-Count", "ETag"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
 
+# Per-request timing: Server-Timing header plus histograms served at /metrics
+metrics.init_app(app)
+# Per-request query counts, slow-query log and N+1 flagging
+query_stats.init_app(app)
+# Keeps a session's reads on the primary until the read replica has its last write
+app.after_request(remember_write)
+# No-op unless PROFILE_ENABLED is set
+profiler.init_app(app)
+
 # Register blueprints
 app.register_blueprint(auth_bp)
 app.register_blueprint(merchants_bp)
@@ -54,6 +72,18 @@ app.register_blueprint(customers_bp)
 app.register_blueprint(cards_bp)
 app.register_blueprint(transactions_bp)
 app.register_blueprint(audit_bp)
+app.register_blueprint(admin_bp)
+app.register_blueprint(changes_bp)
+app.register_blueprint(reports_bp)
+
+@app.errorhandler(shards.ShardMoving)
+def shard_moving(e):
+    # shard_admin.py is moving the merchant; writes are refused until the map flips
+    response = jsonify({"error": str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, int(SHARD_MAP_TTL)))
+    return response
+
 
 @app.route('/')
 def home():
@@ -68,15 +98,48 @@ def dbtest():
         db, cur = get_db()
         cur.execute("SELECT 1")
         _ = cur.fetchone()
-        return {"db": "ok", "db_info": SAFE_DB_INFO}, 200
+        return {"db": "ok", "db_info": SAFE_DB_INFO, "pool": pool_stats(), "replica": replica_stats(),
+                "shards": list(shards.names()), "shard_map": shards.shard_map_stats(),
+                "dek_cache": dek_cache_stats(), "audit": audit_stats()}, 200
     except Exception as e:
         # Return a short error message and log full exception server-side
         print(f"[DBTEST] error connecting to DB: {e}")
         return {"db": "error", "error": str(e), "db_info": SAFE_DB_INFO}, 500
 
+@app.get('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition: request counters/histograms plus this worker's pool and cache gauges."""
+    # Pool, cache and per-endpoint traffic figures are not for the public: no token, no route
+    if not METRICS_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        abort(401)
+    pid = (("pid", os.getpid()),)
+    gauges = {}
+    for prefix, stats in (("db_pool", pool_stats()), ("db_replica", replica_stats()),
+                          ("shard_map", shards.shard_map_stats()),
+                          ("dek_cache", dek_cache_stats()), ("query_stats", query_stats.query_stats()),
+                          ("idempotency_cache", idempotency_cache_stats()), ("list_cache", list_cache_stats()),
+                          ("audit", audit_stats())):
+        for name, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges[f"vault_{prefix}_{name}"] = {pid: value}
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+def _login_reply(body, status):
+    """The /login response, with the deprecated timings it used to carry while LOGIN_DEBUG_TIMINGS is on."""
+    if not LOGIN_DEBUG_TIMINGS:
+        return jsonify(body), status
+    total = time.perf_counter() - g.get('request_start', time.perf_counter())
+    timings = g.get('timings') or {}
+    resp = jsonify(dict(body, timings={"total_s": total, "db_connect_s": timings.get("db_connect", 0.0),
+                                       "db_query_s": timings.get("db_query", 0.0)}))
+    resp.status_code = status
+    resp.headers['X-Debug-Timings'] = str(total)
+    return resp
+
 @app.post('/login')
 def login():
-    start = time.time()
     data = request.json
     username = data.get('username') if data else None
     password = data.get('password') if data else None
@@ -85,62 +148,33 @@ def login():
         return jsonify({"error": "Username and password required"}), 400
 
     try:
-        t_connect_start = time.time()
         db, cur = get_db()
-        t_connect_end = time.time()
-
-        t_query_start = time.time()
         hashed = hash_password(password)
         cur.execute(
             "SELECT user_id, user_role, status FROM users WHERE username = %s AND password_hash = %s",
             (username, hashed)
         )
         user = cur.fetchone()
-        t_query_end = time.time()
 
         if not user:
-            total = time.time() - start
-            print(f"[LOGIN] failed auth for {username} — total={total:.3f}s, connect={(t_connect_end-t_connect_start):.3f}s, query={(t_query_end-t_query_start):.3f}s")
-            resp = jsonify({"error": "Invalid username or password", "timings": {
-                "total_s": total,
-                "db_connect_s": (t_connect_end - t_connect_start),
-                "db_query_s": (t_query_end - t_query_start)
-            }})
-            resp.status_code = 401
-            resp.headers['X-Debug-Timings'] = str(total)
-            return resp
+            print(f"[LOGIN] failed auth for {username}")
+            return _login_reply({"error": "Invalid username or password"}, 401)
 
         user_id, role, status = user
 
         if status != "Active":
-            total = time.time() - start
-            print(f"[LOGIN] inactive account {username} — total={total:.3f}s")
-            resp = jsonify({"error": "Account is inactive or suspended", "timings": {"total_s": total}})
-            resp.status_code = 403
-            resp.headers['X-Debug-Timings'] = str(total)
-            return resp
+            print(f"[LOGIN] inactive account {username}")
+            return _login_reply({"error": "Account is inactive or suspended"}, 403)
 
         session['user_id'] = user_id
         session['user_role'] = role
         session['username'] = username
 
-        total = time.time() - start
-        print(f"[LOGIN] success {username} id={user_id} role={role} — total={total:.3f}s, connect={(t_connect_end-t_connect_start):.3f}s, query={(t_query_end-t_query_start):.3f}s")
-        resp = jsonify({"message": "Login successful", "user_id": user_id, "role": role, "timings": {
-            "total_s": total,
-            "db_connect_s": (t_connect_end - t_connect_start),
-            "db_query_s": (t_query_end - t_query_start)
-        }})
-        resp.status_code = 200
-        resp.headers['X-Debug-Timings'] = str(total)
-        return resp
+        print(f"[LOGIN] success {username} id={user_id} role={role}")
+        return _login_reply({"message": "Login successful", "user_id": user_id, "role": role}, 200)
     except Exception as e:
-        total = time.time() - start
-        print(f"[LOGIN] error for {username if username else 'unknown'} — {e} — total={total:.3f}s")
-        resp = jsonify({"error": str(e), "timings": {"total_s": total}})
-        resp.status_code = 500
-        resp.headers['X-Debug-Timings'] = str(total)
-        return resp
+        print(f"[LOGIN] error for {username if username else 'unknown'} — {e}")
+        return _login_reply({"error": str(e)}, 500)
 
 @app.post('/logout')
 def logout():
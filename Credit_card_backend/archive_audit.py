@@ -0,0 +1,120 @@
+"""Audit log retention: monthly partitions, archival to segment files, and reading the archive.
+
+    python archive_audit.py partitions                  # add partitions AUDIT_PARTITIONS_AHEAD months out
+    python archive_audit.py archive --hot-months 3      # export and drop months past the hot window
+    python archive_audit.py list                        # segments in AUDIT_ARCHIVE_DIR
+    python archive_audit.py verify                      # re-check every segment's checksum and row count
+    python archive_audit.py read --user-id 7 --since 2026-01-01 > events.ndjson
+
+Run `partitions` and `archive` from cron; both are safe to repeat. The
+archived rows are also served by GET /audit/export?source=archive.
+"""
+import argparse
+import json
+import sys
+from config import AUDIT_ARCHIVE_DIR, AUDIT_HOT_MONTHS, AUDIT_PARTITIONS_AHEAD
+from models.migrations import connect
+from utils.audit_archive import (ArchiveError, archive, ensure_partitions, partitions, read_archive, segments,
+                                 verify_segment)
+from utils.audit_filters import parse_filters
+
+
+def cmd_partitions(args):
+    conn = connect()
+    cur = conn.cursor(buffered=True)
+    try:
+        if not partitions(cur):
+            print("[AUDIT] audit_logs is not partitioned (SQLite, or migration 7 not applied)")
+            return 1
+        added = ensure_partitions(cur, args.ahead)
+        print(f"[AUDIT] added partitions: {', '.join(added)}" if added else "[AUDIT] partitions are up to date")
+        for name, bound, rows in partitions(cur):
+            print(f"  {name:<8} < {bound:%Y-%m-%d}  ~{rows} rows" if bound else f"  {name:<8} MAXVALUE  ~{rows} rows")
+    finally:
+        cur.close()
+        conn.close()
+    return 0
+
+
+def cmd_archive(args):
+    conn = connect()
+    try:
+        written = archive(conn, args.dir, args.hot_months, dry_run=args.dry_run)
+    except ArchiveError as e:
+        print(f"[AUDIT] archive stopped: {e}; nothing was removed for that month, re-run to retry")
+        return 1
+    finally:
+        conn.close()
+    if not args.dry_run:
+        print(f"[AUDIT] {len(written)} segment(s), {sum(m['rows'] for m in written)} rows archived to {args.dir}")
+    return 0
+
+
+def cmd_list(args):
+    for m in segments(args.dir):
+        print(f"{m['segment']}  {m['rows']:>10} rows  {m['bytes']:>12} bytes  "
+              f"{m['first_created_at']} .. {m['last_created_at']}")
+    return 0
+
+
+def cmd_verify(args):
+    failed = 0
+    for m in segments(args.dir):
+        try:
+            verify_segment(m)
+            print(f"[AUDIT] {m['segment']} ok")
+        except (ArchiveError, OSError) as e:
+            failed += 1
+            print(f"[AUDIT] {m['segment']} FAILED: {e}")
+    return 1 if failed else 0
+
+
+def cmd_read(args):
+    try:
+        filters = parse_filters({'user_id': args.user_id, 'table_name': args.table_name,
+                                 'action_type': args.action_type, 'record_id': args.record_id,
+                                 'since': args.since, 'until': args.until})
+    except ValueError as e:
+        print(f"[AUDIT] {e}", file=sys.stderr)
+        return 2
+    for record in read_archive(args.dir, filters, verify=args.verify):
+        sys.stdout.write(json.dumps(record) + "\n")
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Audit log partitions and archive")
+    parser.add_argument("--dir", default=AUDIT_ARCHIVE_DIR, help="segment directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("partitions", help="create monthly partitions ahead of the clock")
+    p.add_argument("--ahead", type=int, default=AUDIT_PARTITIONS_AHEAD)
+    p.set_defaults(func=cmd_partitions)
+
+    p = sub.add_parser("archive", help="move months past the hot window into segment files")
+    p.add_argument("--hot-months", type=int, default=AUDIT_HOT_MONTHS,
+                   help="months kept in the table, counting the current one")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_archive)
+
+    sub.add_parser("list", help="show archived segments").set_defaults(func=cmd_list)
+    sub.add_parser("verify", help="check segment checksums and row counts").set_defaults(func=cmd_verify)
+
+    p = sub.add_parser("read", help="print archived events matching the /audit filters as NDJSON")
+    p.add_argument("--user-id")
+    p.add_argument("--table-name")
+    p.add_argument("--action-type")
+    p.add_argument("--record-id")
+    p.add_argument("--since", help="ISO 8601, inclusive")
+    p.add_argument("--until", help="ISO 8601, exclusive")
+    p.add_argument("--verify", action="store_true", help="fail if a segment's checksum does not match")
+    p.set_defaults(func=cmd_read)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "hot_months", 1) < 1:
+        parser.error("--hot-months must be at least 1")
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,115 @@
-from flask import Blueprint
-from utils.decorators import require_role
+from datetime import datetime
+from flask import Blueprint, request, jsonify
+from utils.decorators import require_role, read_only
+from utils.streaming import page_args, stream_query, stream_response, csv_response
+from utils.audit_filters import parse_filters, filter_sql
+from utils.audit_archive import COLUMNS as AUDIT_COLUMNS, read_archive, segments
+from config import AUDIT_ARCHIVE_DIR
 from db import get_db
 
 audit_bp = Blueprint('audit', __name__)
 
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_SOURCES = ('live', 'archive')
+DEFAULT_LIMIT = 100
+
+
+def _parse_cursor(after):
+    # Cursor is "<created_at ISO>,<log_id>" of the last row on the previous page
+    created_at, sep, log_id = (after or '').rpartition(',')
+    try:
+        if not sep or not log_id.isdigit():
+            raise ValueError
+        return datetime.fromisoformat(created_at), int(log_id)
+    except ValueError:
+        raise ValueError("after must look like <created_at>,<log_id>")
+
+
+def _audit_sql(clauses, descending=True):
+    order = "DESC" if descending else "ASC"
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return (f"SELECT {', '.join(AUDIT_COLUMNS)} FROM audit_logs {where} "
+            f"ORDER BY created_at {order}, log_id {order}")
+
+
+def _iso(record):
+    if isinstance(record.get('created_at'), datetime):
+        record['created_at'] = record['created_at'].isoformat()
+    return record
+
+
 @audit_bp.get('/audit')
 @require_role('admin')
+@read_only
 def audit_logs():
+    """Newest-first audit events, optionally filtered, in keyset pages.
+
+    Pass the returned next_after as ?after= to get the following page.
+    ?stream=ndjson|json walks every matching row instead.
+    """
+    try:
+        limit, after, stream = page_args()
+        clauses, params = filter_sql(parse_filters(request.args))
+        if after:
+            created_at, log_id = _parse_cursor(after)
+            # Expanded rather than a row comparison so MySQL can range-scan the index
+            clauses.append("(created_at < %s OR (created_at = %s AND log_id < %s))")
+            params += [created_at, created_at, log_id]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    sql = _audit_sql(clauses)
+    if stream:
+        return stream_response(map(_iso, stream_query(sql, tuple(params), ())), 'logs', stream)
+
+    limit = limit or DEFAULT_LIMIT
     db, cur = get_db()
-    cur.execute("SELECT * FROM audit_logs ORDER BY created_at DESC LIMIT 100")
-    return {"logs": cur.fetchall()}
\ No newline at end of file
+    cur.execute(sql + " LIMIT %s", tuple(params) + (limit,))
+    columns = [desc[0] for desc in cur.description]
+    logs = [_iso(dict(zip(columns, r))) for r in cur.fetchall()]
+    next_after = f"{logs[-1]['created_at']},{logs[-1]['log_id']}" if len(logs) == limit else None
+    return jsonify({"logs": logs, "next_after": next_after})
+
+
+@audit_bp.get('/audit/export')
+@require_role('admin')
+@read_only
+def export_audit_logs():
+    """Oldest-first export of every matching event as NDJSON or CSV (?format=), in constant memory.
+
+    Takes the same filters as /audit. ?source=archive reads the segment
+    files written by archive_audit.py instead of the table.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    source = request.args.get('source', 'live')
+    if source not in EXPORT_SOURCES:
+        return jsonify({"error": f"source must be one of: {', '.join(EXPORT_SOURCES)}"}), 400
+    try:
+        filters = parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if source == 'archive':
+        records = read_archive(AUDIT_ARCHIVE_DIR, filters, verify=True)
+    else:
+        clauses, params = filter_sql(filters)
+        records = map(_iso, stream_query(_audit_sql(clauses, descending=False), tuple(params), ()))
+    if fmt == 'csv':
+        response = csv_response(records, AUDIT_COLUMNS)
+    else:
+        response = stream_response(records, 'logs', 'ndjson')
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+    response.headers['Content-Disposition'] = f'attachment; filename="audit-{source}-{stamp}.{fmt}"'
+    return response
+
+
+@audit_bp.get('/audit/archive')
+@require_role('admin')
+def list_audit_archive():
+    """Segments written by archive_audit.py, oldest first."""
+    manifests = segments(AUDIT_ARCHIVE_DIR)
+    for m in manifests:
+        m.pop('path', None)
+    return jsonify({"segments": manifests, "rows": sum(m['rows'] for m in manifests)})
@@ -0,0 +1,112 @@
+"""Fill the blind-index columns (card_vault.card_number_bidx, customers.email_bidx) for existing rows.
+
+Walks each table in primary-key order one chunk per transaction, decrypting
+only the indexed column. Rows that already have an index are skipped unless
+--all is given (needed after changing BLIND_INDEX_KEY). Safe to stop and
+re-run at any time.
+
+    python backfill_blind_index.py --chunk-size 2000 --max-rows-per-sec 5000
+
+With merchant shards, --shard NAME fills one shard and --shard all fills
+main and then every shard in DB_SHARDS. Data keys are always read from main.
+"""
+import argparse
+import sys
+import time
+from config import DB_SHARDS
+from models.migrations import connect
+from utils.crypto import DecryptionError, blind_index, decrypt_field
+from utils.keystore import keys_for
+from utils.shards import MAIN
+
+# table -> (primary key, encrypted column, blind-index column, blind-index kind)
+TABLES = {
+    "card_vault": ("card_id", "card_number_enc", "card_number_bidx", "card_number"),
+    "customers": ("customer_id", "email_enc", "email_bidx", "email"),
+}
+
+
+def backfill(conn, table, chunk_size, recompute=False, rows_per_sec=None, keys_conn=None):
+    """Returns (rows scanned, rows updated, rows that could not be decrypted).
+
+    `keys_conn` is a connection to main, where data_keys live, when `conn` is a shard.
+    """
+    pk, enc_col, bidx_col, kind = TABLES[table]
+    where = "" if recompute else f" AND {bidx_col} IS NULL"
+    select_sql = f"SELECT {pk}, {enc_col} FROM {table} WHERE {pk} > %s{where} ORDER BY {pk} LIMIT %s"
+    update_sql = f"UPDATE {table} SET {bidx_col} = %s WHERE {pk} = %s"
+    cur = conn.cursor(buffered=True)
+    kcur = cur if keys_conn is None else keys_conn.cursor(buffered=True)
+    last_pk, scanned, updated, failed = 0, 0, 0, 0
+    try:
+        while True:
+            started = time.time()
+            cur.execute(select_sql, (last_pk, chunk_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            keys = keys_for(kcur, (r[1] for r in rows))
+            if keys_conn is not None:
+                keys_conn.rollback()
+            updates = []
+            for row_id, blob in rows:
+                try:
+                    plain = decrypt_field(blob, keys)
+                except DecryptionError as e:
+                    print(f"[BIDX] {table} {row_id}: {e}")
+                    plain = None
+                if plain is None:
+                    if blob is not None:
+                        failed += 1
+                    continue
+                updates.append((blind_index(kind, plain), row_id))
+            if updates:
+                cur.executemany(update_sql, updates)
+            conn.commit()
+            last_pk = rows[-1][0]
+            scanned += len(rows)
+            updated += len(updates)
+            print(f"[BIDX] {table}: {scanned} scanned, {updated} indexed, {failed} undecryptable (last {pk}={last_pk})")
+            if rows_per_sec:
+                pause = len(rows) / rows_per_sec - (time.time() - started)
+                if pause > 0:
+                    time.sleep(pause)
+    finally:
+        if kcur is not cur:
+            kcur.close()
+        cur.close()
+    return scanned, updated, failed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Backfill blind-index columns for existing vault rows")
+    parser.add_argument("--tables", nargs="*", choices=sorted(TABLES), default=sorted(TABLES))
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--max-rows-per-sec", type=int, help="throttle to spare the primary")
+    parser.add_argument("--all", action="store_true", help="recompute rows that already have an index")
+    parser.add_argument("--shard", default=MAIN, help="shard to fill, or 'all' for main and every shard in DB_SHARDS")
+    args = parser.parse_args(argv)
+    shards = [MAIN, *DB_SHARDS] if args.shard == "all" else [args.shard]
+    if any(s != MAIN and s not in DB_SHARDS for s in shards):
+        parser.error(f"unknown shard {args.shard!r}; DB_SHARDS has: {', '.join(DB_SHARDS) or 'none'}")
+
+    failed = 0
+    for shard in shards:
+        conn = connect(shard)
+        keys_conn = None if shard == MAIN else connect(MAIN)
+        try:
+            for table in args.tables:
+                scanned, updated, bad = backfill(conn, table, args.chunk_size, args.all, args.max_rows_per_sec,
+                                                 keys_conn)
+                failed += bad
+                label = f"{shard}/{table}" if len(shards) > 1 else table
+                print(f"[BIDX] {label} done: {updated}/{scanned} rows indexed")
+        finally:
+            if keys_conn is not None:
+                keys_conn.close()
+            conn.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,395 @@
+"""Concurrent load runner for the vault API.
+
+Reads the manifest written by bench/seed.py, logs every worker thread in as
+the bench admin and one of the bench merchants, then hits the scenario's
+endpoints (picked by weight) for --duration seconds or --requests calls.
+Per endpoint it reports requests/s and p50/p95/p99 latency, plus the mean
+of each Server-Timing phase the app reported. The full result is saved as
+JSON.
+
+    python -m bench.run run --base-url http://127.0.0.1:5000 --scenario mixed --concurrency 16 --duration 60
+    python -m bench.run run --scenario reads --weights card_list=3,audit=1
+    python -m bench.run compare bench/results/before.json bench/results/after.json --threshold 10
+
+Only the standard library is used, so it can run from any machine that can
+reach the app.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MANIFEST = os.path.join(BENCH_DIR, "manifest.json")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+
+def _card_number(rng):
+    return "4" + "".join(str(rng.randrange(10)) for _ in range(15))
+
+
+def _pick(rng, id_range):
+    return rng.randint(id_range[0], id_range[1])
+
+
+# name -> (method, role whose session is used, path, body(worker) or None)
+ENDPOINTS = {
+    "login": ("POST", None, "/login",
+              lambda w: {"username": w.merchant["username"], "password": w.password}),
+    "card_store": ("POST", "merchant", "/card/store",
+                   lambda w: {"customer_id": _pick(w.rng, w.merchant["customer_ids"]), "card": _card_number(w.rng),
+                              "exp": "12/30", "cvv": f"{w.rng.randrange(1000):03d}", "cardholderName": "Bench User"}),
+    "card_list": ("GET", "merchant", "/card/list?limit=100", None),
+    "card_list_full": ("GET", "merchant", "/card/list?limit=100&view=full", None),
+    "store_with_card": ("POST", "merchant", "/customer/store_with_card",
+                        lambda w: {"merchant_id": w.merchant["merchant_id"], "firstname": "Bench", "lastname": "User",
+                                   "email": f"bench-{w.rng.randrange(10 ** 9)}@bench.local", "phone": "+15550000000",
+                                   "card": _card_number(w.rng), "exp": "12/30", "cvv": "123"}),
+    "merchant_customers": ("GET", "merchant", "/merchant/customers", None),
+    "admin_all_data": ("GET", "admin", "/admin/all_data?limit=200", None),
+    "charge": ("POST", "merchant", "/charge",
+               lambda w: {"card_id": _pick(w.rng, w.merchant["card_ids"]),
+                          "amount": f"{w.rng.uniform(1, 200):.2f}", "currency": "USD"}),
+    "audit": ("GET", "admin", "/audit", None),
+    "report": ("GET", "merchant", "/reports/transactions?interval=day", None),
+}
+
+# scenario -> {endpoint: weight}; every endpoint name is also a single-endpoint scenario
+SCENARIOS = {
+    "mixed": {"login": 2, "card_list": 15, "merchant_customers": 10, "admin_all_data": 3, "audit": 3,
+              "card_store": 10, "store_with_card": 5, "charge": 50},
+    "reads": {"card_list": 4, "merchant_customers": 3, "admin_all_data": 1, "audit": 1},
+    "writes": {"card_store": 3, "store_with_card": 1, "charge": 6},
+}
+SCENARIOS.update({name: {name: 1} for name in ENDPOINTS})
+
+
+class Client:
+    """One keep-alive HTTP connection that carries the Flask session cookie by hand.
+
+    The app marks its cookie Secure, which a cookie jar would refuse to send
+    over plain http to a local server.
+    """
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        conn_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._conn = conn_class(parts.netloc, timeout=timeout)
+        self.cookie = None
+
+    def request(self, method, path, body=None):
+        headers = {"Accept": "application/json"}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        try:
+            self._conn.request(method, path, body=payload, headers=headers)
+            resp = self._conn.getresponse()
+            data = resp.read()
+        except (http.client.HTTPException, OSError):
+            # Server dropped the keep-alive connection; reconnect on the next call
+            self._conn.close()
+            raise
+        for name, value in resp.getheaders():
+            if name.lower() == "set-cookie" and value.startswith("session="):
+                self.cookie = value.split(";", 1)[0]
+        return resp.status, resp.getheader("Server-Timing"), data
+
+    def close(self):
+        self._conn.close()
+
+
+def parse_server_timing(header):
+    """'db_query;dur=1.20, total;dur=3.4' -> {'db_query': 1.2, 'total': 3.4}"""
+    phases = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        for p in params.split(";"):
+            key, _, value = p.strip().partition("=")
+            if key == "dur":
+                try:
+                    phases[name] = float(value)
+                except ValueError:
+                    pass
+    return phases
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.server = defaultdict(lambda: defaultdict(list))
+
+    def add(self, endpoint, seconds, status, server_timing):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][str(status)] += 1
+            for phase, ms in parse_server_timing(server_timing).items():
+                self.server[endpoint][phase].append(ms)
+
+
+class Worker(threading.Thread):
+    def __init__(self, index, args, manifest, weights, stats, measure_from, deadline, budget):
+        super().__init__(name=f"bench-{index}", daemon=True)
+        self.args = args
+        self.rng = random.Random(args.seed * 1000 + index)
+        self.password = manifest["password"]
+        merchants = [m for m in manifest["merchants"] if m.get("card_ids")]
+        self.merchant = merchants[index % len(merchants)]
+        self.admin = manifest["admin"]
+        self.names = list(weights)
+        self.weights = [weights[n] for n in self.names]
+        self.stats = stats
+        self.measure_from = measure_from
+        self.deadline = deadline
+        self.budget = budget
+        self.clients = {}
+        self.error = None
+
+    def _login(self, role, username):
+        client = Client(self.args.base_url, self.args.timeout)
+        status, _, body = client.request("POST", "/login", {"username": username, "password": self.password})
+        if status != 200:
+            raise RuntimeError(f"login as {username} failed with {status}: {body[:200]!r}")
+        self.clients[role] = client
+
+    def run(self):
+        try:
+            roles = {ENDPOINTS[n][1] for n in self.names}
+            if "merchant" in roles:
+                self._login("merchant", self.merchant["username"])
+            if "admin" in roles:
+                self._login("admin", self.admin["username"])
+            if None in roles:
+                self.clients[None] = Client(self.args.base_url, self.args.timeout)
+            while time.time() < self.deadline and self.budget.take():
+                name = self.rng.choices(self.names, self.weights)[0]
+                method, role, path, body = ENDPOINTS[name]
+                client = self.clients[role]
+                if role is None:
+                    client.cookie = None
+                start = time.perf_counter()
+                try:
+                    status, server_timing, _ = client.request(method, path, body(self) if body else None)
+                except (http.client.HTTPException, OSError) as e:
+                    status, server_timing = type(e).__name__, None
+                elapsed = time.perf_counter() - start
+                if time.time() >= self.measure_from:
+                    self.stats.add(name, elapsed, status, server_timing)
+        except Exception as e:
+            self.error = e
+        finally:
+            for client in self.clients.values():
+                client.close()
+
+
+class Budget:
+    """Shared request counter for --requests runs (unlimited when total is None)."""
+
+    def __init__(self, total):
+        self.remaining = total
+        self._lock = threading.Lock()
+
+    def take(self):
+        if self.remaining is None:
+            return True
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # Nearest-rank method
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, statuses, server, elapsed):
+    values = sorted(latencies)
+    ok = sum(n for s, n in statuses.items() if s.isdigit() and int(s) < 400)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        "count": len(values),
+        "errors": len(values) - ok,
+        "rps": round(len(values) / elapsed, 2) if elapsed else None,
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1]) if values else None,
+        "statuses": dict(statuses),
+        "server_timing_mean_ms": {p: round(sum(v) / len(v), 2) for p, v in sorted(server.items()) if v},
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=BENCH_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _parse_weights(text):
+    weights = {}
+    for item in filter(None, (text or "").split(",")):
+        name, _, weight = item.partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint '{name}', expected one of: {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def run(args):
+    with open(args.manifest, encoding="utf-8") as f:
+        manifest = json.load(f)
+    weights = dict(SCENARIOS[args.scenario])
+    weights.update(_parse_weights(args.weights))
+    weights = {n: w for n, w in weights.items() if w > 0}
+    if not any(m.get("card_ids") for m in manifest["merchants"]):
+        raise SystemExit("manifest has no merchants with cards; run bench.seed first")
+
+    stats = Stats()
+    started = time.time()
+    measure_from = started + args.warmup
+    deadline = measure_from + args.duration if args.requests is None else float("inf")
+    budget = Budget(args.requests)
+    workers = [Worker(i, args, manifest, weights, stats, measure_from, deadline, budget)
+               for i in range(args.concurrency)]
+    print(f"[BENCH] {args.scenario}: {args.concurrency} workers against {args.base_url} "
+          f"({f'{args.requests} requests' if args.requests else f'{args.duration}s'}, warm-up {args.warmup}s)")
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    finished = time.time()
+    failed = [w.error for w in workers if w.error]
+    if failed:
+        print(f"[BENCH] {len(failed)} worker(s) stopped early: {failed[0]}")
+    elapsed = finished - max(measure_from, started)
+
+    endpoints = {name: summarize(stats.latencies[name], stats.statuses[name], stats.server[name], elapsed)
+                 for name in sorted(stats.latencies)}
+    all_latencies = [v for values in stats.latencies.values() for v in values]
+    all_statuses = Counter()
+    for c in stats.statuses.values():
+        all_statuses.update(c)
+    result = {
+        "meta": {"scenario": args.scenario, "weights": weights, "base_url": args.base_url,
+                 "concurrency": args.concurrency, "duration": args.duration, "requests": args.requests,
+                 "warmup": args.warmup, "seed": args.seed, "started": time.strftime("%Y-%m-%dT%H:%M:%S",
+                                                                                   time.localtime(started)),
+                 "elapsed_s": round(elapsed, 2), "git": _git_revision(), "dataset": manifest.get("counts"),
+                 "worker_errors": [str(e) for e in failed]},
+        "total": summarize(all_latencies, all_statuses, {}, elapsed),
+        "endpoints": endpoints,
+    }
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{args.scenario}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print_table(result)
+    print(f"[BENCH] results written to {out}")
+    return 1 if failed else 0
+
+
+def print_table(result):
+    print(f"{'endpoint':<20}{'count':>8}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, s in list(result["endpoints"].items()) + [("TOTAL", result["total"])]:
+        print(f"{name:<20}{s['count']:>8}{s['errors']:>8}{s['rps'] or 0:>10}"
+              f"{s['p50_ms'] or 0:>10}{s['p95_ms'] or 0:>10}{s['p99_ms'] or 0:>10}")
+
+
+def compare(args):
+    """Print per-endpoint deltas between two result files; exit 1 if any endpoint regressed."""
+    with open(args.baseline, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        cand = json.load(f)
+    if base["meta"]["scenario"] != cand["meta"]["scenario"] or base["meta"]["concurrency"] != cand["meta"]["concurrency"]:
+        print("[BENCH] warning: runs used different scenarios or concurrency; deltas may not be meaningful")
+
+    def delta(old, new):
+        if not old or new is None:
+            return None
+        return (new - old) / old * 100
+
+    regressions = []
+    print(f"{'endpoint':<20}{'metric':>8}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for name in sorted(set(base["endpoints"]) | set(cand["endpoints"])):
+        old, new = base["endpoints"].get(name), cand["endpoints"].get(name)
+        if old is None or new is None:
+            print(f"{name:<20} only in {'candidate' if old is None else 'baseline'}")
+            continue
+        for metric, higher_is_worse in (("rps", False), ("p50_ms", True), ("p95_ms", True), ("p99_ms", True)):
+            change = delta(old[metric], new[metric])
+            if change is None:
+                continue
+            worse = change > args.threshold if higher_is_worse else change < -args.threshold
+            # Ignore sub-millisecond jitter on fast endpoints
+            if worse and metric.endswith("_ms") and new[metric] - old[metric] < args.min_ms:
+                worse = False
+            flag = "  REGRESSION" if worse else ""
+            print(f"{name:<20}{metric:>8}{old[metric]:>12}{new[metric]:>12}{change:>+9.1f}%{flag}")
+            if worse:
+                regressions.append((name, metric, change))
+        if new["errors"] > old["errors"]:
+            print(f"{name:<20}{'errors':>8}{old['errors']:>12}{new['errors']:>12}")
+
+    if regressions:
+        print(f"[BENCH] {len(regressions)} regression(s) beyond {args.threshold}%")
+        return 1
+    print(f"[BENCH] no regressions beyond {args.threshold}%")
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Load-test the vault API and compare runs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    r = sub.add_parser("run", help="run a load scenario")
+    r.add_argument("--base-url", default="http://127.0.0.1:5000")
+    r.add_argument("--manifest", default=DEFAULT_MANIFEST)
+    r.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    r.add_argument("--weights", help="override endpoint weights, e.g. charge=5,card_list=1 (0 disables)")
+    r.add_argument("--concurrency", type=int, default=8)
+    r.add_argument("--duration", type=float, default=30, help="seconds to measure (after warm-up)")
+    r.add_argument("--requests", type=int, help="stop after this many requests instead of --duration")
+    r.add_argument("--warmup", type=float, default=5, help="seconds of load excluded from the results")
+    r.add_argument("--timeout", type=float, default=30)
+    r.add_argument("--seed", type=int, default=1)
+    r.add_argument("--out", help="result file (default bench/results/<time>-<scenario>.json)")
+
+    c = sub.add_parser("compare", help="compare two result files")
+    c.add_argument("baseline")
+    c.add_argument("candidate")
+    c.add_argument("--threshold", type=float, default=10, help="percent change that counts as a regression")
+    c.add_argument("--min-ms", type=float, default=1, help="ignore latency changes smaller than this")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        if args.requests is not None:
+            args.warmup = 0
+        return run(args)
+    return compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
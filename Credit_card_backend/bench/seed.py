@@ -0,0 +1,201 @@
+"""Fill a local database with synthetic merchants, customers, cards and transactions.
+
+Data goes through the app's own encryption (per-merchant data keys), so
+reads in a benchmark pay the same decrypt cost as production. Ids are
+assigned explicitly and the RNG is seeded, so two runs with the same
+arguments against an empty database produce the same rows.
+
+Merchant users share their id with their merchant row and customer users
+with their customer row, as the app expects. All bench users get the
+same password.
+
+    python -m bench.seed --merchants 20 --customers 200 --cards 2 --transactions 5 --reset
+
+A manifest with the logins and each merchant's customer and card id
+ranges is written for bench/run.py.
+Restart the app after --reset so no worker keeps cached data keys.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from config import DB_CONFIG, DB_ENGINE
+from auth import hash_password
+from models.migrations import connect, migrate
+from utils.crypto import encrypt_field, blind_index
+from utils.keystore import get_merchant_key
+from utils.list_cache import bump
+from utils import rollups
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MANIFEST = os.path.join(BENCH_DIR, "manifest.json")
+DEFAULT_PASSWORD = "bench-pass-123"
+RESET_TABLES = ("transactions", "card_vault", "customers", "merchants", "data_keys",
+                "idempotency_keys", "audit_logs", "change_events", "txn_rollups", "users")
+
+FIRST_NAMES = ("Ada", "Alan", "Grace", "Linus", "Barbara", "Ken", "Margaret", "Dennis", "Frances", "Edsger")
+LAST_NAMES = ("Lovelace", "Turing", "Hopper", "Torvalds", "Liskov", "Thompson", "Hamilton", "Ritchie", "Allen")
+
+USER_SQL = """
+    INSERT INTO users (user_id, username, email, password_hash, user_role, status)
+    VALUES (%s, %s, %s, %s, %s, 'Active')"""
+MERCHANT_SQL = "INSERT INTO merchants (merchant_id, merchant_name, contact_email, status) VALUES (%s, %s, %s, 'Active')"
+CUSTOMER_SQL = """
+    INSERT INTO customers (customer_id, merchant_id, first_name, last_name, email_enc, phone_enc, status, email_bidx)
+    VALUES (%s, %s, %s, %s, %s, %s, 'Active', %s)"""
+CARD_SQL = """
+    INSERT INTO card_vault (card_id, customer_id, card_number_enc, card_holder_enc, expiry_date_enc, cvv_enc,
+                            last_four_digits, status, is_default, card_number_bidx)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, 'Active', %s, %s)"""
+TRANSACTION_SQL = "INSERT INTO transactions (card_id, amount, currency, status, created_at) VALUES (%s, %s, %s, %s, %s)"
+
+
+def _next_id(cur, table, pk):
+    cur.execute(f"SELECT COALESCE(MAX({pk}), 0) FROM {table}")
+    return cur.fetchone()[0] + 1
+
+
+def reset(conn, cur):
+    cur.execute("SET FOREIGN_KEY_CHECKS = 0")
+    for table in RESET_TABLES:
+        cur.execute(f"TRUNCATE TABLE {table}")
+    cur.execute("SET FOREIGN_KEY_CHECKS = 1")
+    conn.commit()
+
+
+def _ensure_admin(conn, cur, password_hash):
+    cur.execute("SELECT user_id FROM users WHERE username = 'bench_admin'")
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    cur.execute(USER_SQL, (None, "bench_admin", "bench_admin@bench.local", password_hash, "admin"))
+    conn.commit()
+    return cur.lastrowid
+
+
+def seed(conn, cur, args):
+    rng = random.Random(args.seed)
+    password_hash = hash_password(args.password)
+    admin_id = _ensure_admin(conn, cur, password_hash)
+
+    # Users, merchants and customers share one id sequence (see module docstring)
+    next_id = max(_next_id(cur, "users", "user_id"), _next_id(cur, "merchants", "merchant_id"),
+                  _next_id(cur, "customers", "customer_id"))
+    next_card = _next_id(cur, "card_vault", "card_id")
+    now = datetime.now().replace(microsecond=0)
+    counts = {"merchants": 0, "customers": 0, "cards": 0, "transactions": 0}
+    merchants = []
+
+    for m in range(args.merchants):
+        merchant_id = next_id
+        next_id += 1
+        username = f"bench_m{merchant_id}"
+        # The data key is committed on its own connection, so create it before this transaction starts
+        key_id, key = get_merchant_key(cur, merchant_id)
+        cur.execute(USER_SQL, (merchant_id, username, f"{username}@bench.local", password_hash, "merchant"))
+        cur.execute(MERCHANT_SQL, (merchant_id, f"Bench Merchant {m + 1}", f"{username}@bench.local"))
+        merchant_card = next_card
+
+        users, customers, cards, transactions = [], [], [], []
+        for _ in range(args.customers):
+            customer_id = next_id
+            next_id += 1
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            email = f"bench_c{customer_id}@bench.local"
+            users.append((customer_id, f"bench_c{customer_id}", email, password_hash, "customer"))
+            customers.append((customer_id, merchant_id, first, last, encrypt_field(email, key, key_id),
+                              encrypt_field(f"+1555{rng.randrange(10 ** 7):07d}", key, key_id),
+                              blind_index("email", email)))
+            for c in range(args.cards):
+                card_id = next_card
+                next_card += 1
+                number = "4" + "".join(str(rng.randrange(10)) for _ in range(15))
+                exp = f"{rng.randint(1, 12):02d}/{rng.randint(27, 32)}"
+                cards.append((card_id, customer_id, encrypt_field(number, key, key_id),
+                              encrypt_field(f"{first} {last}", key, key_id), encrypt_field(exp, key, key_id),
+                              encrypt_field(f"{rng.randrange(1000):03d}", key, key_id), number[-4:], int(c == 0),
+                              blind_index("card_number", number)))
+                for _ in range(args.transactions):
+                    created = now - timedelta(seconds=rng.randrange(args.days * 86400))
+                    status = "success" if rng.random() > 0.05 else "declined"
+                    transactions.append((card_id, f"{rng.uniform(1, 500):.2f}", "USD", status, created))
+
+        # One transaction per merchant; mysql.connector turns each executemany into multi-row INSERTs
+        for sql, rows in ((USER_SQL, users), (CUSTOMER_SQL, customers), (CARD_SQL, cards)):
+            if rows:
+                cur.executemany(sql, rows)
+        for i in range(0, len(transactions), args.batch_size):
+            cur.executemany(TRANSACTION_SQL, transactions[i:i + args.batch_size])
+        rollups.apply(cur, ((merchant_id, card_id, created, currency, status, amount)
+                            for card_id, amount, currency, status, created in transactions))
+        conn.commit()
+
+        merchants.append({"merchant_id": merchant_id, "username": username,
+                          "customer_ids": [merchant_id + 1, next_id - 1] if customers else None,
+                          "card_ids": [merchant_card, next_card - 1] if cards else None})
+        counts["merchants"] += 1
+        counts["customers"] += len(customers)
+        counts["cards"] += len(cards)
+        counts["transactions"] += len(transactions)
+        if (m + 1) % 10 == 0 or m + 1 == args.merchants:
+            print(f"[SEED] {m + 1}/{args.merchants} merchants, {counts['cards']} cards, "
+                  f"{counts['transactions']} transactions")
+
+    return {
+        "seed": args.seed,
+        "password": args.password,
+        "admin": {"user_id": admin_id, "username": "bench_admin"},
+        "merchants": merchants,
+        "counts": counts,
+        "created_at": now.isoformat(),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Seed a benchmark database with synthetic vault data")
+    parser.add_argument("--merchants", type=int, default=10)
+    parser.add_argument("--customers", type=int, default=100, help="customers per merchant")
+    parser.add_argument("--cards", type=int, default=2, help="cards per customer")
+    parser.add_argument("--transactions", type=int, default=5, help="transactions per card")
+    parser.add_argument("--days", type=int, default=90, help="spread transactions over this many days")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="password for every bench user")
+    parser.add_argument("--batch-size", type=int, default=5000, help="transactions per INSERT batch")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST, help="where to write logins and id ranges")
+    parser.add_argument("--reset", action="store_true", help=f"truncate {', '.join(RESET_TABLES)} first")
+    parser.add_argument("--force", action="store_true",
+                        help="allow --reset on a database whose name does not contain 'bench'")
+    args = parser.parse_args(argv)
+
+    database = DB_CONFIG.get("database") or ""
+    if args.reset and DB_ENGINE == "mysql" and "bench" not in database and not args.force:
+        print(f"[SEED] refusing to truncate '{database}'; use a *bench* database or pass --force")
+        return 2
+
+    conn = connect()
+    cur = conn.cursor(buffered=True)
+    started = time.time()
+    try:
+        migrate(conn)
+        if args.reset:
+            reset(conn, cur)
+            print(f"[SEED] truncated {', '.join(RESET_TABLES)}")
+        manifest = seed(conn, cur, args)
+        # Running app workers on this host drop their cached list responses
+        bump("merchants", "customers", "card_vault")
+    finally:
+        cur.close()
+        conn.close()
+
+    manifest["seconds"] = round(time.time() - started, 2)
+    with open(args.manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"[SEED] done in {manifest['seconds']}s: {manifest['counts']} -> {args.manifest}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,48 @@
+"""Load cards from a CSV or NDJSON file straight into card_vault.
+
+Uses the same parsing, validation and batched inserts as POST /card/bulk_store.
+
+    python bulk_ingest.py cards.csv --actor-user-id 1 --batch-size 2000
+"""
+import argparse
+import json
+import sys
+import time
+from db import get_pool
+from utils.ingest import FORMATS, read_records, ingest_cards
+from config import BULK_BATCH_SIZE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load cards into the vault")
+    parser.add_argument("path", help="CSV or NDJSON file, or - for stdin")
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument("--actor-user-id", type=int, required=True, help="user recorded in the audit log")
+    args = parser.parse_args()
+
+    fmt = args.format or ('csv' if args.path.lower().endswith('.csv') else 'ndjson')
+    stream = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+
+    pool = get_pool()
+    conn = pool.acquire()
+    cur = conn.cursor(buffered=True)
+    started = time.time()
+    try:
+        report = ingest_cards(conn, cur, read_records(stream, fmt), args.actor_user_id, args.batch_size)
+    finally:
+        cur.close()
+        pool.release(conn)
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+    elapsed = time.time() - started
+    result = report.as_dict()
+    result["seconds"] = round(elapsed, 2)
+    result["rows_per_sec"] = round(report.rows / elapsed) if elapsed else None
+    print(json.dumps(result, indent=2))
+    return 0 if not report.failed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
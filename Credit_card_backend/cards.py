@@ -1,11 +1,39 @@
 from flask import Blueprint, request, session, jsonify
-from db import get_db
-from utils.decorators import require_role
+from db import get_db, shard_db
+from utils.decorators import require_role, read_only
 from utils.logger import audit_log
-from config import AES_KEY
+from utils.validation import card_error
+from utils.ingest import FORMATS, read_records, ingest_cards
+from config import BULK_BATCH_SIZE
+from utils.crypto import encrypt_field, blind_index
+from utils.keystore import get_merchant_key, decrypt_records
+from utils.streaming import page_args, stream_shards, stream_response
+from utils.projection import requested_secrets, secret_columns
+from utils.list_cache import conditional_list, bump
+from utils import outbox, shards
 
 cards_bp = Blueprint('cards', __name__)
 
+# Encrypted fields /card/list returns on request (see utils.projection)
+CARD_LIST_SECRETS = {'card_number': 'card_number_enc', 'expiry_date': 'expiry_date_enc'}
+# With shards, /card/list also reads each card's merchant for the ownership filter (utils/shards.py)
+CARD_OWNER_COLUMN = (", (SELECT c.merchant_id FROM customers c WHERE c.customer_id = card_vault.customer_id) "
+                     "AS owner_merchant_id")
+
+
+def _card_key(row):
+    return row['card_id']
+
+
+def _card_owner(row):
+    return row['owner_merchant_id']
+
+
+def _without_owner(cards):
+    for card in cards:
+        card.pop('owner_merchant_id', None)
+        yield card
+
 # -------------------------------
 # Store a card
 # -------------------------------
@@ -25,29 +53,52 @@ def store_card():
             return jsonify({"error": "Forbidden"}), 403
         
         # Basic validation
-        if not str(d['card']).isdigit() or len(str(d['card'])) < 13 or len(str(d['card'])) > 19:
-            return jsonify({"error": "Invalid card number"}), 400
-        if not str(d['cvv']).isdigit() or len(str(d['cvv'])) < 3 or len(str(d['cvv'])) > 4:
-            return jsonify({"error": "Invalid CVV"}), 400
+        error = card_error(d['card'], d['cvv'])
+        if error:
+            return jsonify({"error": error}), 400
 
         db, cur = get_db()
         
         # FIX: Check 'users' table instead of 'customers' table
         # The login returns user_id, so we must validate against that.
-        cur.execute("SELECT user_id FROM users WHERE user_id = %s", (d['customer_id'],))
-        if not cur.fetchone():
+        # The customers row (if any) tells us whose data key encrypts the card.
+        cur.execute(
+            "SELECT u.user_id, c.merchant_id FROM users u LEFT JOIN customers c ON c.customer_id = u.user_id WHERE u.user_id = %s",
+            (d['customer_id'],)
+        )
+        user = cur.fetchone()
+        if not user:
             return jsonify({"error": "User not found"}), 404
+        merchant_id = user[1]
+        if merchant_id is None and shards.enabled():
+            # The customers row is on the merchant's shard
+            merchant_id = shards.locate(shards.CUSTOMER_SQL, (d['customer_id'],)).get(int(d['customer_id']), (None,))[0]
+        db, cur = get_db(merchant_id)
+
+        # Duplicate check through the blind index, without decrypting the customer's cards
+        card_bidx = blind_index('card_number', d['card'])
+        cur.execute(
+            "SELECT card_id FROM card_vault WHERE card_number_bidx = %s AND customer_id = %s AND status = 'Active' LIMIT 1",
+            (card_bidx, d['customer_id'])
+        )
+        existing = cur.fetchone()
+        if existing:
+            return jsonify({"error": "Card already stored", "card_id": existing[0]}), 409
+        key_id, key = get_merchant_key(shards.key_cursor(), merchant_id)
         
         # Store encrypted card details
         # Added 'is_default' = 0 to fix the "Field 'is_default' doesn't have a default value" error
         cur.execute(
             """
-            INSERT INTO card_vault (customer_id, card_number_enc, card_holder_enc, expiry_date_enc, cvv_enc, last_four_digits, status, is_default)
-            VALUES (%s, AES_ENCRYPT(%s,%s), AES_ENCRYPT(%s,%s), AES_ENCRYPT(%s,%s), AES_ENCRYPT(%s,%s), %s, 'Active', 0)
+            INSERT INTO card_vault (customer_id, card_number_enc, card_holder_enc, expiry_date_enc, cvv_enc, last_four_digits, status, is_default, card_number_bidx)
+            VALUES (%s, %s, %s, %s, %s, %s, 'Active', 0, %s)
             """,
-            (d['customer_id'], d['card'], AES_KEY, d.get('cardholderName','Card'), AES_KEY, d['exp'], AES_KEY, d['cvv'], AES_KEY, str(d['card'])[-4:])
+            (d['customer_id'], encrypt_field(d['card'], key, key_id), encrypt_field(d.get('cardholderName','Card'), key, key_id),
+             encrypt_field(d['exp'], key, key_id), encrypt_field(d['cvv'], key, key_id), str(d['card'])[-4:], card_bidx)
         )
+        outbox.record(cur, outbox.CARD_STORED, cur.lastrowid, merchant_id=merchant_id, customer_id=d['customer_id'])
         db.commit()
+        bump('card_vault')
         
         # FIX: Changed "STORE_CARD" to "INSERT" to avoid "Data truncated" error if DB column is small or ENUM
         try:
@@ -57,57 +108,156 @@ def store_card():
 
         return jsonify({"message": "Card stored successfully"}), 201
 
+    except shards.ShardMoving:
+        raise
     except Exception as e:
         print(f"Error storing card: {e}") # Added server-side logging
         return jsonify({"error": str(e)}), 500
 
+# -------------------------------
+# Deactivate a card
+# -------------------------------
+@cards_bp.post('/card/<int:card_id>/deactivate')
+@require_role('admin','merchant','customer')
+def deactivate_card(card_id):
+    """Mark a card Inactive. Merchants can only touch their customers' cards, customers their own."""
+    try:
+        owner = shards.locate(shards.CARD_SQL, (card_id,)).get(card_id) if shards.enabled() else None
+        db, cur = get_db(owner[0] if owner else None)
+        cur.execute(
+            "SELECT cv.customer_id, c.merchant_id, cv.status FROM card_vault cv "
+            "LEFT JOIN customers c ON c.customer_id = cv.customer_id WHERE cv.card_id = %s FOR UPDATE",
+            (card_id,)
+        )
+        card = cur.fetchone()
+        if not card:
+            db.rollback()
+            return jsonify({"error": "Card not found"}), 404
+        customer_id, merchant_id, status = card
+        role, user_id = session.get('user_role'), session.get('user_id')
+        if (role == 'customer' and customer_id != user_id) or (role == 'merchant' and merchant_id != user_id):
+            db.rollback()
+            return jsonify({"error": "Forbidden"}), 403
+        if status != 'Active':
+            db.rollback()
+            return jsonify({"message": "Card is already inactive", "card_id": card_id}), 200
+
+        cur.execute("UPDATE card_vault SET status = 'Inactive' WHERE card_id = %s", (card_id,))
+        outbox.record(cur, outbox.CARD_DEACTIVATED, card_id, merchant_id=merchant_id, customer_id=customer_id)
+        db.commit()
+        bump('card_vault')
+        # The card is already deactivated; a failed audit write must not turn that into a 500
+        try:
+            audit_log(user_id, "UPDATE", "card_vault", old_value="Active", new_value="Inactive", record_id=card_id)
+        except Exception as e:
+            print(f"Audit log failed (non-fatal): {e}")
+        return jsonify({"message": "Card deactivated", "card_id": card_id}), 200
+    except shards.ShardMoving:
+        raise
+    except Exception as e:
+        print(f"Error deactivating card: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# -------------------------------
+# Bulk store cards (CSV / NDJSON upload)
+# -------------------------------
+@cards_bp.post('/card/bulk_store')
+@require_role('admin','merchant')
+def bulk_store_cards():
+    """Stream-parse an upload of cards and insert them in batches.
+
+    Body is CSV (header: customer_id,card,exp,cvv[,cardholderName]) or one JSON
+    object per line; pick with ?format=csv|ndjson or the Content-Type.
+    Returns counts plus a per-row error report.
+    """
+    fmt = request.args.get('format')
+    if not fmt:
+        content_type = request.mimetype or ''
+        fmt = 'csv' if content_type in ('text/csv', 'application/csv') else 'ndjson'
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(FORMATS)}"}), 400
+    batch_size = request.args.get('batch_size', str(BULK_BATCH_SIZE))
+    if not batch_size.isdigit() or int(batch_size) < 1:
+        return jsonify({"error": "batch_size must be a positive integer"}), 400
+
+    try:
+        db, cur = get_db()
+        report = ingest_cards(db, cur, read_records(request.stream, fmt), session['user_id'], int(batch_size))
+        return jsonify(report.as_dict()), 200 if not report.failed else 207
+    except Exception as e:
+        print(f"Error in bulk card store: {e}")
+        return jsonify({"error": str(e)}), 500
+
 # -------------------------------
 # List cards
 # -------------------------------
 @cards_bp.get('/card/list')
 @require_role('admin','merchant','customer')
+@read_only
+@conditional_list('card_vault')
 def list_cards():
     try:
-        db, cur = get_db()
-        
         # We handle both 'role' and 'user_role' session keys just in case
         role = session.get('role') or session.get('user_role')
         user_id = session.get('user_id')
 
+        # Masked by default: only ?fields= / ?view=full pull ciphertext and pay for decryption
+        try:
+            fields = requested_secrets(CARD_LIST_SECRETS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        columns = "card_id, customer_id, last_four_digits, status" + secret_columns(CARD_LIST_SECRETS, fields)
+
         if role == 'customer':
             # Only list the logged-in customer's cards
+            db, cur = shard_db(shards.customer_shard(user_id))
             cur.execute(
-                """
-                SELECT card_id, customer_id, AES_DECRYPT(card_number_enc, %s) AS card_number, 
-                       AES_DECRYPT(expiry_date_enc, %s) AS expiry_date 
+                f"""
+                SELECT {columns}
                 FROM card_vault 
                 WHERE customer_id=%s AND status='Active'
                 """,
-                (AES_KEY, AES_KEY, user_id)
+                (user_id,)
             )
+            rows = cur.fetchall()
+            cards = [dict(zip([desc[0] for desc in cur.description], r)) for r in rows]
+            limit = None
         else:
-            # Admin/merchant can list all cards
-            cur.execute(
+            # Admin/merchant can list all cards: keyset pages on card_id (?limit=&after=)
+            # or a row-by-row stream (?stream=ndjson|json)
+            try:
+                limit, after, stream = page_args()
+                after = int(after or 0)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            if shards.enabled():
+                columns += CARD_OWNER_COLUMN
+            sql = f"""
+                SELECT {columns}
+                FROM card_vault WHERE status='Active' AND card_id > %s
+                ORDER BY card_id
                 """
-                SELECT card_id, customer_id, AES_DECRYPT(card_number_enc, %s) AS card_number, 
-                       AES_DECRYPT(expiry_date_enc, %s) AS expiry_date 
-                FROM card_vault WHERE status='Active'
-                """,
-                (AES_KEY, AES_KEY)
-            )
+            params = (after,)
+            if limit:
+                sql += " LIMIT %s"
+                params += (limit,)
+            if stream:
+                cards = stream_shards(sql, params, fields, _card_key, _card_owner)
+                return stream_response(_without_owner(cards) if shards.enabled() else cards, 'cards', stream)
+
+            def page(shard, cur):
+                cur.execute(sql, params)
+                return [dict(zip([desc[0] for desc in cur.description], r)) for r in cur.fetchall()]
 
-        rows = cur.fetchall()
-        cards = [dict(zip([desc[0] for desc in cur.description], r)) for r in rows]
+            cards, next_after = shards.merge_page(shards.fan_out(page), _card_key, limit, _card_owner)
+            cards = list(_without_owner(cards))
 
-        # Decode binary fields
-        for c in cards:
-            for k, v in list(c.items()):
-                if isinstance(v, (bytes, bytearray)):
-                    try:
-                        c[k] = v.decode('utf-8')
-                    except Exception:
-                        c[k] = v.hex()
+        # Decrypt in the app tier (with each row's data key) and decode any other binary fields
+        if fields:
+            decrypt_records(shards.key_cursor(), cards, fields)
 
+        if limit:
+            return jsonify({'cards': cards, 'next_after': next_after}), 200
         return jsonify({'cards': cards}), 200
 
     except Exception as e:
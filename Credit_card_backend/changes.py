@@ -0,0 +1,120 @@
+from datetime import datetime
+from flask import Blueprint, request, session, jsonify
+from config import MAX_PAGE_SIZE
+from utils.decorators import require_role, read_only
+from utils.keystore import decrypt_records
+from utils.projection import requested_secrets, secret_columns
+from utils import outbox, shards
+
+changes_bp = Blueprint('changes', __name__)
+
+DEFAULT_LIMIT = 100
+# Encrypted fields /changes returns on request (see utils.projection); CVVs never leave through the feed
+CHANGE_SECRETS = {'card_number': 'card_number_enc', 'expiry_date': 'expiry_date_enc',
+                  'email': 'email_enc', 'phone': 'phone_enc'}
+# entity type -> (snapshot query without its WHERE, primary key, encrypted fields it can carry)
+SNAPSHOTS = {
+    'card': ("SELECT card_id, customer_id, last_four_digits, status{secrets} FROM card_vault",
+             'card_id', ('card_number', 'expiry_date')),
+    'customer': ("SELECT customer_id, merchant_id, first_name AS firstname, last_name AS lastname, status{secrets} "
+                 "FROM customers", 'customer_id', ('email', 'phone')),
+    'merchant': ("SELECT merchant_id, merchant_name AS business_name, contact_email, status FROM merchants",
+                 'merchant_id', ()),
+}
+
+
+def _snapshots(cur, events, fields):
+    """Current state of every entity the events mention: one query per entity type, secrets still encrypted."""
+    found = {}
+    for entity_type, (sql, pk, secrets) in SNAPSHOTS.items():
+        ids = sorted({e['entity_id'] for e in events if e['entity_type'] == entity_type})
+        if not ids:
+            continue
+        wanted = [f for f in secrets if f in fields]
+        cur.execute(sql.format(secrets=secret_columns(CHANGE_SECRETS, wanted)) +
+                    f" WHERE {pk} IN ({','.join(['%s'] * len(ids))})", tuple(ids))
+        columns = [desc[0] for desc in cur.description]
+        found.update(((entity_type, r[pk]), r) for r in (dict(zip(columns, row)) for row in cur.fetchall()))
+    return found
+
+
+def _decrypt_snapshots(snapshots, fields):
+    """Decrypt (entity_type, row) snapshots from every shard; data keys live on main."""
+    for entity_type, (_, _, secrets) in SNAPSHOTS.items():
+        wanted = [f for f in secrets if f in fields]
+        if wanted:
+            decrypt_records(shards.key_cursor(), [r for t, r in snapshots if t == entity_type], wanted)
+
+
+def _parse_since(since):
+    """?since= as {shard: event_id}: a bare event id is main's, "main:12,s2:40" names each shard."""
+    if since.isdigit():
+        return {shards.MAIN: int(since)}
+    positions = {}
+    for part in since.split(','):
+        shard, _, event_id = part.partition(':')
+        if shard not in shards.names() or not event_id.isdigit():
+            raise ValueError("since must be an event id or a list of <shard>:<event_id>")
+        positions[shard] = int(event_id)
+    return positions
+
+
+@changes_bp.get('/changes')
+@require_role('admin', 'merchant', 'customer')
+@read_only
+def list_changes():
+    """Vault changes after ?since=<event_id>, oldest first, for incremental sync.
+
+    Each event carries the entity's current state, masked unless ?fields= or
+    ?view=full asks for more. Merchants see their own merchant, customers
+    and cards; customers see their own cards. Pass next_since back as
+    ?since= on the next poll; it only moves past events that are committed.
+    With merchant shards every shard has its own outbox: events carry their
+    shard, event ids are per shard and next_since holds one position per
+    shard ("main:12,s2:40").
+    """
+    limit = request.args.get('limit', str(DEFAULT_LIMIT))
+    try:
+        since = _parse_since(request.args.get('since', '0'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not limit.isdigit() or int(limit) < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    try:
+        fields = requested_secrets(CHANGE_SECRETS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    role, user_id = session.get('user_role'), session.get('user_id')
+    scope = {'merchant_id': user_id} if role == 'merchant' else {'customer_id': user_id} if role == 'customer' else {}
+
+    limit = min(int(limit), MAX_PAGE_SIZE)
+
+    def read(shard, cur):
+        events, next_since = outbox.fetch(cur, since.get(shard, 0), limit, **scope)
+        return events, next_since, _snapshots(cur, events, fields)
+
+    pages = shards.fan_out(read)
+    snapshots = {}
+    for shard, (_, _, found) in pages.items():
+        snapshots.update(((shard,) + key, r) for key, r in found.items())
+    _decrypt_snapshots([(key[1], r) for key, r in snapshots.items()], fields)
+    changes = []
+    for shard, (events, _, _) in pages.items():
+        for e in events:
+            created_at = e['created_at']
+            change = {
+                'event_id': e['event_id'], 'type': e['event_type'], 'entity': e['entity_type'],
+                'entity_id': e['entity_id'], 'merchant_id': e['merchant_id'], 'customer_id': e['customer_id'],
+                'created_at': created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+                'data': snapshots.get((shard, e['entity_type'], e['entity_id'])),
+            }
+            if shards.enabled():
+                change['shard'] = shard
+            changes.append(change)
+    has_more = any(len(events) == limit for events, _, _ in pages.values())
+    if not shards.enabled():
+        return jsonify({'changes': changes, 'next_since': pages[shards.MAIN][1], 'has_more': has_more})
+    changes.sort(key=lambda c: c['created_at'])
+    next_since = ','.join(f"{shard}:{next_since}" for shard, (_, next_since, _) in pages.items())
+    return jsonify({'changes': changes, 'next_since': next_since, 'has_more': has_more})
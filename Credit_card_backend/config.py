@@ -1,4 +1,6 @@
+import json
 import os
+import tempfile
 from dotenv import load_dotenv
 from urllib.parse import urlparse
 
@@ -36,6 +38,41 @@ DB_CONFIG = {
 if DB_SSL_CA:
     DB_CONFIG['ssl_ca'] = DB_SSL_CA
 
+# Optional read replica for views marked @read_only (utils/replica.py). Set DATABASE_READ_URL,
+# or DB_READ_HOST / DB_READ_PORT; user, password and database default to the primary's.
+database_read_url = os.getenv('DATABASE_READ_URL')
+if database_read_url:
+    parsed = urlparse(database_read_url)
+    DB_READ_CONFIG = dict(DB_CONFIG, host=parsed.hostname, port=parsed.port or DB_PORT,
+                          user=parsed.username or DB_USER, password=parsed.password or DB_PASS,
+                          database=parsed.path.lstrip('/') or DB_NAME)
+elif os.getenv('DB_READ_HOST'):
+    DB_READ_CONFIG = dict(DB_CONFIG, host=os.getenv('DB_READ_HOST'), port=int(os.getenv('DB_READ_PORT', DB_PORT)),
+                          user=os.getenv('DB_READ_USER', DB_USER), password=os.getenv('DB_READ_PASS', DB_PASS),
+                          database=os.getenv('DB_READ_NAME', DB_NAME))
+else:
+    DB_READ_CONFIG = None
+
+# Merchant shards (utils/shards.py): JSON object of shard name -> database URL, e.g.
+# DB_SHARDS='{"s2": "mysql://vault:pw@10.0.0.12:3306/credit_card_vault"}', or sqlite:///path with DB_ENGINE=sqlite.
+# The primary is always shard "main"; merchants without a merchant_shards row live there.
+DB_SHARDS = {}
+for name, url in json.loads(os.getenv('DB_SHARDS') or '{}').items():
+    if name == 'main':
+        raise ValueError("DB_SHARDS must not redefine the 'main' shard (the primary)")
+    if url.startswith('sqlite:///'):
+        DB_SHARDS[name] = {'path': url[len('sqlite:///'):]}
+        continue
+    parsed = urlparse(url)
+    DB_SHARDS[name] = dict(DB_CONFIG, host=parsed.hostname, port=parsed.port or DB_PORT,
+                           user=parsed.username or DB_USER, password=parsed.password or DB_PASS,
+                           database=parsed.path.lstrip('/') or DB_NAME)
+
+# Storage engine: 'mysql', or 'sqlite' to run the whole app without a DB server (utils/sqlite_engine.py)
+DB_ENGINE = os.getenv('DB_ENGINE', 'mysql').lower()
+# ':memory:' or a file path; put the file on /dev/shm for a RAM-backed DB shared by several workers
+SQLITE_PATH = os.getenv('SQLITE_PATH', ':memory:')
+
 # Debug-friendly non-secret info (printed by app when starting)
 SAFE_DB_INFO = {
     'host': DB_HOST,
@@ -43,6 +80,138 @@ SAFE_DB_INFO = {
     'database': DB_NAME,
     'user': DB_USER
 }
+if DB_READ_CONFIG:
+    SAFE_DB_INFO['replica'] = f"{DB_READ_CONFIG['host']}:{DB_READ_CONFIG['port']}"
+if DB_ENGINE == 'sqlite':
+    SAFE_DB_INFO = {'engine': 'sqlite', 'path': SQLITE_PATH}
 
 AES_KEY = os.getenv("AES_KEY", "2864bcef5d960f9248b5775473bdada01e845114c0bf31c409199c753cb9e57e")
-SECRET_KEY = os.getenv("FLASK_SECRET", os.getenv('SECRET_KEY', "a792e2e9ea07d4c87f30f34dffc997b5"))
\ No newline at end of file
+# HMAC key for the searchable blind-index columns; derived from AES_KEY when unset.
+# Changing it requires `python backfill_blind_index.py --all`.
+BLIND_INDEX_KEY = os.getenv("BLIND_INDEX_KEY")
+SECRET_KEY = os.getenv("FLASK_SECRET", os.getenv('SECRET_KEY', "a792e2e9ea07d4c87f30f34dffc997b5"))
+
+# Connection pool settings (per worker process)
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+# Seconds a request waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+# Connections older than this are closed and replaced on checkout (0 disables)
+DB_POOL_MAX_LIFETIME = int(os.getenv('DB_POOL_MAX_LIFETIME', 1800))
+# Ping a connection on checkout if it has been idle for longer than this (seconds)
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_POOL_PING_INTERVAL = float(os.getenv('DB_POOL_PING_INTERVAL', 30))
+# Issue COM_RESET_CONNECTION when a connection is returned (clears session vars/temp tables)
+DB_POOL_RESET_SESSION = os.getenv('DB_POOL_RESET_SESSION', 'false').lower() in ('1', 'true', 'yes')
+
+# Read replica routing (utils/replica.py); ignored unless DB_READ_CONFIG is set and DB_ENGINE is mysql
+DB_READ_POOL_MAX = int(os.getenv('DB_READ_POOL_MAX', DB_POOL_MAX))
+# Reads go back to the primary while the replica is further behind than this (seconds)
+DB_READ_MAX_LAG = float(os.getenv('DB_READ_MAX_LAG', 5))
+# How often each worker re-measures replica lag (seconds)
+DB_READ_LAG_CHECK_INTERVAL = float(os.getenv('DB_READ_LAG_CHECK_INTERVAL', 1))
+
+# Merchant shards (utils/shards.py, shard_admin.py)
+# Shard that new merchants are placed on
+SHARD_FOR_NEW_MERCHANTS = os.getenv('SHARD_FOR_NEW_MERCHANTS', 'main')
+# Seconds a worker trusts its cached merchant -> shard entries; shard_admin.py move waits this out
+SHARD_MAP_TTL = float(os.getenv('SHARD_MAP_TTL', 5))
+SHARD_MAP_CACHE_SIZE = int(os.getenv('SHARD_MAP_CACHE_SIZE', 10000))
+# Threads per worker that query shards in parallel for the cross-merchant views
+SHARD_FAN_OUT_WORKERS = int(os.getenv('SHARD_FAN_OUT_WORKERS', 8))
+
+# Application-side field encryption (utils/crypto.py)
+CRYPTO_WORKERS = int(os.getenv('CRYPTO_WORKERS', min(4, os.cpu_count() or 1)))
+# Below this many fields per result set, decrypt inline instead of using the thread pool
+CRYPTO_PARALLEL_MIN = int(os.getenv('CRYPTO_PARALLEL_MIN', 256))
+
+# Cache of unwrapped per-merchant data keys (utils/keystore.py)
+DEK_CACHE_SIZE = int(os.getenv('DEK_CACHE_SIZE', 1024))
+DEK_CACHE_TTL = int(os.getenv('DEK_CACHE_TTL', 300))
+
+# Keyset pagination / streaming for large list endpoints (utils/streaming.py)
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 500))
+
+# ETags and cached bodies for polled list endpoints (utils/list_cache.py). The write counters below are local
+# to one host, so with app instances on several hosts a write on one would not invalidate the others' ETags
+# and bodies for up to LIST_CACHE_TTL. Off unless set; the Dockerfile, which runs the database and every
+# worker in one container, turns it on. Turn it on only where every instance runs on one host.
+LIST_CACHE_ENABLED = os.getenv('LIST_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+LIST_CACHE_SIZE = int(os.getenv('LIST_CACHE_SIZE', 256))
+# Upper bound on staleness for writes made outside the app; also the lifetime of a cached body
+LIST_CACHE_TTL = int(os.getenv('LIST_CACHE_TTL', 300))
+# Larger bodies get an ETag but are not kept in memory (bytes)
+LIST_CACHE_MAX_BODY = int(os.getenv('LIST_CACHE_MAX_BODY', 1024 * 1024))
+# Per-table write counters shared by all workers on the host; /dev/shm is a good place for it
+TABLE_VERSIONS_PATH = os.getenv('TABLE_VERSIONS_PATH', os.path.join(tempfile.gettempdir(), 'vault-table-versions'))
+
+# Change feed (/changes, utils/outbox.py)
+# An unfilled gap in event ids younger than this (seconds) is treated as a transaction still in flight
+CHANGES_GAP_WAIT = float(os.getenv('CHANGES_GAP_WAIT', 5))
+# Events examined per request when looking for such gaps
+CHANGES_SCAN_MAX = int(os.getenv('CHANGES_SCAN_MAX', 10000))
+
+# Audit log pipeline (utils/logger.py)
+AUDIT_ASYNC = os.getenv('AUDIT_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', 10000))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 200))
+# Flush at least this often (seconds) even if the batch is not full
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 1.0))
+# What to do when the queue is full: block (up to AUDIT_BLOCK_TIMEOUT, then spool), spool or drop
+AUDIT_QUEUE_FULL = os.getenv('AUDIT_QUEUE_FULL', 'block')
+AUDIT_BLOCK_TIMEOUT = float(os.getenv('AUDIT_BLOCK_TIMEOUT', 0.5))
+# Events that cannot be written to the DB are appended here and replayed later
+AUDIT_SPOOL_DIR = os.getenv('AUDIT_SPOOL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audit_spool'))
+
+# Audit retention (archive_audit.py, utils/audit_archive.py)
+# Months kept in audit_logs, counting the current one; older months go to segment files
+AUDIT_HOT_MONTHS = int(os.getenv('AUDIT_HOT_MONTHS', 3))
+# Monthly partitions created ahead of the clock (run `archive_audit.py partitions` from cron)
+AUDIT_PARTITIONS_AHEAD = int(os.getenv('AUDIT_PARTITIONS_AHEAD', 3))
+AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audit_archive'))
+
+# Bulk card ingestion (/card/bulk_store and bulk_ingest.py)
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', 1000))
+BULK_MAX_ERRORS = int(os.getenv('BULK_MAX_ERRORS', 1000))
+
+# Batch charges and idempotency keys (transactions.py, utils/idempotency.py)
+CHARGE_BATCH_MAX = int(os.getenv('CHARGE_BATCH_MAX', 1000))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000))
+IDEMPOTENCY_CACHE_TTL = int(os.getenv('IDEMPOTENCY_CACHE_TTL', 600))
+
+# /reports/transactions (reports.py, utils/rollups.py)
+# Widest report, in hour or day buckets; bounds the rows one report reads
+REPORT_MAX_BUCKETS = int(os.getenv('REPORT_MAX_BUCKETS', 750))
+# Range reported when ?since= is not given
+REPORT_DEFAULT_DAYS = int(os.getenv('REPORT_DEFAULT_DAYS', 30))
+
+# Request timing and /metrics (utils/metrics.py)
+SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', 'true').lower() in ('1', 'true', 'yes')
+# Shared directory where each gunicorn worker drops its counters so /metrics can add them up
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', 5))
+# /metrics is only served when this is set, and then requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Deprecated, removed in the next release: /login replies carry their old "timings" key and
+# X-Debug-Timings header. Server-Timing has the same numbers; turn this off once clients use it.
+LOGIN_DEBUG_TIMINGS = os.getenv('LOGIN_DEBUG_TIMINGS', 'true').lower() in ('1', 'true', 'yes')
+
+# Query instrumentation (utils/query_stats.py)
+# Statements slower than this are logged with their fingerprint and route
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+# Flag a request that runs the same statement more than this many times (likely N+1)
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 10))
+# Distinct fingerprints kept per worker; the least recently seen are dropped first
+QUERY_STATS_MAX = int(os.getenv('QUERY_STATS_MAX', 1000))
+
+# On-demand profiler (utils/profiler.py); nothing is hooked into requests unless enabled
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+# Oldest captures are deleted once there are more than this many
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 50))
+# Fraction of all requests to profile in the background (0 = only when armed via /admin/profile)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+# 'cprofile' writes .pstats files, 'stack' samples the worker thread and writes collapsed stacks
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'stack')
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 5))
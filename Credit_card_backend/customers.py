@@ -1,24 +1,45 @@
 from flask import Blueprint, request, session, jsonify
-from db import get_db
-from utils.decorators import require_role
+from db import get_db, shard_db
+from utils.decorators import require_role, read_only
 from utils.logger import audit_log
-from config import AES_KEY
+from utils.crypto import encrypt_field, blind_index
+from utils.keystore import get_merchant_key, decrypt_records
+from utils.projection import requested_secrets, secret_columns
+from utils.list_cache import conditional_list, bump
+from utils import outbox, shards
 
 customers_bp = Blueprint('customers', __name__)
 
+# Encrypted fields /customer/my_cards returns on request (see utils.projection)
+MY_CARDS_SECRETS = {'card_number': 'card_number_enc', 'expiry_date': 'expiry_date_enc', 'cvv': 'cvv_enc'}
+
+
+def _customer_key(row):
+    return row['customer_id']
+
+
+def _merchant_of(row):
+    return row['merchant_id']
+
+
 @customers_bp.post('/customer')
 @require_role('admin','merchant')
 def create_customer():
     data = request.json
-    db, cur = get_db()
+    db, cur = get_db(data['merchant_id'])
+    key_id, key = get_merchant_key(shards.key_cursor(), data['merchant_id'])
     cur.execute(
         """
-        INSERT INTO customers (merchant_id, first_name, last_name, email_enc, phone_enc)
-        VALUES (%s,%s,%s, AES_ENCRYPT(%s,%s), AES_ENCRYPT(%s,%s))
+        INSERT INTO customers (merchant_id, first_name, last_name, email_enc, phone_enc, email_bidx)
+        VALUES (%s,%s,%s,%s,%s,%s)
         """,
-        (data['merchant_id'], data['firstname'], data['lastname'], data['email'], AES_KEY, data['phone'], AES_KEY)
+        (data['merchant_id'], data['firstname'], data['lastname'],
+         encrypt_field(data['email'], key, key_id), encrypt_field(data['phone'], key, key_id),
+         blind_index('email', data['email']))
     )
+    outbox.record(cur, outbox.CUSTOMER_ADDED, cur.lastrowid, merchant_id=data['merchant_id'], customer_id=cur.lastrowid)
     db.commit()
+    bump('customers')
     audit_log(session['user_id'], "ADD_CUSTOMER", "customers")
     return {"message": "customer added"}
 
@@ -51,15 +72,19 @@ def store_customer_with_card():
         if not cvv.isdigit() or len(cvv) < 3 or len(cvv) > 4:
             return jsonify({"error": "Invalid CVV"}), 400
 
-        db, cur = get_db()
+        db, cur = get_db(d['merchant_id'])
+        # The merchant's data key encrypts both the customer and the card
+        key_id, key = get_merchant_key(shards.key_cursor(), d['merchant_id'])
 
         # Insert customer
         cur.execute(
             """
-            INSERT INTO customers (merchant_id, first_name, last_name, email_enc, phone_enc)
-            VALUES (%s,%s,%s, AES_ENCRYPT(%s,%s), AES_ENCRYPT(%s,%s))
+            INSERT INTO customers (merchant_id, first_name, last_name, email_enc, phone_enc, email_bidx)
+            VALUES (%s,%s,%s,%s,%s,%s)
             """,
-            (d['merchant_id'], d['firstname'], d['lastname'], d['email'], AES_KEY, d['phone'], AES_KEY)
+            (d['merchant_id'], d['firstname'], d['lastname'],
+             encrypt_field(d['email'], key, key_id), encrypt_field(d['phone'], key, key_id),
+             blind_index('email', d['email']))
         )
         # Retrieve inserted customer id
         customer_id = cur.lastrowid
@@ -67,19 +92,27 @@ def store_customer_with_card():
         # Store encrypted card details linked to the newly created customer
         cur.execute(
             """
-            INSERT INTO card_vault (customer_id, card_number_enc, card_holder_enc, expiry_date_enc, cvv_enc, last_four_digits, status)
-            VALUES (%s, AES_ENCRYPT(%s,%s), AES_ENCRYPT(%s,%s), AES_ENCRYPT(%s,%s), AES_ENCRYPT(%s,%s), %s, 'Active')
+            INSERT INTO card_vault (customer_id, card_number_enc, card_holder_enc, expiry_date_enc, cvv_enc, last_four_digits, status, card_number_bidx)
+            VALUES (%s, %s, %s, %s, %s, %s, 'Active', %s)
             """,
-            (customer_id, card, AES_KEY, 'Card', AES_KEY, d['exp'], AES_KEY, cvv, AES_KEY, card[-4:])
+            (customer_id, encrypt_field(card, key, key_id), encrypt_field('Card', key, key_id),
+             encrypt_field(d['exp'], key, key_id), encrypt_field(cvv, key, key_id), card[-4:],
+             blind_index('card_number', card))
         )
+        card_id = cur.lastrowid
+        outbox.record(cur, outbox.CUSTOMER_ADDED, customer_id, merchant_id=d['merchant_id'], customer_id=customer_id)
+        outbox.record(cur, outbox.CARD_STORED, card_id, merchant_id=d['merchant_id'], customer_id=customer_id)
 
         db.commit()
+        bump('customers', 'card_vault')
 
         # Audit logs for both actions
         audit_log(session['user_id'], "ADD_CUSTOMER", "customers", record_id=customer_id)
         audit_log(session['user_id'], "STORE_CARD", "card_vault", record_id=customer_id)
 
         return jsonify({"message": "customer and card stored", "customer_id": customer_id}), 201
+    except shards.ShardMoving:
+        raise
     except Exception as e:
         # Attempt to rollback if possible
         try:
@@ -90,25 +123,48 @@ def store_customer_with_card():
 
 @customers_bp.get('/customer/list')
 @require_role('admin','merchant')
+@read_only
+@conditional_list('customers', store=False)  # the body carries decrypted email/phone
 def list_customers():
-    db, cur = get_db()
-    cur.execute("SELECT customer_id, first_name AS firstname, last_name AS lastname, AES_DECRYPT(email_enc, %s) AS email, AES_DECRYPT(phone_enc, %s) AS phone, merchant_id FROM customers WHERE status='Active'", (AES_KEY, AES_KEY))
-    rows = cur.fetchall()
-    customers = [dict(zip([desc[0] for desc in cur.description], r)) for r in rows]
-
-    # Decode any binary fields returned from AES_DECRYPT so JSON serialization succeeds
-    for c in customers:
-        for k, v in list(c.items()):
-            if isinstance(v, (bytes, bytearray)):
-                try:
-                    c[k] = v.decode('utf-8')
-                except Exception:
-                    c[k] = v.hex()
+    def page(shard, cur):
+        cur.execute("SELECT customer_id, first_name AS firstname, last_name AS lastname, email_enc AS email, phone_enc AS phone, merchant_id FROM customers WHERE status='Active' ORDER BY customer_id")
+        return [dict(zip([desc[0] for desc in cur.description], r)) for r in cur.fetchall()]
+
+    customers, _ = shards.merge_page(shards.fan_out(page), _customer_key, merchant_of=_merchant_of)
 
+    # Decrypt in the app tier so JSON serialization succeeds
+    decrypt_records(shards.key_cursor(), customers, ('email', 'phone'))
+
+    return jsonify({'customers': customers})
+
+@customers_bp.get('/customer/search')
+@require_role('admin','merchant')
+@read_only
+def search_customers():
+    """Find customers by exact email via the blind index; merchants only see their own customers."""
+    email = (request.args.get('email') or '').strip()
+    if not email:
+        return jsonify({"error": "email is required"}), 400
+    sql = ("SELECT customer_id, first_name AS firstname, last_name AS lastname, email_enc AS email, "
+           "phone_enc AS phone, merchant_id FROM customers WHERE email_bidx = %s AND status='Active'")
+    params = (blind_index('email', email),)
+    targets = None
+    if session.get('user_role') == 'merchant':
+        sql += " AND merchant_id = %s"
+        params += (session['user_id'],)
+        targets = [shards.shard_of(session['user_id'])]
+
+    def page(shard, cur):
+        cur.execute(sql + " ORDER BY customer_id", params)
+        return [dict(zip([desc[0] for desc in cur.description], r)) for r in cur.fetchall()]
+
+    customers, _ = shards.merge_page(shards.fan_out(page, targets), _customer_key, merchant_of=_merchant_of)
+    decrypt_records(shards.key_cursor(), customers, ('email', 'phone'))
     return jsonify({'customers': customers})
 
 @customers_bp.get('/customer/my_cards')
 @require_role('customer')
+@read_only
 def get_my_cards():
     """Retrieve card details for the logged-in customer."""
     try:
@@ -116,28 +172,26 @@ def get_my_cards():
         if not user_id:
             return jsonify({"error": "Unauthorized access."}), 401
 
-        db, cur = get_db()
+        try:
+            fields = requested_secrets(MY_CARDS_SECRETS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        db, cur = shard_db(shards.customer_shard(user_id))
         cur.execute(
-            """
-            SELECT card_id, AES_DECRYPT(card_number_enc, %s) AS card_number,
-                   AES_DECRYPT(expiry_date_enc, %s) AS expiry_date,
-                   AES_DECRYPT(cvv_enc, %s) AS cvv
+            f"""
+            SELECT card_id, last_four_digits, status{secret_columns(MY_CARDS_SECRETS, fields)}
             FROM card_vault
             WHERE customer_id = %s AND status = 'Active'
             """,
-            (AES_KEY, AES_KEY, AES_KEY, user_id)
+            (user_id,)
         )
         rows = cur.fetchall()
         cards = [dict(zip([desc[0] for desc in cur.description], r)) for r in rows]
 
-        # Decode binary fields returned from AES_DECRYPT
-        for card in cards:
-            for k, v in list(card.items()):
-                if isinstance(v, (bytes, bytearray)):
-                    try:
-                        card[k] = v.decode('utf-8')
-                    except Exception:
-                        card[k] = v.hex()
+        # Decrypt in the app tier, and only what was asked for
+        if fields:
+            decrypt_records(shards.key_cursor(), cards, fields)
 
         return jsonify({'cards': cards})
     except Exception as e:
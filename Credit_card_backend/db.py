@@ -1,37 +1,461 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
 import mysql.connector
 from mysql.connector import Error as MySQLError
-from flask import g
-from config import DB_CONFIG
+from flask import g, request, session, has_request_context
+from utils.metrics import add_timing
+from utils import query_stats
+from utils.replica import ReplicaMonitor
+from config import (DB_CONFIG, DB_ENGINE, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME,
+                    DB_POOL_PRE_PING, DB_POOL_PING_INTERVAL, DB_POOL_RESET_SESSION, DB_READ_CONFIG,
+                    DB_READ_POOL_MAX, DB_READ_MAX_LAG, DB_READ_LAG_CHECK_INTERVAL, DB_SHARDS)
 
 
-def get_db():
-    if 'db' not in g:
-        # Allow configuring a short DB connect timeout to fail fast in cloud environments
-        timeout = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+class PoolTimeout(MySQLError):
+    """Raised when no pooled connection became free within DB_POOL_TIMEOUT."""
+
+
+class ConnectionPool:
+    """A small thread-safe pool of MySQL connections owned by one worker process.
+
+    Connections are created lazily up to ``max_size`` and at least ``min_size``
+    are kept open. On checkout a connection is recycled if it is older than
+    ``max_lifetime`` and pinged if it has been idle for a while; on return any
+    open transaction is rolled back so the next request starts clean.
+    """
+
+    def __init__(self, config, min_size=1, max_size=10, timeout=5.0, max_lifetime=1800,
+                 pre_ping=True, ping_interval=30.0, reset_session=False, connector=None):
+        self.config = dict(config)
+        # Callable that opens a connection from **config; mysql.connector unless another engine is used
+        self.connector = connector or mysql.connector.connect
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.pre_ping = pre_ping
+        self.ping_interval = ping_interval
+        self.reset_session = reset_session
+        self.pid = os.getpid()
+
+        self._lock = threading.Condition()
+        self._idle = []      # [(conn, created_at, last_used)]
+        self._created = {}   # id(conn) -> created_at, for connections checked out
+        self._size = 0
+        self.stats = {
+            "checkouts": 0, "returns": 0, "waits": 0, "timeouts": 0,
+            "created": 0, "recycled": 0, "ping_failures": 0, "discarded": 0,
+        }
+
+    def _connect(self):
+        conn = self.connector(**self.config, autocommit=False)
+        with self._lock:
+            self.stats["created"] += 1
+        return conn
+
+    def fill(self):
+        """Open connections until ``min_size`` are available."""
+        while True:
+            with self._lock:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+            now = time.time()
+            with self._lock:
+                self._idle.append((conn, now, now))
+                self._lock.notify()
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        waited = False
+        with self._lock:
+            while True:
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    raise PoolTimeout(f"no database connection available after {self.timeout}s "
+                                      f"(pool size {self.max_size})")
+                if not waited:
+                    self.stats["waits"] += 1
+                    waited = True
+                self._lock.wait(remaining)
+            self.stats["checkouts"] += 1
+
+        if conn is not None:
+            now = time.time()
+            if self.max_lifetime and now - created_at > self.max_lifetime:
+                with self._lock:
+                    self.stats["recycled"] += 1
+                self._close_quietly(conn)
+                conn = None
+            elif self.pre_ping and now - last_used > self.ping_interval:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    with self._lock:
+                        self.stats["ping_failures"] += 1
+                    self._close_quietly(conn)
+                    conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                    self._lock.notify()
+                raise
+            created_at = time.time()
+
+        with self._lock:
+            self._created[id(conn)] = created_at
+        return conn
+
+    def release(self, conn, discard=False):
+        with self._lock:
+            created_at = self._created.pop(id(conn), time.time())
+        if not discard:
+            try:
+                # Drain any unread result so rollback/reset don't fail
+                if getattr(conn, 'unread_result', False):
+                    conn.consume_results()
+                conn.rollback()
+                if self.reset_session:
+                    conn.cmd_reset_connection()
+            except Exception:
+                discard = True
+        with self._lock:
+            if discard:
+                self.stats["discarded"] += 1
+                self._size -= 1
+            else:
+                self.stats["returns"] += 1
+                self._idle.append((conn, created_at, time.time()))
+            self._lock.notify()
+        if discard:
+            self._close_quietly(conn)
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self.stats)
+            data.update({"size": self._size, "idle": len(self._idle),
+                         "in_use": self._size - len(self._idle),
+                         "min_size": self.min_size, "max_size": self.max_size, "pid": self.pid})
+        return data
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times every statement.
+
+    Execute and fetch time is charged to the request's db_query phase, and
+    each execute/executemany is recorded under its SQL fingerprint
+    (utils/query_stats.py) for the slow-query log, N+1 detection and
+    /admin/query_stats.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, fn, *args, **kwargs):
+        start = time.perf_counter()
         try:
-            conn_args = dict(DB_CONFIG)
-            # mysql.connector supports 'connection_timeout' parameter
-            conn_args['connection_timeout'] = timeout
-            g.db = mysql.connector.connect(**conn_args, autocommit=False)
-            g.cursor = g.db.cursor(buffered=True)
-        except MySQLError as e:
-            # Log and re-raise so the request handler can capture this and return an error
-            print(f"[DB] connection error (timeout={timeout}s): {e}")
-            raise
+            return fn(*args, **kwargs)
+        finally:
+            add_timing("db_query", time.perf_counter() - start)
+
+    def _run(self, fn, operation, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(operation, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            add_timing("db_query", elapsed)
+            query_stats.record(operation, elapsed, self._cursor.rowcount)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        return self._run(self._cursor.execute, operation, params, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        return self._run(self._cursor.executemany, operation, seq_params, *args, **kwargs)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, size=1):
+        return self._timed(self._cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+_pool = None
+_replica = None
+_shard_pools = {}    # shard name -> ConnectionPool, for the shards in DB_SHARDS
+_pool_lock = threading.Lock()
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_pool():
+    """Return this process's pool, rebuilding it after a fork (e.g. gunicorn workers).
+
+    Connections inherited from the parent share its sockets, so the child must
+    drop them without sending COM_QUIT on the parent's behalf.
+    """
+    global _pool
+    pid = os.getpid()
+    if _pool is None or _pool.pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool.pid != pid:
+                # Allow configuring a short DB connect timeout to fail fast in cloud environments
+                timeout = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+                conn_args = dict(DB_CONFIG)
+                # mysql.connector supports 'connection_timeout' parameter
+                conn_args['connection_timeout'] = timeout
+                connector = None
+                if DB_ENGINE == 'sqlite':
+                    from utils.sqlite_engine import connect as connector
+                _pool = ConnectionPool(conn_args, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                                       timeout=DB_POOL_TIMEOUT, max_lifetime=DB_POOL_MAX_LIFETIME,
+                                       pre_ping=DB_POOL_PRE_PING, ping_interval=DB_POOL_PING_INTERVAL,
+                                       reset_session=DB_POOL_RESET_SESSION, connector=connector)
+    return _pool
+
+
+def get_replica():
+    """Return this process's ReplicaMonitor, or None when no read replica is configured (always for SQLite)."""
+    global _replica
+    if DB_READ_CONFIG is None or DB_ENGINE == 'sqlite':
+        return None
+    pid = os.getpid()
+    if _replica is None or _replica.pool.pid != pid:
+        with _pool_lock:
+            if _replica is None or _replica.pool.pid != pid:
+                conn_args = dict(DB_READ_CONFIG, connection_timeout=int(os.environ.get('DB_CONNECT_TIMEOUT', 5)))
+                pool = ConnectionPool(conn_args, min_size=0, max_size=DB_READ_POOL_MAX,
+                                      timeout=DB_POOL_TIMEOUT, max_lifetime=DB_POOL_MAX_LIFETIME,
+                                      pre_ping=DB_POOL_PRE_PING, ping_interval=DB_POOL_PING_INTERVAL,
+                                      reset_session=DB_POOL_RESET_SESSION)
+                _replica = ReplicaMonitor(pool, DB_READ_MAX_LAG, DB_READ_LAG_CHECK_INTERVAL)
+    return _replica
+
+
+def get_shard_pool(name):
+    """Return this process's pool for a merchant shard; 'main' is the primary's pool."""
+    if name == 'main':
+        return get_pool()
+    pool = _shard_pools.get(name)
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            pool = _shard_pools.get(name)
+            if pool is None or pool.pid != os.getpid():
+                connector = None
+                if DB_ENGINE == 'sqlite':
+                    from utils.sqlite_engine import connect as connector
+                    conn_args = dict(DB_SHARDS[name])
+                else:
+                    conn_args = dict(DB_SHARDS[name], connection_timeout=int(os.environ.get('DB_CONNECT_TIMEOUT', 5)))
+                pool = ConnectionPool(conn_args, min_size=0, max_size=DB_POOL_MAX,
+                                      timeout=DB_POOL_TIMEOUT, max_lifetime=DB_POOL_MAX_LIFETIME,
+                                      pre_ping=DB_POOL_PRE_PING, ping_interval=DB_POOL_PING_INTERVAL,
+                                      reset_session=DB_POOL_RESET_SESSION, connector=connector)
+                _shard_pools[name] = pool
+    return pool
+
+
+def reset_pool():
+    """Forget the current pools without closing their connections (call after fork)."""
+    global _pool, _replica
+    with _pool_lock:
+        _pool = None
+        _replica = None
+        _shard_pools.clear()
+
+
+def pool_stats():
+    return get_pool().snapshot()
+
+
+def replica_stats():
+    replica = get_replica()
+    return replica.snapshot() if replica is not None else {}
+
+
+def _read_pool():
+    """The replica's pool if this request may read from it, else None (use the primary).
+
+    Only @read_only views read from the replica, and only while it is
+    within DB_READ_MAX_LAG and has applied this session's last write.
+    Decided once per request, so one response never mixes the two.
+    """
+    if 'read_pool' not in g:
+        g.read_pool = None
+        replica = get_replica() if g.get('read_only') else None
+        if replica is not None:
+            through = replica.applied_through()
+            if through is None:
+                replica.count("lagging")
+            elif session.get('db_written_at', 0) > through:
+                replica.count("pinned")
+            else:
+                replica.count("reads")
+                g.read_pool = replica.pool
+                # utils/list_cache.py compares this with the last write to the tables it serves
+                g.replica_through = through
+    return g.read_pool
+
+
+def _acquire(pool):
+    start = time.perf_counter()
+    try:
+        conn = pool.acquire()
+        return conn, InstrumentedCursor(conn.cursor(buffered=True))
+    except MySQLError as e:
+        # Log and re-raise so the request handler can capture this and return an error
+        print(f"[DB] connection error: {e}")
+        raise
+    finally:
+        add_timing("db_connect", time.perf_counter() - start)
+
+
+def get_db(merchant_id=None, primary=False):
+    """Return this request's (connection, cursor), opened on first use.
+
+    With a merchant_id it is a connection to the shard holding that
+    merchant's customers and cards (utils/shards.py); a write request for
+    a merchant that is being moved raises shards.ShardMoving. Without one,
+    or for merchants on the main shard, it is the primary's.
+    In a @read_only view a main connection is a replica connection when
+    `_read_pool` allows it. Pass primary=True for a write that has to reach
+    the primary from such a view (e.g. the synchronous audit log).
+    """
+    if merchant_id is not None:
+        from utils import shards
+        shard = shards.shard_of(merchant_id, for_write=request.method not in SAFE_METHODS)
+        if shard != shards.MAIN:
+            return shard_db(shard)
+    pool = None if primary else _read_pool()
+    if pool is not None:
+        if 'read_db' not in g:
+            g.read_db, g.read_cursor = _acquire(pool)
+        return g.read_db, g.read_cursor
+    if 'db' not in g:
+        g.db, g.cursor = _acquire(get_pool())
     return g.db, g.cursor
 
 
+def shard_db(shard):
+    """This request's (connection, cursor) on a shard by name, opened on first use; 'main' is get_db()."""
+    if shard == 'main':
+        return get_db()
+    if 'shard_dbs' not in g:
+        g.shard_dbs = {}
+    if shard not in g.shard_dbs:
+        g.shard_dbs[shard] = _acquire(get_shard_pool(shard))
+    return g.shard_dbs[shard]
+
+
 def close_db(e=None):
-    cursor = g.pop("cursor", None)
-    if cursor:
+    for shard, (db, cursor) in g.pop("shard_dbs", {}).items():
         try:
             cursor.close()
         except Exception:
             pass
-    db = g.pop("db", None)
-    if db:
+        get_shard_pool(shard).release(db)
+    for conn_name, cursor_name, pool in (("db", "cursor", None), ("read_db", "read_cursor", g.get("read_pool"))):
+        cursor = g.pop(cursor_name, None)
+        if cursor:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        db = g.pop(conn_name, None)
+        if db:
+            (pool or get_pool()).release(db)
+
+
+def remember_write(response):
+    """after_request hook: record when this session last wrote; its reads stay on the primary until the replica has it."""
+    if request.method not in SAFE_METHODS and response.status_code < 400 and get_replica() is not None:
+        session['db_written_at'] = time.time()
+    return response
+
+
+def _shard_read_pool(shard):
+    # Main reads follow the request's replica decision; shards have no replicas
+    if shard == 'main':
+        return (_read_pool() if has_request_context() else None) or get_pool()
+    return get_shard_pool(shard)
+
+
+@contextmanager
+def shard_connection(shard):
+    """(connection, buffered cursor) on a shard, on a connection of its own.
+
+    For work outside the request's connections: the threads of
+    shards.fan_out, and scripts. Reads on main come from the same database
+    as get_db() does for this request.
+    """
+    pool = _shard_read_pool(shard)
+    start = time.perf_counter()
+    conn = pool.acquire()
+    add_timing("db_connect", time.perf_counter() - start)
+    cur = InstrumentedCursor(conn.cursor(buffered=True))
+    try:
+        yield conn, cur
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+        pool.release(conn)
+
+
+@contextmanager
+def streaming_cursor(shard='main'):
+    """Unbuffered cursor on a connection of its own, for walking large result sets.
+
+    Rows are pulled from the server as they are fetched instead of being
+    buffered up front, and the request's own connection stays free for other
+    queries (e.g. data key lookups) while the stream is open. On main it
+    comes from the same database as get_db() does for this request.
+    """
+    pool = _shard_read_pool(shard)
+    start = time.perf_counter()
+    conn = pool.acquire()
+    add_timing("db_connect", time.perf_counter() - start)
+    cur = InstrumentedCursor(conn.cursor(buffered=False))
+    try:
+        yield cur
+    finally:
         try:
-            db.close()
+            cur.close()
         except Exception:
             pass
+        pool.release(conn)
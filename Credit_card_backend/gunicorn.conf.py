@@ -0,0 +1,22 @@
+# Picked up automatically by `gunicorn app:app` when started from this directory.
+
+
+def post_fork(server, worker):
+    # Workers must not reuse connections opened by the master before forking
+    from db import reset_pool
+    reset_pool()
+
+
+def post_worker_init(worker):
+    # Warm up DB_POOL_MIN connections so the first requests skip the handshake
+    from db import get_pool
+    try:
+        get_pool().fill()
+    except Exception as e:
+        worker.log.warning(f"[DB] pool warm-up failed: {e}")
+
+
+def worker_exit(server, worker):
+    # Write out audit events still sitting in this worker's queue
+    from utils.logger import shutdown
+    shutdown()
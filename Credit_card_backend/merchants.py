@@ -1,11 +1,22 @@
 from flask import Blueprint, request, session, jsonify
-from db import get_db
-from utils.decorators import require_role
+from db import get_db, shard_db
+from config import SHARD_FOR_NEW_MERCHANTS
+from utils.decorators import require_role, read_only
 from utils.logger import audit_log
-from config import AES_KEY
+from utils.keystore import decrypt_records
+from utils.streaming import page_args, stream_shards, stream_response
+from utils.projection import requested_secrets, secret_columns
+from utils.list_cache import conditional_list, bump
+from utils import outbox, shards
 
 merchants_bp = Blueprint('merchants', __name__)
 
+# Encrypted fields the customer/card listings return on request (see utils.projection)
+ADMIN_DATA_FIELDS = {'email': 'c.email_enc', 'phone': 'c.phone_enc', 'card_number': 'cv.card_number_enc',
+                     'expiry_date': 'cv.expiry_date_enc', 'cvv': 'cv.cvv_enc'}
+CUSTOMER_FIELDS = ('email', 'phone')
+CARD_FIELDS = ('card_number', 'expiry_date', 'cvv')
+
 @merchants_bp.post('/merchant/create')
 @require_role('admin')
 def create_merchant():
@@ -13,12 +24,26 @@ def create_merchant():
     db, cur = get_db()
     cur.execute("INSERT INTO merchants (merchant_name,contact_email, status) VALUES (%s,%s, 'Active')",
                 (data['name'], data['email']))
+    merchant_id = cur.lastrowid
+    outbox.record(cur, outbox.MERCHANT_CREATED, merchant_id, merchant_id=merchant_id)
+    if SHARD_FOR_NEW_MERCHANTS != shards.MAIN:
+        # Main keeps the master row; the shard gets a copy for its joins, committed
+        # first so the map never names a shard that lacks the merchant
+        cur.execute("INSERT INTO merchant_shards (merchant_id, shard, state) VALUES (%s, %s, %s)",
+                    (merchant_id, SHARD_FOR_NEW_MERCHANTS, shards.ACTIVE))
+        shard_conn, shard_cur = shard_db(SHARD_FOR_NEW_MERCHANTS)
+        shard_cur.execute("INSERT INTO merchants (merchant_id, merchant_name, contact_email, status) "
+                          "VALUES (%s, %s, %s, 'Active')", (merchant_id, data['name'], data['email']))
+        shard_conn.commit()
     db.commit()
+    bump('merchants')
     audit_log(session['user_id'], "CREATE_MERCHANT", "merchants")
     return {"message": "merchant created"}
 
 @merchants_bp.get('/merchant/list')
 @require_role('admin')
+@read_only
+@conditional_list('merchants')
 def list_merchants():
     db, cur = get_db()
     cur.execute("SELECT merchant_id, merchant_name AS business_name, contact_email FROM merchants WHERE status='Active'")
@@ -28,6 +53,7 @@ def list_merchants():
 
 @merchants_bp.get('/merchant/customers')
 @require_role('merchant')
+@read_only
 def get_merchant_customers():
     """Retrieve customers and their card details for the logged-in merchant."""
     try:
@@ -35,67 +61,170 @@ def get_merchant_customers():
         if not merchant_id:
             return jsonify({"error": "Unauthorized access."}), 401
 
-        db, cur = get_db()
+        try:
+            fields = requested_secrets(ADMIN_DATA_FIELDS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        db, cur = get_db(merchant_id)
         cur.execute(
-            """
+            f"""
             SELECT c.customer_id, c.first_name AS firstname, c.last_name AS lastname,
-                   AES_DECRYPT(c.email_enc, %s) AS email, AES_DECRYPT(c.phone_enc, %s) AS phone,
-                   cv.card_id, AES_DECRYPT(cv.card_number_enc, %s) AS card_number,
-                   AES_DECRYPT(cv.expiry_date_enc, %s) AS expiry_date, AES_DECRYPT(cv.cvv_enc, %s) AS cvv
+                   cv.card_id, cv.last_four_digits{secret_columns(ADMIN_DATA_FIELDS, fields)}
             FROM customers c
             LEFT JOIN card_vault cv ON c.customer_id = cv.customer_id
             WHERE c.merchant_id = %s AND c.status = 'Active' AND cv.status = 'Active'
             """,
-            (AES_KEY, AES_KEY, AES_KEY, AES_KEY, AES_KEY, merchant_id)
+            (merchant_id,)
         )
         rows = cur.fetchall()
         customers = [dict(zip([desc[0] for desc in cur.description], r)) for r in rows]
 
-        # Decode binary fields returned from AES_DECRYPT
-        for customer in customers:
-            for k, v in list(customer.items()):
-                if isinstance(v, (bytes, bytearray)):
-                    try:
-                        customer[k] = v.decode('utf-8')
-                    except Exception:
-                        customer[k] = v.hex()
+        # Decrypt in the app tier (one call for the whole result set)
+        if fields:
+            decrypt_records(shards.key_cursor(), customers, fields)
 
         return jsonify({'customers': customers})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+def _admin_key(row):
+    return (row['merchant_id'], row['customer_id'] or 0, row['card_id'] or 0)
+
+
+def _parse_admin_cursor(after):
+    # Cursor is "merchant_id:customer_id:card_id"; missing customer/card sort as 0
+    if not after:
+        return (0, 0, 0)
+    parts = after.split(':')
+    if len(parts) != 3 or not all(p.isdigit() for p in parts):
+        raise ValueError("after must look like <merchant_id>:<customer_id>:<card_id>")
+    return tuple(int(p) for p in parts)
+
+
+def _finish_merchant(merchant, fields, key_cur=None):
+    customers = merchant['customers']
+    cards = [card for customer in customers for card in customer['cards']]
+    customer_fields = [f for f in CUSTOMER_FIELDS if f in fields]
+    card_fields = [f for f in CARD_FIELDS if f in fields]
+    if customer_fields or card_fields:
+        # Streamed responses run after the view's cursor is closed and pass no key_cur
+        key_cur = key_cur or shards.key_cursor()
+        # Each customer's email/phone is decrypted once, however many cards they have
+        decrypt_records(key_cur, customers, customer_fields)
+        decrypt_records(key_cur, cards, card_fields)
+    for customer in customers:
+        customer['card_count'] = len(customer['cards'])
+    merchant['customer_count'] = len(customers)
+    merchant['card_count'] = len(cards)
+    return merchant
+
+
+def _nest_admin_rows(rows, fields, key_cur=None):
+    """Fold flat rows sorted by merchant/customer/card into one nested dict per merchant.
+
+    Works in a single pass and yields each merchant as soon as its last row
+    has been seen, so it can sit on top of a streaming cursor. Only the
+    encrypted `fields` the caller asked for are carried over and decrypted.
+    """
+    customer_fields = [f for f in CUSTOMER_FIELDS if f in fields]
+    card_fields = [f for f in CARD_FIELDS if f in fields]
+    merchant = customer = None
+    for r in rows:
+        if merchant is None or r['merchant_id'] != merchant['merchant_id']:
+            if merchant is not None:
+                yield _finish_merchant(merchant, fields, key_cur)
+            merchant = {'merchant_id': r['merchant_id'], 'business_name': r['business_name'],
+                        'contact_email': r['contact_email'], 'customers': []}
+            customer = None
+        if r['customer_id'] is None:
+            continue
+        if customer is None or r['customer_id'] != customer['customer_id']:
+            customer = {'customer_id': r['customer_id'], 'firstname': r['firstname'], 'lastname': r['lastname'],
+                        **{f: r[f] for f in customer_fields}, 'cards': []}
+            merchant['customers'].append(customer)
+        if r['card_id'] is not None:
+            customer['cards'].append({'card_id': r['card_id'], 'last_four_digits': r['last_four_digits'],
+                                      **{f: r[f] for f in card_fields}})
+    if merchant is not None:
+        yield _finish_merchant(merchant, fields, key_cur)
+
+
 @merchants_bp.get('/admin/all_data')
 @require_role('admin')
+@read_only
+@conditional_list('merchants', 'customers', 'card_vault')
 def get_admin_all_data():
-    """Retrieve all merchants, their customers, and card details for admin."""
+    """Retrieve all merchants, their customers, and card details for admin.
+
+    Supports keyset pages (?limit=&after=<merchant>:<customer>:<card>) and
+    constant-memory streaming (?stream=ndjson|json). ?shape=nested returns
+    merchant -> customers -> cards with per-level counts instead of one flat
+    row per card; with a limit, a merchant can continue on the next page.
+    Card and contact fields stay masked unless named in ?fields= or ?view=full.
+    With merchant shards every shard is queried in parallel and the pages
+    are merged in cursor order.
+    """
     try:
-        db, cur = get_db()
-        cur.execute(
-            """
+        try:
+            limit, after, stream = page_args()
+            m_after, c_after, cv_after = _parse_admin_cursor(after)
+            fields = requested_secrets(ADMIN_DATA_FIELDS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        nested = request.args.get('shape', 'flat') == 'nested'
+
+        sql = f"""
             SELECT m.merchant_id, m.merchant_name AS business_name, m.contact_email,
                    c.customer_id, c.first_name AS firstname, c.last_name AS lastname,
-                   AES_DECRYPT(c.email_enc, %s) AS email, AES_DECRYPT(c.phone_enc, %s) AS phone,
-                   cv.card_id, AES_DECRYPT(cv.card_number_enc, %s) AS card_number,
-                   AES_DECRYPT(cv.expiry_date_enc, %s) AS expiry_date, AES_DECRYPT(cv.cvv_enc, %s) AS cvv
+                   cv.card_id, cv.last_four_digits{secret_columns(ADMIN_DATA_FIELDS, fields)}
             FROM merchants m
             LEFT JOIN customers c ON m.merchant_id = c.merchant_id AND c.status = 'Active'
             LEFT JOIN card_vault cv ON c.customer_id = cv.customer_id AND cv.status = 'Active'
-            WHERE m.status = 'Active'
-            """,
-            (AES_KEY, AES_KEY, AES_KEY, AES_KEY, AES_KEY)
-        )
-        rows = cur.fetchall()
-        data = [dict(zip([desc[0] for desc in cur.description], r)) for r in rows]
+            WHERE m.status = 'Active' AND m.merchant_id >= %s
+              AND (m.merchant_id, COALESCE(c.customer_id, 0), COALESCE(cv.card_id, 0)) > (%s, %s, %s)
+            ORDER BY m.merchant_id, COALESCE(c.customer_id, 0), COALESCE(cv.card_id, 0)
+            """
+        params = (m_after, m_after, c_after, cv_after)
+        if limit:
+            sql += " LIMIT %s"
+            params += (limit,)
+        if stream:
+            # Main's merchants table lists every merchant; the ownership filter keeps
+            # only the shard that holds each one's customers
+            merchant_of = lambda r: r['merchant_id']
+            if nested:
+                rows = stream_shards(sql, params, (), _admin_key, merchant_of)
+                return stream_response(_nest_admin_rows(rows, fields), 'merchants', stream)
+            return stream_response(stream_shards(sql, params, fields, _admin_key, merchant_of), 'data', stream)
+
+        def page(shard, cur):
+            cur.execute(sql, params)
+            columns = [desc[0] for desc in cur.description]
+            return [dict(zip(columns, r)) for r in cur.fetchall()]
 
-        # Decode binary fields returned from AES_DECRYPT
-        for item in data:
-            for k, v in list(item.items()):
-                if isinstance(v, (bytes, bytearray)):
-                    try:
-                        item[k] = v.decode('utf-8')
-                    except Exception:
-                        item[k] = v.hex()
+        data, last = shards.merge_page(shards.fan_out(page), _admin_key, limit, lambda r: r['merchant_id'])
+        next_after = ':'.join(map(str, last)) if limit and last else None
+        key_cur = shards.key_cursor()
 
+        if nested:
+            merchants = list(_nest_admin_rows(data, fields, key_cur))
+            body = {'merchants': merchants, 'counts': {
+                'merchants': len(merchants),
+                'customers': sum(m['customer_count'] for m in merchants),
+                'cards': sum(m['card_count'] for m in merchants),
+            }}
+            if limit:
+                body['next_after'] = next_after
+            return jsonify(body)
+
+        # Decrypt in the app tier (one call for the whole result set)
+        if fields:
+            decrypt_records(key_cur, data, fields)
+
+        if limit:
+            return jsonify({'data': data, 'next_after': next_after})
         return jsonify({'data': data})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
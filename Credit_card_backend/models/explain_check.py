@@ -0,0 +1,136 @@
+"""Run EXPLAIN on every SQL statement the app issues and fail on full table scans.
+
+Statements are collected from the source: literal strings (and f-strings,
+with each placeholder rendered as %s) passed to .execute()/.executemany(),
+either inline or through a module-level or local variable. Every %s is
+bound to '1', which MySQL can compare against both integer and string
+columns without giving up on an index.
+
+Run it against a database with realistic row counts (see bench/), since
+the optimizer happily scans tiny tables:
+
+    python -m models.explain_check [--min-rows 1000] [--allow table ...] [--allow-skip]
+
+A statement whose EXPLAIN fails (e.g. a dynamic piece rendered as %s that
+is not a value) was not checked, so it fails the run too unless
+--allow-skip is given.
+"""
+import argparse
+import ast
+import os
+import sys
+import mysql.connector
+from config import DB_CONFIG
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCAN_DIRS = (".", "utils")
+EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "WITH")
+
+
+def _render(node, names):
+    """Return the SQL text for an AST node if it is statically known, else None."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for v in node.values:
+            if isinstance(v, ast.Constant):
+                parts.append(v.value)
+            else:
+                # Dynamic pieces are mostly IN-list placeholders; anything else will fail EXPLAIN and be reported
+                parts.append("%s")
+        return "".join(parts)
+    if isinstance(node, ast.Name):
+        return names.get(node.id)
+    return None
+
+
+def _string_assignments(body):
+    names = {}
+    for node in body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            text = _render(node.value, {})
+            if text is not None and node.targets[0].id not in names:
+                names[node.targets[0].id] = text
+    return names
+
+
+def collect_statements(base_dir=BACKEND_DIR):
+    """Yield (location, sql) for every statically known statement in the app's modules."""
+    for d in SCAN_DIRS:
+        folder = os.path.join(base_dir, d)
+        for filename in sorted(os.listdir(folder)):
+            if not filename.endswith(".py"):
+                continue
+            path = os.path.join(folder, filename)
+            with open(path, encoding="utf-8") as f:
+                tree = ast.parse(f.read(), path)
+            module_names = _string_assignments(tree.body)
+            scopes = [(tree, module_names)]
+            for node in ast.walk(tree):
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    scopes.append((node, {**module_names, **_string_assignments(ast.walk(node))}))
+            seen = set()
+            for scope, names in scopes:
+                for node in ast.walk(scope):
+                    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                            and node.func.attr in ("execute", "executemany") and node.args
+                            and id(node) not in seen):
+                        sql = _render(node.args[0], names)
+                        if sql is None:
+                            continue
+                        seen.add(id(node))
+                        yield f"{os.path.relpath(path, base_dir)}:{node.lineno}", sql
+
+
+def explain(cur, sql):
+    cur.execute("EXPLAIN " + sql.replace("%s", "'1'"))
+    return cur.fetchall()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Fail if any app query does a full table scan")
+    parser.add_argument("--min-rows", type=int, default=0,
+                        help="ignore full scans the optimizer estimates at fewer rows than this")
+    parser.add_argument("--allow", nargs="*", default=[], help="tables allowed to be scanned")
+    parser.add_argument("--allow-skip", action="store_true",
+                        help="pass even if some statements could not be explained")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cur = conn.cursor(dictionary=True, buffered=True)
+    failures, skipped, checked = [], [], 0
+    for location, sql in collect_statements():
+        keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+        if keyword not in EXPLAINABLE:
+            continue
+        try:
+            plan = explain(cur, sql)
+        except mysql.connector.Error as e:
+            skipped.append((location, str(e)))
+            continue
+        checked += 1
+        for row in plan:
+            table = row.get("table") or ""
+            if (row.get("type") == "ALL" and not table.startswith("<") and table not in args.allow
+                    and (row.get("rows") or 0) >= args.min_rows):
+                failures.append((location, table, row.get("rows"), " ".join(sql.split())))
+        if args.verbose:
+            print(f"{location}: " + ", ".join(f"{r.get('table')}={r.get('type')}" for r in plan))
+    cur.close()
+    conn.close()
+
+    for location, error in skipped:
+        print(f"[EXPLAIN] skipped {location}: {error}")
+    for location, table, rows, sql in failures:
+        print(f"[EXPLAIN] FULL SCAN of {table} (~{rows} rows) at {location}\n    {sql}")
+    print(f"[EXPLAIN] checked {checked} statements, {len(failures)} full scan(s), {len(skipped)} skipped")
+    if skipped and not args.allow_skip:
+        print("[EXPLAIN] failing: skipped statements were not checked (pass --allow-skip to accept that)")
+        return 1
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
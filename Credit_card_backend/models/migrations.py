@@ -0,0 +1,353 @@
+"""Versioned schema migrations for the vault database.
+
+Each migration runs once and is recorded in `schema_migrations`. Add new
+ones to the end of MIGRATIONS; never edit one that has shipped.
+
+    python -m models.migrations            # apply pending migrations
+    python -m models.migrations status     # show applied / pending
+    python -m models.migrations --shard all    # the same on main and every shard in DB_SHARDS
+
+Every shard gets the full schema; see utils/shards.py for what each one holds.
+"""
+import sys
+import mysql.connector
+from config import DB_CONFIG, DB_ENGINE, DB_SHARDS
+
+ENC = "VARBINARY(255)"  # AES-GCM envelope of a short text field (utils/crypto.py)
+
+
+def _is_sqlite(cur):
+    # utils/sqlite_engine.py cursors; everything else is MySQL
+    return getattr(cur, "dialect", None) == "sqlite"
+
+
+def add_index(cur, table, name, columns, unique=False):
+    """CREATE INDEX unless an index with this name already exists (MySQL has no IF NOT EXISTS)."""
+    if _is_sqlite(cur):
+        cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+        return
+    cur.execute(
+        "SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+        (table, name)
+    )
+    if cur.fetchone():
+        return
+    cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})")
+
+
+def add_column(cur, table, name, definition):
+    if _is_sqlite(cur):
+        cur.execute(f"SELECT 1 FROM pragma_table_info('{table}') WHERE name = %s", (name,))
+        if not cur.fetchone():
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+        return
+    cur.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+        (table, name)
+    )
+    if not cur.fetchone():
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def _base_schema(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(255) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            user_role ENUM('customer', 'merchant', 'admin') DEFAULT 'customer',
+            status VARCHAR(50) DEFAULT 'Active',
+            last_login DATETIME NULL
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS merchants (
+            merchant_id INT AUTO_INCREMENT PRIMARY KEY,
+            merchant_name VARCHAR(255) NOT NULL,
+            contact_email VARCHAR(255),
+            status VARCHAR(50) NOT NULL DEFAULT 'Active',
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS customers (
+            customer_id INT AUTO_INCREMENT PRIMARY KEY,
+            merchant_id INT NOT NULL,
+            first_name VARCHAR(100),
+            last_name VARCHAR(100),
+            email_enc {ENC},
+            phone_enc {ENC},
+            status VARCHAR(50) NOT NULL DEFAULT 'Active',
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS card_vault (
+            card_id INT AUTO_INCREMENT PRIMARY KEY,
+            customer_id INT NOT NULL,
+            card_number_enc {ENC} NOT NULL,
+            card_holder_enc {ENC},
+            expiry_date_enc {ENC},
+            cvv_enc {ENC},
+            last_four_digits CHAR(4),
+            status VARCHAR(50) NOT NULL DEFAULT 'Active',
+            is_default TINYINT(1) NOT NULL DEFAULT 0,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            transaction_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            card_id INT NOT NULL,
+            amount DECIMAL(12, 2) NOT NULL,
+            currency CHAR(3) NOT NULL DEFAULT 'USD',
+            status VARCHAR(20) NOT NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS audit_logs (
+            log_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            table_name VARCHAR(64),
+            action_type VARCHAR(50),
+            record_id INT,
+            old_value TEXT,
+            new_value TEXT,
+            ip_address VARCHAR(45),
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS data_keys (
+            key_id INT AUTO_INCREMENT PRIMARY KEY,
+            merchant_id INT NOT NULL,
+            wrapped_key VARBINARY(128) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'Active',
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            retired_at DATETIME NULL
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            idem_key VARCHAR(128) NOT NULL,
+            request_hash CHAR(64) NOT NULL,
+            status_code SMALLINT NOT NULL,
+            response_body MEDIUMTEXT NOT NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+
+
+def _encrypted_columns(cur):
+    # Databases created by hand sized these for SQL AES_ENCRYPT output; AES-GCM envelopes are longer
+    for table, columns in (("card_vault", ("card_number_enc", "card_holder_enc", "expiry_date_enc", "cvv_enc")),
+                           ("customers", ("email_enc", "phone_enc"))):
+        for column in columns:
+            null = "NOT NULL" if column == "card_number_enc" else "NULL"
+            cur.execute(f"ALTER TABLE {table} MODIFY {column} {ENC} {null}")
+    # Inserts set is_default explicitly today; give it a default so nothing else has to
+    cur.execute("ALTER TABLE card_vault MODIFY is_default TINYINT(1) NOT NULL DEFAULT 0")
+
+
+def _hot_path_indexes(cur):
+    # Plain indexes: the login lookups only need the range, and existing tables may hold duplicates
+    add_index(cur, "users", "idx_users_username", "username")
+    add_index(cur, "users", "idx_users_email", "email")
+    add_index(cur, "merchants", "idx_merchants_status", "status, merchant_id")
+    add_index(cur, "customers", "idx_customers_merchant_status", "merchant_id, status")
+    add_index(cur, "customers", "idx_customers_status", "status, customer_id")
+    add_index(cur, "card_vault", "idx_card_vault_customer_status", "customer_id, status")
+    add_index(cur, "transactions", "idx_transactions_card", "card_id, created_at")
+    add_index(cur, "audit_logs", "idx_audit_logs_created", "created_at")
+    add_index(cur, "data_keys", "idx_data_keys_merchant_status", "merchant_id, status")
+    add_index(cur, "idempotency_keys", "uq_idempotency_user_key", "user_id, idem_key", unique=True)
+    add_index(cur, "idempotency_keys", "idx_idempotency_created", "created_at")
+
+
+def _rotation_progress(cur):
+    # rotate_keys.py also creates this on first run
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS key_rotation_progress (
+            job_id VARCHAR(64) NOT NULL,
+            table_name VARCHAR(64) NOT NULL,
+            worker INT NOT NULL,
+            range_start BIGINT NOT NULL,
+            range_end BIGINT NOT NULL,
+            last_pk BIGINT NOT NULL,
+            rows_total BIGINT NOT NULL DEFAULT 0,
+            rows_done BIGINT NOT NULL DEFAULT 0,
+            done TINYINT NOT NULL DEFAULT 0,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (job_id, table_name, worker)
+        )""")
+
+
+def _blind_indexes(cur):
+    # HMAC-SHA256 of the normalised plaintext (utils/crypto.blind_index); filled by backfill_blind_index.py
+    add_column(cur, "card_vault", "card_number_bidx", "VARBINARY(32) NULL")
+    add_column(cur, "customers", "email_bidx", "VARBINARY(32) NULL")
+    add_index(cur, "card_vault", "idx_card_vault_number_bidx", "card_number_bidx, customer_id")
+    add_index(cur, "customers", "idx_customers_email_bidx", "email_bidx, merchant_id")
+
+
+def _audit_filter_indexes(cur):
+    # One per /audit filter, each ending in created_at so the filtered keyset walk is an index range.
+    # InnoDB (and SQLite's rowid) append the primary key, which covers the log_id tie-breaker.
+    add_index(cur, "audit_logs", "idx_audit_logs_user_created", "user_id, created_at")
+    add_index(cur, "audit_logs", "idx_audit_logs_table_created", "table_name, created_at")
+    add_index(cur, "audit_logs", "idx_audit_logs_action_created", "action_type, created_at")
+    add_index(cur, "audit_logs", "idx_audit_logs_record_created", "record_id, created_at")
+
+
+def _audit_partitions(cur):
+    # MySQL only; on SQLite archive_audit.py deletes archived rows instead of dropping partitions
+    from config import AUDIT_PARTITIONS_AHEAD
+    from utils.audit_archive import partition_table
+    partition_table(cur, AUDIT_PARTITIONS_AHEAD)
+
+
+def _change_events(cur):
+    # Outbox written in the same transaction as each vault write; served by /changes (changes.py)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS change_events (
+            event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            event_type VARCHAR(32) NOT NULL,
+            entity_type VARCHAR(16) NOT NULL,
+            entity_id INT NOT NULL,
+            merchant_id INT NULL,
+            customer_id INT NULL,
+            created_at DATETIME(3) NOT NULL
+        )""")
+    add_index(cur, "change_events", "idx_change_events_merchant", "merchant_id, event_id")
+    add_index(cur, "change_events", "idx_change_events_customer", "customer_id, event_id")
+
+
+def _txn_rollups(cur):
+    # Maintained by utils/rollups.py in each charge's transaction; served by /reports/transactions
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS txn_rollups (
+            scope VARCHAR(8) NOT NULL,
+            scope_id INT NOT NULL,
+            period CHAR(1) NOT NULL,
+            bucket DATETIME NOT NULL,
+            currency CHAR(3) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            txn_count BIGINT NOT NULL,
+            amount_total DECIMAL(18, 2) NOT NULL,
+            PRIMARY KEY (scope, scope_id, period, bucket, currency, status)
+        )""")
+    add_index(cur, "txn_rollups", "idx_txn_rollups_bucket", "bucket")
+    # rebuild_rollups.py reads transactions one day at a time
+    add_index(cur, "transactions", "idx_transactions_created", "created_at")
+
+
+def _merchant_shards(cur):
+    # Merchant -> shard map (utils/shards.py); only main's copy is read, merchants without a row are on main
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS merchant_shards (
+            merchant_id INT PRIMARY KEY,
+            shard VARCHAR(32) NOT NULL,
+            state VARCHAR(16) NOT NULL DEFAULT 'active',
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+
+
+# (version, description, function(cursor))
+MIGRATIONS = [
+    (1, "base schema", _base_schema),
+    (2, "widen encrypted columns for AES-GCM", _encrypted_columns),
+    (3, "indexes for hot predicates", _hot_path_indexes),
+    (4, "key rotation checkpoints", _rotation_progress),
+    (5, "blind index columns for card number and email", _blind_indexes),
+    (6, "audit log filter indexes", _audit_filter_indexes),
+    (7, "monthly partitions for audit_logs", _audit_partitions),
+    (8, "change event outbox", _change_events),
+    (9, "transaction rollups", _txn_rollups),
+    (10, "merchant shard map", _merchant_shards),
+]
+
+
+def connect(shard='main'):
+    """Open a connection to the primary, or to one of the merchant shards in DB_SHARDS."""
+    if shard != 'main' and shard not in DB_SHARDS:
+        raise ValueError(f"unknown shard {shard!r}; DB_SHARDS has: {', '.join(DB_SHARDS) or 'none'}")
+    if DB_ENGINE == 'sqlite':
+        from utils.sqlite_engine import connect as sqlite_connect
+        return sqlite_connect(path=DB_SHARDS[shard]['path'] if shard != 'main' else None, bootstrap=False)
+    return mysql.connector.connect(**(DB_SHARDS[shard] if shard != 'main' else DB_CONFIG), autocommit=False)
+
+
+def applied_versions(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )""")
+    cur.execute("SELECT version FROM schema_migrations")
+    return {r[0] for r in cur.fetchall()}
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations in order; returns the versions applied.
+
+    DDL commits implicitly in MySQL, so each migration is recorded as soon as
+    it finishes and must be safe to re-run if it failed half way.
+    """
+    cur = conn.cursor(buffered=True)
+    # Only one process (e.g. one of several booting workers) migrates at a time
+    cur.execute("SELECT GET_LOCK('schema_migrations', 60)")
+    if cur.fetchone()[0] != 1:
+        raise RuntimeError("could not acquire the schema_migrations lock")
+    try:
+        done = applied_versions(cur)
+        applied = []
+        for version, name, step in MIGRATIONS:
+            if version in done or (target is not None and version > target):
+                continue
+            print(f"[MIGRATE] {version}: {name}")
+            step(cur)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            conn.commit()
+            applied.append(version)
+        return applied
+    finally:
+        cur.execute("SELECT RELEASE_LOCK('schema_migrations')")
+        cur.fetchall()
+        cur.close()
+
+
+def main(argv):
+    argv = list(argv)
+    shards = ['main']
+    if "--shard" in argv:
+        i = argv.index("--shard")
+        name = argv[i + 1] if i + 1 < len(argv) else ""
+        del argv[i:i + 2]
+        shards = ['main', *DB_SHARDS] if name == "all" else [name]
+    for shard in shards:
+        if len(shards) > 1:
+            print(f"[MIGRATE] shard {shard}")
+        status = _run(shard, argv)
+        if status:
+            return status
+    return 0
+
+
+def _run(shard, argv):
+    command = argv[0] if argv else "migrate"
+    conn = connect(shard)
+    try:
+        if command == "status":
+            done = applied_versions(conn.cursor(buffered=True))
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:>4}  {'applied' if version in done else 'pending':8} {name}")
+        elif command == "migrate":
+            applied = migrate(conn, int(argv[1]) if len(argv) > 1 else None)
+            print(f"[MIGRATE] applied {len(applied)} migration(s)" if applied else "[MIGRATE] schema is up to date")
+        else:
+            print(__doc__)
+            return 2
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,67 @@
+"""Recompute txn_rollups from the transactions table, one transaction per day.
+
+    python rebuild_rollups.py                                  # every day before today
+    python rebuild_rollups.py --since 2026-09-01 --until 2026-10-01
+
+The charge endpoints keep the rollups current on their own. Run this once
+after migration 9 for older history, and after any write to transactions
+that goes around them (bulk loads, manual corrections). Each day's
+buckets are replaced, so re-running is safe. Days that are still taking
+charges must not be rebuilt: a charge that lands mid-rebuild is lost or
+counted twice. That is why --until defaults to today.
+"""
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+from models.migrations import connect
+from utils.rollups import rebuild_day
+
+
+def _day(value):
+    try:
+        return datetime.combine(date.fromisoformat(value), datetime.min.time())
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected YYYY-MM-DD")
+
+
+def _first_day(conn):
+    cur = conn.cursor(buffered=True)
+    try:
+        cur.execute("SELECT MIN(created_at) FROM transactions")
+        oldest = cur.fetchone()[0]
+    finally:
+        cur.close()
+    if isinstance(oldest, str):
+        oldest = datetime.fromisoformat(oldest)
+    return oldest.replace(hour=0, minute=0, second=0, microsecond=0) if oldest else None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Rebuild transaction rollups from the transactions table")
+    parser.add_argument("--since", type=_day, help="first day to rebuild (default: the oldest transaction)")
+    parser.add_argument("--until", type=_day, help="day to stop before (default: today)")
+    args = parser.parse_args(argv)
+
+    conn = connect()
+    try:
+        day = args.since or _first_day(conn)
+        until = args.until or datetime.combine(date.today(), datetime.min.time())
+        if day is None:
+            print("[ROLLUPS] no transactions")
+            return 0
+        total_txns = total_rows = 0
+        while day < until:
+            txns, rows = rebuild_day(conn, day)
+            total_txns += txns
+            total_rows += rows
+            if txns:
+                print(f"[ROLLUPS] {day:%Y-%m-%d}: {txns} transactions -> {rows} rollup rows")
+            day += timedelta(days=1)
+    finally:
+        conn.close()
+    print(f"[ROLLUPS] rebuilt {total_txns} transactions into {total_rows} rollup rows")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
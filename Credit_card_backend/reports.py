@@ -0,0 +1,95 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import Blueprint, request, session, jsonify
+from db import get_db
+from config import REPORT_MAX_BUCKETS, REPORT_DEFAULT_DAYS
+from utils.decorators import require_role, read_only
+from utils.validation import parse_timestamp
+from utils import rollups, shards
+
+reports_bp = Blueprint('reports', __name__)
+
+
+def _parse_id(name, value):
+    if value is None or value == '':
+        return None
+    if not value.isdigit():
+        raise ValueError(f"{name} must be a positive integer")
+    return int(value)
+
+
+def _card_merchant(cur, card_id):
+    if shards.enabled():
+        return shards.locate(shards.CARD_SQL, (card_id,)).get(card_id, (None,))[0]
+    cur.execute("SELECT c.merchant_id FROM card_vault cv JOIN customers c ON c.customer_id = cv.customer_id "
+                "WHERE cv.card_id = %s", (card_id,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+@reports_bp.get('/reports/transactions')
+@require_role('admin', 'merchant')
+@read_only
+def transaction_report():
+    """Charge counts and amounts for a merchant or one card, in hour or day buckets.
+
+    Query: merchant_id or card_id, interval=hour|day (default day), since
+    and until (ISO 8601, widened to whole buckets, until exclusive; an
+    offset is converted to server local time; default the last
+    REPORT_DEFAULT_DAYS days), currency, status.
+    Merchants get their own figures and may only name their own cards.
+    Served from the rollups only; buckets without charges are left out of
+    the series.
+    """
+    args = request.args
+    interval = args.get('interval', 'day')
+    if interval not in rollups.PERIODS:
+        return jsonify({"error": f"interval must be one of: {', '.join(rollups.PERIODS)}"}), 400
+    try:
+        merchant_id = _parse_id('merchant_id', args.get('merchant_id'))
+        card_id = _parse_id('card_id', args.get('card_id'))
+        until = parse_timestamp('until', args['until']) if args.get('until') else datetime.now()
+        since = (parse_timestamp('since', args['since']) if args.get('since')
+                 else until - timedelta(days=REPORT_DEFAULT_DAYS))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if merchant_id is not None and card_id is not None:
+        return jsonify({"error": "pass merchant_id or card_id, not both"}), 400
+
+    since, until = rollups.floor(since, interval), rollups.ceil(until, interval)
+    if since >= until:
+        return jsonify({"error": "since must be before until"}), 400
+    buckets = (until - since) // rollups.PERIODS[interval][1]
+    if buckets > REPORT_MAX_BUCKETS:
+        return jsonify({"error": f"at most {REPORT_MAX_BUCKETS} {interval} buckets per report, asked for {buckets}"}), 400
+
+    db, cur = get_db()
+    if session.get('user_role') == 'merchant':
+        if merchant_id not in (None, session['user_id']):
+            return jsonify({"error": "Forbidden"}), 403
+        if card_id is None:
+            merchant_id = session['user_id']
+        else:
+            owner = _card_merchant(cur, card_id)
+            if owner is None:
+                return jsonify({"error": "Card not found"}), 404
+            if owner != session['user_id']:
+                return jsonify({"error": "Forbidden"}), 403
+    elif merchant_id is None and card_id is None:
+        return jsonify({"error": "merchant_id or card_id is required"}), 400
+    scope, scope_id = ('card', card_id) if card_id is not None else ('merchant', merchant_id)
+
+    rows = rollups.series(cur, scope, scope_id, interval, since, until,
+                          currency=args.get('currency'), status=args.get('status'))
+    totals = defaultdict(lambda: {'count': 0, 'amount': 0})
+    for r in rows:
+        total = totals[(r['currency'], r['status'])]
+        total['count'] += r['count']
+        total['amount'] += r['amount']
+        r['bucket'] = r['bucket'].isoformat()
+    return jsonify({
+        'scope': scope, 'scope_id': scope_id, 'interval': interval,
+        'since': since.isoformat(), 'until': until.isoformat(),
+        'totals': [{'currency': c, 'status': s, **t} for (c, s), t in sorted(totals.items())],
+        'series': rows,
+    })
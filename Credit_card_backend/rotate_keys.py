@@ -0,0 +1,479 @@
+"""Re-encrypt vault columns under each merchant's current data key.
+
+Walks card_vault and customers in primary-key order, one chunk per
+transaction, spread across worker processes that each hold their own
+connection. Progress is checkpointed in `key_rotation_progress`, so running
+the same --job-id again resumes where a killed run stopped. Rows written by
+the old SQL AES_ENCRYPT path are upgraded to the AES-GCM format on the way.
+
+    python rotate_keys.py --job-id 2026-10 --rotate-deks --workers 4 --max-rows-per-sec 2000
+
+--rotate-deks issues a new data key per merchant first; it is checkpointed
+per merchant too, so a rerun never issues a merchant two keys.
+
+--new-master-key replaces the master key (AES_KEY) with the one in the
+NEW_AES_KEY environment variable. Data keys are re-wrapped under it in one
+transaction, and values under the old master key (key_id 0 and legacy
+AES_ENCRYPT rows) are re-encrypted. The app cannot read either while this
+runs, so stop it first. Afterwards start it with AES_KEY set to the new key,
+and run backfill_blind_index.py --all unless BLIND_INDEX_KEY is set, since
+the blind-index key is otherwise derived from the master key.
+
+    NEW_AES_KEY=... python rotate_keys.py --job-id master-2026-10 --new-master-key
+
+With merchant shards, --shard NAME walks one shard's tables and --shard all
+walks main and then every shard in DB_SHARDS. Data keys live on main, so
+the steps above run there once per job whichever shard comes first; each
+shard checkpoints its own ranges.
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from cryptography.exceptions import InvalidTag
+from config import DB_SHARDS
+from models import migrations
+from utils.crypto import (MASTER_KEY_ID, MASTER_KEY, DecryptionError, key_id_of, encrypt_field, decrypt_field,
+                          _derive_master_key)
+from utils.keystore import keys_for, wrap_key, unwrap_key, rotate_merchant_key
+from utils.shards import MAIN
+
+# table -> (primary key, SELECT returning pk, merchant_id and the encrypted columns, columns)
+TABLES = {
+    "card_vault": (
+        "card_id",
+        """
+        SELECT cv.card_id, c.merchant_id, cv.card_number_enc, cv.card_holder_enc, cv.expiry_date_enc, cv.cvv_enc
+        FROM card_vault cv LEFT JOIN customers c ON c.customer_id = cv.customer_id
+        WHERE cv.card_id > %s AND cv.card_id <= %s ORDER BY cv.card_id LIMIT %s
+        """,
+        ("card_number_enc", "card_holder_enc", "expiry_date_enc", "cvv_enc"),
+    ),
+    "customers": (
+        "customer_id",
+        """
+        SELECT customer_id, merchant_id, email_enc, phone_enc
+        FROM customers WHERE customer_id > %s AND customer_id <= %s ORDER BY customer_id LIMIT %s
+        """,
+        ("email_enc", "phone_enc"),
+    ),
+}
+
+OPEN_END = 2 ** 62
+
+# One-off steps of a job, checkpointed in main's key_rotation_progress next to the table ranges (worker 0)
+ROTATE_DEKS_STEP = "step:rotate_deks"
+NEW_MASTER_KEY_STEP = "step:new_master_key"
+
+CHECKPOINT_DDL = """
+    CREATE TABLE IF NOT EXISTS key_rotation_progress (
+        job_id VARCHAR(64) NOT NULL,
+        table_name VARCHAR(64) NOT NULL,
+        worker INT NOT NULL,
+        range_start BIGINT NOT NULL,
+        range_end BIGINT NOT NULL,
+        last_pk BIGINT NOT NULL,
+        rows_total BIGINT NOT NULL DEFAULT 0,
+        rows_done BIGINT NOT NULL DEFAULT 0,
+        done TINYINT NOT NULL DEFAULT 0,
+        updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (job_id, table_name, worker)
+    )
+"""
+
+
+def connect(shard=MAIN):
+    return migrations.connect(shard)
+
+
+def _step(cur, job_id, step, start):
+    """(last_pk, done) of a step's checkpoint row, creating it when `start`; None if the job never ran the step."""
+    cur.execute("SELECT last_pk, done FROM key_rotation_progress WHERE job_id = %s AND table_name = %s AND worker = 0",
+                (job_id, step))
+    row = cur.fetchone()
+    if row is None and start:
+        cur.execute(
+            "INSERT INTO key_rotation_progress (job_id, table_name, worker, range_start, range_end, last_pk) "
+            "VALUES (%s, %s, 0, 0, %s, 0)",
+            (job_id, step, OPEN_END)
+        )
+        row = (0, 0)
+    return row
+
+
+def _finish_step(cur, job_id, step):
+    cur.execute("UPDATE key_rotation_progress SET done = 1 WHERE job_id = %s AND table_name = %s AND worker = 0",
+                (job_id, step))
+
+
+def issue_data_keys(conn, cur, job_id, last_merchant):
+    """Issue a new data key for every merchant after `last_merchant`, in merchant order.
+
+    Each merchant's checkpoint is committed with its new key, so a resumed
+    job carries on with the next merchant instead of rotating them all again.
+    """
+    cur.execute("SELECT DISTINCT merchant_id FROM data_keys WHERE status = 'Active' AND merchant_id > %s "
+                "ORDER BY merchant_id", (last_merchant,))
+    merchants = [r[0] for r in cur.fetchall()]
+    for merchant_id in merchants:
+        cur.execute(
+            "UPDATE key_rotation_progress SET last_pk = %s, rows_done = rows_done + 1 "
+            "WHERE job_id = %s AND table_name = %s AND worker = 0",
+            (merchant_id, job_id, ROTATE_DEKS_STEP)
+        )
+        rotate_merchant_key(conn, cur, merchant_id)
+    _finish_step(cur, job_id, ROTATE_DEKS_STEP)
+    conn.commit()
+    return len(merchants)
+
+
+def rewrap_data_keys(cur, new_master):
+    """Re-wrap every data key under `new_master`, without committing. Keys already wrapped under it are skipped."""
+    cur.execute("SELECT key_id, merchant_id, wrapped_key FROM data_keys ORDER BY key_id")
+    updates = []
+    for key_id, merchant_id, wrapped in cur.fetchall():
+        try:
+            unwrap_key(wrapped, merchant_id, new_master)
+            continue
+        except InvalidTag:
+            pass
+        try:
+            dek = unwrap_key(wrapped, merchant_id)
+        except InvalidTag:
+            raise ValueError(f"data key {key_id} unwraps under neither AES_KEY nor NEW_AES_KEY") from None
+        updates.append((wrap_key(dek, merchant_id, new_master), key_id))
+    if updates:
+        cur.executemany("UPDATE data_keys SET wrapped_key = %s WHERE key_id = %s", updates)
+    return len(updates)
+
+
+def plan(conn, job_id, tables, workers, rotate_deks, new_master=None, keys_conn=None):
+    """Create the checkpoint rows for a new job (or reuse them when resuming).
+
+    `conn` holds the tables to walk and `keys_conn` (main, where data_keys
+    live) the job's steps; they are the same connection unless sharded.
+    With `new_master`, the data keys are re-wrapped under it before any range
+    is handed out; a job started that way must be resumed with the same key.
+    """
+    keys_conn = conn if keys_conn is None else keys_conn
+    cur = conn.cursor()
+    cur.execute(CHECKPOINT_DDL)
+    kcur = cur if keys_conn is conn else keys_conn.cursor()
+    if kcur is not cur:
+        kcur.execute(CHECKPOINT_DDL)
+    cur.execute("SELECT COUNT(*) FROM key_rotation_progress WHERE job_id = %s", (job_id,))
+    resuming = cur.fetchone()[0] > 0
+    kcur.execute("SELECT COUNT(*) FROM key_rotation_progress WHERE job_id = %s", (job_id,))
+    started = kcur.fetchone()[0] > 0
+
+    deks_step = _step(kcur, job_id, ROTATE_DEKS_STEP, rotate_deks and not started)
+    master_step = _step(kcur, job_id, NEW_MASTER_KEY_STEP, new_master is not None and not started)
+    keys_conn.commit()
+    try:
+        if (master_step is not None) != (new_master is not None):
+            raise ValueError(f"job {job_id} was {'' if master_step else 'not '}started with --new-master-key; "
+                             "resume it the same way")
+        if deks_step is not None and not deks_step[1]:
+            print(f"[ROTATE] issued new data keys for {issue_data_keys(keys_conn, kcur, job_id, deks_step[0])} merchants")
+        if new_master is not None:
+            # Idempotent, so it runs on every resume: that also checks NEW_AES_KEY is the key the job started with
+            rewrapped = rewrap_data_keys(kcur, new_master)
+            _finish_step(kcur, job_id, NEW_MASTER_KEY_STEP)
+            keys_conn.commit()
+            print(f"[ROTATE] re-wrapped {rewrapped} data keys under the new master key")
+    finally:
+        if kcur is not cur:
+            kcur.close()
+
+    for table in tables:
+        pk = TABLES[table][0]
+        cur.execute("SELECT COUNT(*) FROM key_rotation_progress WHERE job_id = %s AND table_name = %s", (job_id, table))
+        if cur.fetchone()[0]:
+            continue
+        cur.execute(f"SELECT MIN({pk}), MAX({pk}) FROM {table}")
+        lo, hi = cur.fetchone()
+        if lo is None:
+            continue
+        step = -(-(hi - lo + 1) // workers)
+        for w in range(workers):
+            start = lo - 1 + w * step
+            end = min(hi, start + step)
+            if start >= end:
+                break
+            if end == hi:
+                # Leave the last range open so rows inserted during the run are covered too
+                end = OPEN_END
+            cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {pk} > %s AND {pk} <= %s", (start, end))
+            total = cur.fetchone()[0]
+            cur.execute(
+                "INSERT INTO key_rotation_progress (job_id, table_name, worker, range_start, range_end, last_pk, rows_total) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                (job_id, table, w, start, end, start, total)
+            )
+    conn.commit()
+    if resuming:
+        print(f"[ROTATE] resuming job {job_id}")
+
+    cur.execute(
+        "SELECT table_name, worker, last_pk, range_end, rows_done, rows_total, done FROM key_rotation_progress "
+        "WHERE job_id = %s ORDER BY table_name, worker",
+        (job_id,)
+    )
+    ranges = [r for r in cur.fetchall() if r[0] in tables]
+    cur.close()
+    return ranges
+
+
+class _TargetKeys:
+    """Per-process lookup of each merchant's active data key, unwrapped with `master_key`."""
+
+    def __init__(self, cur, master_key=MASTER_KEY):
+        self.cur = cur
+        self.master_key = master_key
+        self.keys = {}
+
+    def get(self, merchant_id):
+        if merchant_id is None:
+            return MASTER_KEY_ID, self.master_key
+        if merchant_id not in self.keys:
+            self.cur.execute(
+                "SELECT key_id, wrapped_key FROM data_keys WHERE merchant_id = %s AND status = 'Active' "
+                "ORDER BY key_id DESC LIMIT 1",
+                (merchant_id,)
+            )
+            row = self.cur.fetchone()
+            # Merchants that never got a DEK keep using the master key
+            self.keys[merchant_id] = ((row[0], unwrap_key(row[1], merchant_id, self.master_key)) if row
+                                      else (MASTER_KEY_ID, self.master_key))
+        return self.keys[merchant_id]
+
+
+def _decrypt(value, keys, new_master=None):
+    try:
+        return decrypt_field(value, keys)
+    except DecryptionError:
+        # A --new-master-key job that is run again finds master-key values it already moved
+        if new_master is None or key_id_of(value) != MASTER_KEY_ID:
+            raise
+        return decrypt_field(value, keys, new_master)
+
+
+def _settled(values, key_id, new_master=None):
+    """True if a row's values need no re-encryption."""
+    if new_master is None:
+        return all(v is None or key_id_of(v) == key_id for v in values)
+    # Data keys were re-wrapped, not replaced: only values under the old master key move
+    return all(v is None or key_id_of(v) not in (None, MASTER_KEY_ID) for v in values)
+
+
+def reencrypt_range(job_id, table, worker, last_pk, range_end, chunk_size, rows_per_sec, progress, new_master=None,
+                    shard=MAIN):
+    pk, select_sql, columns = TABLES[table]
+    update_sql = f"UPDATE {table} SET {', '.join(c + ' = %s' for c in columns)} WHERE {pk} = %s"
+    master = MASTER_KEY if new_master is None else new_master
+    conn = connect(shard)
+    cur = conn.cursor(buffered=True)
+    # Data keys are read from main
+    keys_conn = conn if shard == MAIN else connect(MAIN)
+    kcur = cur if keys_conn is conn else keys_conn.cursor(buffered=True)
+    targets = _TargetKeys(kcur, master)
+    try:
+        while last_pk < range_end:
+            started = time.time()
+            cur.execute(select_sql, (last_pk, range_end, chunk_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            keys = keys_for(kcur, (v for r in rows for v in r[2:]), master)
+            if keys_conn is not conn:
+                keys_conn.rollback()
+            updates, failed = [], 0
+            for row in rows:
+                key_id, key = targets.get(row[1])
+                values = row[2:]
+                if _settled(values, key_id, new_master):
+                    continue
+                try:
+                    plain = [_decrypt(v, keys, new_master) for v in values]
+                except DecryptionError as e:
+                    print(f"[ROTATE] {table} {row[0]}: {e}")
+                    failed += 1
+                    continue
+                if any(p is None and v is not None for p, v in zip(plain, values)):
+                    failed += 1
+                    continue
+                updates.append(tuple(encrypt_field(p, key, key_id) for p in plain) + (row[0],))
+            if updates:
+                cur.executemany(update_sql, updates)
+            last_pk = rows[-1][0]
+            cur.execute(
+                "UPDATE key_rotation_progress SET last_pk = %s, rows_done = rows_done + %s "
+                "WHERE job_id = %s AND table_name = %s AND worker = %s",
+                (last_pk, len(rows), job_id, table, worker)
+            )
+            conn.commit()
+            progress.put((len(rows), len(updates), failed))
+
+            # Rate limit: each worker gets an equal share of --max-rows-per-sec
+            if rows_per_sec:
+                pause = len(rows) / rows_per_sec - (time.time() - started)
+                if pause > 0:
+                    time.sleep(pause)
+        cur.execute(
+            "UPDATE key_rotation_progress SET done = 1 WHERE job_id = %s AND table_name = %s AND worker = %s",
+            (job_id, table, worker)
+        )
+        conn.commit()
+    finally:
+        if keys_conn is not conn:
+            kcur.close()
+            keys_conn.close()
+        cur.close()
+        conn.close()
+
+
+def _worker(job_id, tasks, chunk_size, rows_per_sec, progress, new_master=None, shard=MAIN):
+    # Blocking get: a None sentinel, one per process, ends the loop. get_nowait() could see
+    # an empty queue before the parent's feeder thread has flushed the tasks.
+    for table, worker, last_pk, range_end in iter(tasks.get, None):
+        reencrypt_range(job_id, table, worker, last_pk, range_end, chunk_size, rows_per_sec, progress, new_master,
+                        shard)
+
+
+def unfinished(conn, job_id, tables):
+    """(table, worker) of every range of the job that is not marked done."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT table_name, worker FROM key_rotation_progress WHERE job_id = %s AND done = 0 "
+                    "ORDER BY table_name, worker", (job_id,))
+        return [r for r in cur.fetchall() if r[0] in tables]
+    finally:
+        cur.close()
+
+
+def _fmt_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s"
+
+
+def _rotate(args, shard, tables, new_master):
+    """Run (or resume) the job on one shard; returns the exit status."""
+    conn = connect(shard)
+    keys_conn = conn if shard == MAIN else connect(MAIN)
+    try:
+        ranges = plan(conn, args.job_id, tables, max(1, args.workers), args.rotate_deks, new_master, keys_conn)
+    finally:
+        if keys_conn is not conn:
+            keys_conn.close()
+        conn.close()
+
+    total = sum(r[5] for r in ranges)
+    done_before = sum(r[4] for r in ranges)
+    tasks = multiprocessing.Queue()
+    pending = [r for r in ranges if not r[6]]
+    for table, worker, last_pk, range_end, _, _, _ in pending:
+        tasks.put((table, worker, last_pk, range_end))
+    if not pending:
+        print(f"[ROTATE] job {args.job_id} already complete ({done_before} rows)")
+        return 0
+
+    n = min(args.workers, len(pending))
+    for _ in range(n):
+        tasks.put(None)
+    per_worker_rate = args.max_rows_per_sec / n if args.max_rows_per_sec else 0
+    progress = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_worker, args=(args.job_id, tasks, args.chunk_size, per_worker_rate, progress,
+                                                           new_master, shard))
+             for _ in range(n)]
+    for p in procs:
+        p.start()
+
+    started = time.time()
+    scanned = updated = failed = 0
+    last_report = started
+    while any(p.is_alive() for p in procs) or not progress.empty():
+        try:
+            rows, upd, bad = progress.get(timeout=0.5)
+            scanned += rows
+            updated += upd
+            failed += bad
+        except queue.Empty:
+            pass
+        now = time.time()
+        if now - last_report >= args.report_every:
+            last_report = now
+            rate = scanned / (now - started) if now > started else 0
+            remaining = max(total - done_before - scanned, 0)
+            eta = _fmt_eta(remaining / rate) if rate else "?"
+            print(f"[ROTATE] {done_before + scanned}/{total} rows, {updated} re-encrypted, "
+                  f"{failed} unreadable, {rate:.0f} rows/s, ETA {eta}")
+    for p in procs:
+        p.join()
+
+    elapsed = time.time() - started
+    rate = scanned / elapsed if elapsed else 0
+    # The checkpoint table, not the exit codes, says whether every range was walked to its end
+    conn = connect(shard)
+    try:
+        left = unfinished(conn, args.job_id, tables)
+    finally:
+        conn.close()
+    exit_codes = [p.exitcode for p in procs]
+    if left:
+        status = (f"incomplete, {len(left)} range(s) not done: "
+                  f"{', '.join(f'{t}#{w}' for t, w in left)} (worker exit codes {exit_codes}); "
+                  f"run again with --job-id {args.job_id} to resume")
+    elif new_master is not None:
+        status = "finished; start the app with AES_KEY set to the new key"
+    else:
+        status = "finished"
+    print(f"[ROTATE] {status}: scanned {scanned} rows in {elapsed:.1f}s ({rate:.0f} rows/s), "
+          f"{updated} re-encrypted, {failed} unreadable")
+    return 1 if left else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-encrypt card_vault/customers under the current data keys")
+    parser.add_argument("--job-id", required=True, help="name of the run; reuse it to resume")
+    parser.add_argument("--tables", default="card_vault,customers")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--max-rows-per-sec", type=float, default=0, help="total across workers, 0 = unlimited")
+    parser.add_argument("--rotate-deks", action="store_true", help="issue a new data key per merchant before starting")
+    parser.add_argument("--new-master-key", action="store_true",
+                        help="move from AES_KEY to the master key in the NEW_AES_KEY environment variable")
+    parser.add_argument("--shard", default=MAIN, help="shard to walk, or 'all' for main and every shard in DB_SHARDS")
+    parser.add_argument("--report-every", type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    tables = [t.strip() for t in args.tables.split(",") if t.strip()]
+    unknown = [t for t in tables if t not in TABLES]
+    if unknown:
+        parser.error(f"unknown table(s): {', '.join(unknown)}")
+    shards = [MAIN, *DB_SHARDS] if args.shard == "all" else [args.shard]
+    if any(s != MAIN and s not in DB_SHARDS for s in shards):
+        parser.error(f"unknown shard {args.shard!r}; DB_SHARDS has: {', '.join(DB_SHARDS) or 'none'}")
+
+    new_master = None
+    if args.new_master_key:
+        if not os.getenv('NEW_AES_KEY'):
+            parser.error("--new-master-key needs the new key in the NEW_AES_KEY environment variable")
+        new_master = _derive_master_key(os.environ['NEW_AES_KEY'])
+        if new_master == MASTER_KEY:
+            parser.error("NEW_AES_KEY is the current master key")
+
+    status = 0
+    for shard in shards:
+        if len(shards) > 1:
+            print(f"[ROTATE] shard {shard}")
+        try:
+            status = _rotate(args, shard, tables, new_master) or status
+        except ValueError as e:
+            parser.error(str(e))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
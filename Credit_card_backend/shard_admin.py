@@ -0,0 +1,281 @@
+"""Merchant shards: show the map, check the layout, move a merchant online.
+
+    python shard_admin.py map                       # merchants placed off main, and per-shard row counts
+    python shard_admin.py check                     # schema versions, id spacing, merchant row copies
+    python shard_admin.py move 42 s2 --dry-run      # what a move would copy
+    python shard_admin.py move 42 s2                # move merchant 42's customers and cards to shard s2
+
+A move keeps the merchant readable throughout; its writes get 503 with
+Retry-After for the few seconds between marking it 'moving' and flipping
+the map:
+
+1. mark the merchant 'moving' and wait SHARD_MAP_TTL + --settle seconds,
+   so every worker has seen it and in-flight writes have committed
+2. remove leftovers of an earlier failed move from the target
+3. copy the merchants row, customers and cards to the target, keeping ids
+4. compare row counts and checksums on both shards
+5. point the map at the target, then wait SHARD_MAP_TTL for cached entries
+6. delete the rows from the source (main's master merchants row stays)
+
+Until step 5 the map names the source, which serves every read; a failure
+there puts the merchant back to 'active' on the source. Re-running a move
+that was killed is safe; after the map has flipped it just removes what
+is left on the source. Change events stay in the outbox of the shard
+they were written on.
+"""
+import argparse
+import hashlib
+import sys
+import time
+from config import DB_ENGINE, DB_SHARDS, SHARD_MAP_TTL
+from models.migrations import connect, applied_versions
+from utils.shards import MAIN, ACTIVE, MOVING, names
+
+# Rows that belong to one merchant on a shard, in a stable order
+ROWS_SQL = {
+    "merchants": "SELECT * FROM merchants WHERE merchant_id = %s",
+    "customers": "SELECT * FROM customers WHERE merchant_id = %s ORDER BY customer_id",
+    "card_vault": ("SELECT cv.* FROM card_vault cv JOIN customers c ON c.customer_id = cv.customer_id "
+                   "WHERE c.merchant_id = %s ORDER BY cv.card_id"),
+}
+DELETE_SQL = {
+    "card_vault": "DELETE FROM card_vault WHERE customer_id IN (SELECT customer_id FROM customers WHERE merchant_id = %s)",
+    "customers": "DELETE FROM customers WHERE merchant_id = %s",
+    "merchants": "DELETE FROM merchants WHERE merchant_id = %s",
+}
+
+
+class MoveError(Exception):
+    pass
+
+
+def _query(conn, sql, params=()):
+    cur = conn.cursor(buffered=True)
+    try:
+        cur.execute(sql, params)
+        return [desc[0] for desc in cur.description], cur.fetchall()
+    finally:
+        cur.close()
+
+
+def _placement(main, merchant_id):
+    _, rows = _query(main, "SELECT shard, state FROM merchant_shards WHERE merchant_id = %s", (merchant_id,))
+    return rows[0] if rows else (MAIN, ACTIVE)
+
+
+def _set_placement(main, merchant_id, shard, state):
+    cur = main.cursor()
+    try:
+        cur.execute("DELETE FROM merchant_shards WHERE merchant_id = %s", (merchant_id,))
+        # Merchants without a row are on main
+        if shard != MAIN or state != ACTIVE:
+            cur.execute("INSERT INTO merchant_shards (merchant_id, shard, state) VALUES (%s, %s, %s)",
+                        (merchant_id, shard, state))
+        main.commit()
+    finally:
+        cur.close()
+
+
+def _tables(shard):
+    # main's merchants row is the master list entry and is never copied over or deleted
+    return ("merchants", "customers", "card_vault") if shard != MAIN else ("customers", "card_vault")
+
+
+def _checksum(rows):
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(repr([bytes(v) if isinstance(v, (bytes, bytearray, memoryview)) else str(v)
+                            for v in row]).encode())
+    return len(rows), digest.hexdigest()
+
+
+def _delete(conn, merchant_id, tables):
+    cur = conn.cursor()
+    try:
+        for table in ("card_vault", "customers", "merchants"):
+            if table in tables:
+                cur.execute(DELETE_SQL[table], (merchant_id,))
+        conn.commit()
+    finally:
+        cur.close()
+
+
+def _copy(source, target, merchant_id, tables, batch_size):
+    cur = target.cursor()
+    try:
+        for table in tables:
+            # The master row on main is the copy's source when moving off main
+            columns, rows = _query(source, ROWS_SQL[table], (merchant_id,))
+            if not rows:
+                continue
+            sql = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                   f"VALUES ({', '.join(['%s'] * len(columns))})")
+            for i in range(0, len(rows), batch_size):
+                cur.executemany(sql, [tuple(r) for r in rows[i:i + batch_size]])
+            print(f"[SHARD] copied {len(rows)} {table} rows")
+        target.commit()
+    except Exception:
+        target.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def _verify(source, target, merchant_id, tables):
+    for table in tables:
+        expected = _checksum(_query(source, ROWS_SQL[table], (merchant_id,))[1])
+        found = _checksum(_query(target, ROWS_SQL[table], (merchant_id,))[1])
+        if expected != found:
+            raise MoveError(f"{table}: source has {expected[0]} rows ({expected[1][:12]}), "
+                            f"target has {found[0]} ({found[1][:12]})")
+        print(f"[SHARD] {table}: {found[0]} rows match")
+
+
+def _remove_leftovers(merchant_id, home):
+    # Rows a killed move left behind on other shards; reads already ignore them
+    for shard in names():
+        if shard == home:
+            continue
+        conn = connect(shard)
+        try:
+            if _query(conn, ROWS_SQL["customers"], (merchant_id,))[1]:
+                _delete(conn, merchant_id, _tables(shard))
+                print(f"[SHARD] removed merchant {merchant_id}'s leftover rows from {shard}")
+        finally:
+            conn.close()
+
+
+def cmd_map(args):
+    main = connect()
+    try:
+        _, rows = _query(main, "SELECT merchant_id, shard, state, updated_at FROM merchant_shards ORDER BY merchant_id")
+    finally:
+        main.close()
+    for merchant_id, shard, state, updated_at in rows:
+        print(f"  merchant {merchant_id:<8} {shard:<12} {state:<8} since {updated_at}")
+    print(f"[SHARD] {len(rows)} merchant(s) placed explicitly; all others are on {MAIN}")
+    for shard in names():
+        conn = connect(shard)
+        try:
+            counts = {t: _query(conn, f"SELECT COUNT(*) FROM {t}")[1][0][0] for t in ("customers", "card_vault")}
+        finally:
+            conn.close()
+        print(f"  {shard:<12} {counts['customers']:>10} customers  {counts['card_vault']:>10} cards")
+    return 0
+
+
+def cmd_check(args):
+    problems = 0
+    versions, spacing = {}, {}
+    main = connect()
+    try:
+        _, placed = _query(main, "SELECT merchant_id, shard FROM merchant_shards")
+        for shard in names():
+            conn = connect(shard)
+            try:
+                versions[shard] = max(applied_versions(conn.cursor(buffered=True)) or {0})
+                if DB_ENGINE != 'sqlite':
+                    spacing[shard] = _query(conn, "SELECT @@auto_increment_increment, @@auto_increment_offset")[1][0]
+                missing = [m for m, s in placed if s == shard and not _query(conn, ROWS_SQL["merchants"], (m,))[1]]
+            finally:
+                conn.close()
+            if missing:
+                problems += 1
+                print(f"[SHARD] {shard}: no merchants row for mapped merchant(s) {missing}")
+    finally:
+        main.close()
+    if len(set(versions.values())) > 1:
+        problems += 1
+        print(f"[SHARD] schema versions differ: {versions}; run python -m models.migrations --shard all")
+    if DB_ENGINE == 'sqlite':
+        print("[SHARD] SQLite has no auto_increment spacing: keep shard id ranges apart by hand")
+    elif len(names()) > 1:
+        increments = {inc for inc, _ in spacing.values()}
+        offsets = [off for _, off in spacing.values()]
+        if len(increments) != 1 or increments.pop() < len(spacing) or len(set(offsets)) != len(offsets):
+            problems += 1
+            print(f"[SHARD] ids can collide across shards, (increment, offset) per shard: {spacing}; give every "
+                  f"shard the same auto_increment_increment (>= {len(spacing)}) and its own auto_increment_offset")
+    print(f"[SHARD] {problems} problem(s)" if problems else "[SHARD] layout ok")
+    return 1 if problems else 0
+
+
+def cmd_move(args):
+    if args.target not in names():
+        print(f"[SHARD] unknown shard {args.target!r}; DB_SHARDS has: {', '.join(DB_SHARDS) or 'none'}")
+        return 2
+    main = connect()
+    try:
+        _, merchant = _query(main, ROWS_SQL["merchants"], (args.merchant_id,))
+        if not merchant:
+            print(f"[SHARD] merchant {args.merchant_id} does not exist")
+            return 1
+        source, state = _placement(main, args.merchant_id)
+        if source == args.target:
+            print(f"[SHARD] merchant {args.merchant_id} is already on {source}")
+            if not args.dry_run:
+                if state == MOVING:
+                    _set_placement(main, args.merchant_id, source, ACTIVE)
+                _remove_leftovers(args.merchant_id, source)
+            return 0
+        source_conn, target_conn = connect(source), connect(args.target)
+        try:
+            if args.dry_run:
+                for table in _tables(args.target):
+                    count = len(_query(main if table == "merchants" else source_conn,
+                                       ROWS_SQL[table], (args.merchant_id,))[1])
+                    print(f"[SHARD] would copy {count} {table} rows from {source} to {args.target}")
+                return 0
+            return _move(main, source_conn, target_conn, args.merchant_id, source, args.target, state, args)
+        finally:
+            source_conn.close()
+            target_conn.close()
+    finally:
+        main.close()
+
+
+def _move(main, source_conn, target_conn, merchant_id, source, target, state, args):
+    print(f"[SHARD] moving merchant {merchant_id}: {source} -> {target}"
+          + (" (resuming an unfinished move)" if state == MOVING else ""))
+    _set_placement(main, merchant_id, source, MOVING)
+    try:
+        time.sleep(SHARD_MAP_TTL + args.settle)
+        _delete(target_conn, merchant_id, _tables(target))
+        _copy(source_conn, target_conn, merchant_id, ("customers", "card_vault"), args.batch_size)
+        if target != MAIN:
+            _copy(main, target_conn, merchant_id, ("merchants",), args.batch_size)
+        _verify(source_conn, target_conn, merchant_id, ("customers", "card_vault"))
+    except Exception as e:
+        _set_placement(main, merchant_id, source, ACTIVE)
+        print(f"[SHARD] move failed, merchant {merchant_id} stays on {source}: {e}")
+        return 1
+    _set_placement(main, merchant_id, target, ACTIVE)
+    print(f"[SHARD] map now points at {target}; waiting {SHARD_MAP_TTL}s before removing the old rows")
+    time.sleep(SHARD_MAP_TTL)
+    _delete(source_conn, merchant_id, _tables(source))
+    print(f"[SHARD] merchant {merchant_id} moved to {target}")
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Merchant shard map and moves")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("map", help="show placed merchants and per-shard row counts").set_defaults(func=cmd_map)
+    sub.add_parser("check", help="check schema versions, id spacing and merchant copies").set_defaults(func=cmd_check)
+
+    p = sub.add_parser("move", help="move a merchant's customers and cards to another shard")
+    p.add_argument("merchant_id", type=int)
+    p.add_argument("target", help="shard name, or main")
+    p.add_argument("--settle", type=float, default=2.0,
+                   help="extra seconds to wait for writes started before the merchant was marked moving")
+    p.add_argument("--batch-size", type=int, default=500)
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=cmd_move)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,82 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+import pytest
+
+# The app reads its settings at import time: run everything on the embedded SQLite engine,
+# with the database and the files the app writes in a directory of the test run's own
+_TMP = tempfile.mkdtemp(prefix="vault-tests-")
+os.environ.setdefault("DB_ENGINE", "sqlite")
+os.environ.setdefault("AUDIT_ASYNC", "false")
+os.environ["SQLITE_PATH"] = os.path.join(_TMP, "vault.sqlite3")
+os.environ["TABLE_VERSIONS_PATH"] = os.path.join(_TMP, "table-versions")
+os.environ["AUDIT_ARCHIVE_DIR"] = os.path.join(_TMP, "audit_archive")
+os.environ["AUDIT_SPOOL_DIR"] = os.path.join(_TMP, "audit_spool")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = "test-pass-123"
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_TMP, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def vault():
+    """The app's database, seeded once per run by bench/seed.py; returns its manifest.
+
+    Two merchants with two customers each; every customer has one card with
+    two transactions. Tests add their own rows on top and must not assume
+    they are alone.
+    """
+    from bench import seed
+    from models.migrations import connect, migrate
+    conn = connect()
+    cur = conn.cursor()
+    try:
+        migrate(conn)
+        return seed.seed(conn, cur, argparse.Namespace(merchants=2, customers=2, cards=1, transactions=2, days=3,
+                                                       seed=7, password=PASSWORD, batch_size=100))
+    finally:
+        cur.close()
+        conn.close()
+
+
+@pytest.fixture
+def client(vault):
+    from app import app
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """login(username) signs the test client in as a seeded user."""
+    def sign_in(username):
+        response = client.post('/login', json={'username': username, 'password': PASSWORD})
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+    return sign_in
+
+
+@pytest.fixture
+def store_card(client):
+    """store_card(customer_id, number=None) posts a card to /card/store; returns (response, number)."""
+    def post(customer_id, number=None):
+        number = number or "4" + str(uuid.uuid4().int)[:15]
+        response = client.post('/card/store', json={'customer_id': customer_id, 'card': number,
+                                                    'exp': '12/30', 'cvv': '123'})
+        return response, number
+    return post
+
+
+@pytest.fixture
+def sqlite_conn(tmp_path):
+    """A connection to an empty database of the test's own, with the full schema."""
+    from utils.sqlite_engine import connect
+    conn = connect(path=str(tmp_path / "own.sqlite3"))
+    yield conn
+    conn.close()
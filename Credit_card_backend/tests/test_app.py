@@ -0,0 +1,29 @@
+import app as app_module
+
+
+def test_login_rejects_a_wrong_password(client, vault):
+    response = client.post('/login', json={'username': vault['admin']['username'], 'password': 'nope'})
+    assert response.status_code == 401
+    assert 'Server-Timing' in response.headers
+
+
+def test_login_keeps_its_deprecated_timings_behind_a_flag(client, login, vault, monkeypatch):
+    body = login(vault['admin']['username'])
+    assert set(body['timings']) == {'total_s', 'db_connect_s', 'db_query_s'}
+
+    monkeypatch.setattr(app_module, "LOGIN_DEBUG_TIMINGS", False)
+    response = client.post('/login', json={'username': vault['admin']['username'], 'password': 'nope'})
+    assert 'timings' not in response.get_json()
+    assert 'X-Debug-Timings' not in response.headers
+
+
+def test_metrics_needs_a_token(client, vault, monkeypatch):
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", None)
+    assert client.get('/metrics').status_code == 404
+
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", "s3cret")
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert b'vault_db_pool_' in response.data
@@ -0,0 +1,15 @@
+from datetime import datetime, timedelta, timezone
+
+
+def test_audit_filters_accept_timezone_offsets(client, login, vault):
+    login(vault['admin']['username'])
+    started = datetime.now(timezone.utc) - timedelta(seconds=1)
+    assert client.post('/charge', json={'card_id': vault['merchants'][0]['card_ids'][0], 'amount': 1}).status_code == 200
+    since = started.astimezone(timezone(timedelta(hours=5, minutes=30))).isoformat()
+    logs = client.get('/audit', query_string={'action_type': 'CHARGE', 'since': since}).get_json()['logs']
+    assert logs[0]['user_id'] == vault['admin']['user_id']
+    local = started.astimezone().replace(tzinfo=None)
+    assert all(datetime.fromisoformat(log['created_at']) >= local.replace(microsecond=0) for log in logs)
+    later = (started + timedelta(hours=1)).isoformat()
+    assert client.get('/audit', query_string={'since': later}).get_json()['logs'] == []
+    assert client.get('/audit?since=soon').status_code == 400
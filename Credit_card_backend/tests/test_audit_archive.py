@@ -0,0 +1,77 @@
+from datetime import datetime, timezone
+import pytest
+from utils import audit_archive
+from utils.audit_filters import parse_filters, filter_sql, matches
+
+THIS_MONTH = audit_archive.month_start(datetime.now())
+# (created_at, user_id, action_type): the first three are past a two month hot window
+EVENTS = [
+    (audit_archive.add_months(THIS_MONTH, -3).replace(day=2, hour=8), 1, "INSERT"),
+    (audit_archive.add_months(THIS_MONTH, -3).replace(day=28, hour=23, minute=59), 2, "CHARGE"),
+    (audit_archive.add_months(THIS_MONTH, -2).replace(day=10, hour=12), 1, "CHARGE"),
+    (THIS_MONTH, 2, "INSERT"),
+]
+
+
+def _audit(conn):
+    cur = conn.cursor()
+    cur.executemany("INSERT INTO audit_logs (user_id, table_name, action_type, record_id, ip_address, created_at) "
+                    "VALUES (%s, 'card_vault', %s, 7, '127.0.0.1', %s)",
+                    [(user_id, action, created_at) for created_at, user_id, action in EVENTS])
+    conn.commit()
+    return cur
+
+
+def test_archive_round_trip(sqlite_conn, tmp_path):
+    cur = _audit(sqlite_conn)
+    assert audit_archive.archive_bounds(cur, 2) == [audit_archive.add_months(THIS_MONTH, -2),
+                                                    audit_archive.add_months(THIS_MONTH, -1)]
+
+    written = audit_archive.archive(sqlite_conn, str(tmp_path), 2, log=lambda line: None)
+    assert [m['rows'] for m in written] == [2, 1]
+    cur.execute("SELECT COUNT(*) FROM audit_logs")
+    assert cur.fetchone()[0] == 1
+
+    records = list(audit_archive.read_archive(str(tmp_path), {}, verify=True))
+    assert [(r['user_id'], r['action_type'], r['created_at']) for r in records] == [
+        (user_id, action, created_at.isoformat()) for created_at, user_id, action in EVENTS[:3]]
+    assert list(audit_archive.read_archive(str(tmp_path), {'user_id': 2})) == records[1:2]
+    assert list(audit_archive.read_archive(str(tmp_path), {'since': EVENTS[2][0]})) == records[2:]
+
+
+def test_late_rows_get_a_second_segment(sqlite_conn, tmp_path):
+    _audit(sqlite_conn)
+    bound = audit_archive.add_months(THIS_MONTH, -2)
+    month = f"{audit_archive.add_months(bound, -1):%Y%m}"
+    first = audit_archive.export_segment(sqlite_conn, bound, str(tmp_path))
+    second = audit_archive.export_segment(sqlite_conn, bound, str(tmp_path))
+    assert (first['segment'], second['segment']) == (f"audit-{month}-001", f"audit-{month}-002")
+    assert [m['segment'] for m in audit_archive.segments(str(tmp_path))] == [first['segment'], second['segment']]
+
+
+def test_corrupt_segment_fails_verification(sqlite_conn, tmp_path):
+    _audit(sqlite_conn)
+    manifest = audit_archive.export_segment(sqlite_conn, THIS_MONTH, str(tmp_path))
+    with open(manifest['path'], "r+b") as f:
+        f.seek(-12, 2)
+        f.write(b"\0" * 4)
+    with pytest.raises(audit_archive.ArchiveError):
+        audit_archive.verify_segment(manifest)
+
+
+def test_filters_accept_timezone_aware_bounds():
+    since = datetime(2026, 3, 30, 12, tzinfo=timezone.utc)
+    filters = parse_filters({'since': since.isoformat().replace("+00:00", "Z"), 'action_type': 'CHARGE'})
+    local = since.astimezone().replace(tzinfo=None)
+    assert filters == {'action_type': 'CHARGE', 'since': local}
+    assert filter_sql(filters) == (["action_type = %s", "created_at >= %s"], ['CHARGE', local])
+    record = {'action_type': 'CHARGE', 'created_at': local.isoformat()}
+    assert matches(filters, record)
+    assert not matches(filters, dict(record, created_at=datetime(2026, 3, 1).isoformat()))
+
+
+def test_filters_reject_bad_input():
+    with pytest.raises(ValueError, match="since must be an ISO 8601 timestamp"):
+        parse_filters({'since': 'yesterday'})
+    with pytest.raises(ValueError, match="user_id must be an integer"):
+        parse_filters({'user_id': 'me'})
@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+from utils.logger import AuditWriter
+
+
+def _dead_pid():
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    return child.pid
+
+
+def _spool(path, *rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps([row]) + "\n" for row in rows)
+
+
+def test_replay_leaves_live_workers_spools_alone(tmp_path, monkeypatch):
+    writer = AuditWriter(spool_dir=str(tmp_path), flush_interval=0.05)
+    written = []
+    monkeypatch.setattr(writer, "_write", written.extend)
+    live, dead = os.getppid(), _dead_pid()
+    _spool(tmp_path / f"audit-spool-{writer.pid}.ndjson", "own")
+    _spool(tmp_path / f"audit-spool-{live}.ndjson", "live worker")
+    _spool(tmp_path / f"audit-spool-{dead}.ndjson", "dead worker")
+    # Claimed by a worker that died mid-replay, and by one that is still replaying
+    _spool(tmp_path / f"audit-spool-{live}.ndjson.replaying-{dead}", "dead replayer")
+    _spool(tmp_path / f"audit-spool-{dead}.ndjson.replaying-{live}", "live replayer")
+    try:
+        writer._replay_spools()
+    finally:
+        writer.close()
+
+    assert sorted(row for row, in written) == ["dead replayer", "dead worker", "own"]
+    assert writer.stats["replayed"] == 3
+    assert sorted(os.listdir(tmp_path)) == sorted([f"audit-spool-{live}.ndjson",
+                                                   f"audit-spool-{dead}.ndjson.replaying-{live}"])
+
+
+def test_failed_replay_gives_the_rows_back(tmp_path, monkeypatch):
+    writer = AuditWriter(spool_dir=str(tmp_path), flush_interval=0.05)
+
+    def fail(rows):
+        raise OSError("database is down")
+
+    monkeypatch.setattr(writer, "_write", fail)
+    _spool(tmp_path / f"audit-spool-{_dead_pid()}.ndjson", "a", "b")
+    try:
+        writer._replay_spools()
+    finally:
+        writer.close()
+    assert os.listdir(tmp_path) == [os.path.basename(writer.spool_path)]
+    with open(writer.spool_path, encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == [["a"], ["b"]]
@@ -0,0 +1,54 @@
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+import backfill_blind_index
+from utils import keystore
+from utils.crypto import blind_index, encrypt_field
+from utils.keystore import wrap_key
+from utils.sqlite_engine import connect
+
+# Well clear of the key ids in the app's database, which share the keystore's cache
+KEY_ID = 910
+
+
+@pytest.fixture
+def shards(sqlite_conn, tmp_path, monkeypatch):
+    """main (with the data key) and shard s1 (with the rows); returns their connections."""
+    dek = AESGCM.generate_key(bit_length=256)
+    cur = sqlite_conn.cursor()
+    cur.execute("INSERT INTO data_keys (key_id, merchant_id, wrapped_key, status) VALUES (%s, 2, %s, 'Active')",
+                (KEY_ID, wrap_key(dek, 2)))
+    sqlite_conn.commit()
+    shard = connect(path=str(tmp_path / "s1.sqlite3"))
+    cur = shard.cursor()
+    cur.execute("INSERT INTO customers (customer_id, merchant_id, first_name, email_enc) VALUES (3, 2, 'Ada', %s)",
+                (encrypt_field("Ada@Example.com", dek, KEY_ID),))
+    cur.execute("INSERT INTO card_vault (card_id, customer_id, card_number_enc) VALUES (1, 3, %s)",
+                (encrypt_field("4111111111111111", dek, KEY_ID),))
+    shard.commit()
+    paths = {"main": tmp_path / "own.sqlite3", "s1": tmp_path / "s1.sqlite3"}
+    monkeypatch.setattr(backfill_blind_index, "connect", lambda shard="main": connect(path=str(paths[shard]),
+                                                                                     bootstrap=False))
+    monkeypatch.setattr(backfill_blind_index, "DB_SHARDS", {"s1": {"path": str(paths["s1"])}})
+    keystore.evict_key(KEY_ID)
+    yield sqlite_conn, shard
+    keystore.evict_key(KEY_ID)
+    shard.close()
+
+
+def test_shard_rows_are_indexed_with_keys_from_main(shards):
+    main, shard = shards
+    assert backfill_blind_index.backfill(shard, "card_vault", 10, keys_conn=main) == (1, 1, 0)
+    cur = shard.cursor()
+    cur.execute("SELECT card_number_bidx FROM card_vault")
+    assert cur.fetchone()[0] == blind_index("card_number", "4111111111111111")
+
+
+def test_shard_all_fills_every_shard(shards, capsys):
+    main, shard = shards
+    assert backfill_blind_index.main(["--shard", "all"]) == 0
+    assert "[BIDX] s1/customers done: 1/1 rows indexed" in capsys.readouterr().out
+    cur = shard.cursor()
+    cur.execute("SELECT email_bidx FROM customers")
+    assert cur.fetchone()[0] == blind_index("email", "ada@example.com")
+    with pytest.raises(SystemExit):
+        backfill_blind_index.main(["--shard", "nowhere"])
@@ -0,0 +1,37 @@
+def test_card_list_keyset_pages(client, login, vault):
+    login(vault['admin']['username'])
+    everything = [c['card_id'] for c in client.get('/card/list').get_json()['cards']]
+    assert everything == sorted(everything)
+
+    seen, after = [], None
+    while True:
+        body = client.get('/card/list?limit=2' + (f'&after={after}' if after else '')).get_json()
+        seen += [c['card_id'] for c in body['cards']]
+        after = body['next_after']
+        if after is None:
+            break
+        assert len(body['cards']) == 2
+    assert seen == everything
+    assert client.get('/card/list?limit=0').status_code == 400
+
+
+def test_customer_sees_only_their_cards(client, login, store_card, vault):
+    customer_id = vault['merchants'][0]['customer_ids'][0]
+    login(f"bench_c{customer_id}")
+    response, number = store_card(customer_id)
+    assert response.status_code == 201
+    # The blind index finds the duplicate without decrypting the customer's cards
+    assert store_card(customer_id, number)[0].status_code == 409
+    assert store_card(customer_id + 1)[0].status_code == 403
+    cards = client.get('/card/list').get_json()['cards']
+    assert {c['customer_id'] for c in cards} == {customer_id}
+    assert number[-4:] in [c['last_four_digits'] for c in cards]
+
+
+def test_card_numbers_decrypt_only_when_asked_for(client, login, vault):
+    login(vault['admin']['username'])
+    cards = client.get('/card/list?fields=card_number').get_json()['cards']
+    assert cards and all(len(c['card_number']) == 16 and c['card_number'].endswith(c['last_four_digits'])
+                         for c in cards)
+    masked = client.get('/card/list').get_json()['cards']
+    assert all('card_number' not in c for c in masked)
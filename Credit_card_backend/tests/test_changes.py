@@ -0,0 +1,30 @@
+import cards
+
+
+def test_changes_feed_reports_stored_cards(client, login, store_card, vault):
+    login(vault['admin']['username'])
+    since = client.get('/changes?limit=1000').get_json()['next_since']
+    customer_id = vault['merchants'][1]['customer_ids'][1]
+    assert store_card(customer_id)[0].status_code == 201
+    body = client.get(f'/changes?since={since}').get_json()
+    assert [(c['type'], c['customer_id']) for c in body['changes']] == [('card.stored', customer_id)]
+    assert body['changes'][0]['data']['status'] == 'Active'
+    assert body['next_since'] > since
+
+
+def test_deactivation_survives_a_failed_audit_write(client, login, store_card, vault, monkeypatch):
+    def down(*args, **kwargs):
+        raise RuntimeError("audit_logs is unavailable")
+
+    customer_id = vault['merchants'][0]['customer_ids'][1]
+    login(vault['admin']['username'])
+    since = client.get('/changes?limit=1000').get_json()['next_since']
+    assert store_card(customer_id)[0].status_code == 201
+    body = client.get(f'/changes?since={since}').get_json()
+    card_id = body['changes'][0]['entity_id']
+
+    monkeypatch.setattr(cards, "audit_log", down)
+    response = client.post(f'/card/{card_id}/deactivate')
+    assert response.status_code == 200
+    changes = client.get(f"/changes?since={body['next_since']}").get_json()['changes']
+    assert [(c['type'], c['entity_id']) for c in changes] == [('card.deactivated', card_id)]
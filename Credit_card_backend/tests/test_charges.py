@@ -0,0 +1,83 @@
+import uuid
+import pytest
+from mysql.connector import DatabaseError, IntegrityError
+from utils import idempotency, rollups
+
+
+def _success_count(client, card_id):
+    report = client.get(f'/reports/transactions?card_id={card_id}&status=success').get_json()
+    return sum(t['count'] for t in report['totals'])
+
+
+def test_charge_rejects_unknown_cards(client, login, vault):
+    login(vault['admin']['username'])
+    assert client.post('/charge', json={'card_id': 999999, 'amount': 1}).status_code == 404
+    response = client.post('/charge/batch', json={'charges': [{'card_id': 1, 'amount': 1}, {'card_id': 999999, 'amount': 1}]})
+    assert response.status_code == 404
+    assert response.get_json()['card_ids'] == [999999]
+
+
+def test_idempotent_charge_is_replayed(client, login, vault):
+    merchant = vault['merchants'][1]
+    login(merchant['username'])
+    card_id = merchant['card_ids'][0]
+
+    def count():
+        return _success_count(client, card_id)
+
+    before = count()
+    headers = {'Idempotency-Key': str(uuid.uuid4())}
+    first = client.post('/charge', json={'card_id': card_id, 'amount': '3.00'}, headers=headers)
+    again = client.post('/charge', json={'card_id': card_id, 'amount': '3.00'}, headers=headers)
+    assert first.status_code == again.status_code == 200
+    assert 'Idempotent-Replayed' not in first.headers
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert again.get_json() == first.get_json()
+    assert count() == before + 1
+
+    other = client.post('/charge', json={'card_id': card_id, 'amount': '4.00'}, headers=headers)
+    assert other.status_code == 422
+    assert count() == before + 1
+
+
+@pytest.mark.parametrize("amount", ["NaN", "Infinity", "-inf"])
+def test_charge_rejects_non_finite_amounts(client, login, vault, amount):
+    login(vault['admin']['username'])
+    card_id = vault['merchants'][0]['card_ids'][0]
+    assert client.post('/charge', json={'card_id': card_id, 'amount': amount}).status_code == 400
+    response = client.post('/charge/batch', json={'charges': [{'card_id': card_id, 'amount': amount}]})
+    assert response.status_code == 400
+    assert 'finite' in response.get_json()['error']
+
+
+def test_database_errors_roll_the_charge_back(client, login, vault, monkeypatch):
+    login(vault['admin']['username'])
+    card_id = vault['merchants'][1]['card_ids'][1]
+    before = _success_count(client, card_id)
+
+    def fail(cur, charges):
+        raise DatabaseError(msg="Lock wait timeout exceeded")
+
+    monkeypatch.setattr(rollups, "apply", fail)
+    for headers in ({}, {'Idempotency-Key': str(uuid.uuid4())}):
+        response = client.post('/charge', json={'card_id': card_id, 'amount': 1}, headers=headers)
+        assert response.status_code == 500
+        assert 'Lock wait timeout' in response.get_json()['error']
+    monkeypatch.undo()
+    assert _success_count(client, card_id) == before
+
+
+def test_lost_idempotency_race_without_a_stored_result(client, login, vault, monkeypatch):
+    login(vault['admin']['username'])
+    card_id = vault['merchants'][1]['card_ids'][1]
+    before = _success_count(client, card_id)
+
+    def conflict(*args):
+        raise IntegrityError(msg="Duplicate entry for key 'uq_idempotency_user_key'")
+
+    monkeypatch.setattr(idempotency, "store", conflict)
+    response = client.post('/charge', json={'card_id': card_id, 'amount': 1},
+                           headers={'Idempotency-Key': str(uuid.uuid4())})
+    assert response.status_code == 409
+    assert 'Idempotency-Key' in response.get_json()['error']
+    assert _success_count(client, card_id) == before
@@ -0,0 +1,78 @@
+import os
+import pytest
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from config import AES_KEY
+from utils import crypto
+
+
+def _mysql_aes_encrypt(text):
+    # What MySQL's AES_ENCRYPT(text, AES_KEY) stored before the app encrypted fields itself
+    data = text.encode()
+    pad = 16 - len(data) % 16
+    encryptor = Cipher(algorithms.AES(crypto._mysql_aes_key(AES_KEY)), modes.ECB()).encryptor()
+    return encryptor.update(data + bytes([pad]) * pad) + encryptor.finalize()
+
+
+def test_envelope_round_trip_under_a_data_key():
+    dek = AESGCM.generate_key(bit_length=256)
+    blob = crypto.encrypt_field("4111111111111111", dek, 42)
+    assert crypto.is_envelope(blob)
+    assert crypto.key_id_of(blob) == 42
+    assert crypto.decrypt_field(blob, {42: dek}) == "4111111111111111"
+    # Same value, fresh nonce
+    assert crypto.encrypt_field("4111111111111111", dek, 42) != blob
+
+
+def test_envelope_without_its_key_is_refused():
+    blob = crypto.encrypt_field("secret", os.urandom(32), 7)
+    with pytest.raises(KeyError):
+        crypto.decrypt_field(blob, {})
+
+
+def test_master_key_envelope_needs_no_keys():
+    blob = crypto.encrypt_field("jane@example.com")
+    assert crypto.key_id_of(blob) == crypto.MASTER_KEY_ID
+    assert crypto.decrypt_field(blob) == "jane@example.com"
+
+
+def test_header_is_authenticated():
+    dek = os.urandom(32)
+    blob = bytearray(crypto.encrypt_field("4111111111111111", dek, 3))
+    # Point the header at another key id: the tag no longer matches
+    blob[3:7] = (4).to_bytes(4, "big")
+    with pytest.raises(crypto.DecryptionError):
+        crypto.decrypt_bytes(bytes(blob), {3: dek, 4: dek})
+
+
+def test_tampered_envelope_fails_instead_of_falling_back():
+    dek = os.urandom(32)
+    blob = crypto.encrypt_field("4111111111111111", dek, 3)
+    for i in (crypto.HEADER.size + crypto.NONCE_SIZE, len(blob) - 1):
+        tampered = bytearray(blob)
+        tampered[i] ^= 0x01
+        with pytest.raises(crypto.DecryptionError):
+            crypto.decrypt_field(bytes(tampered), {3: dek})
+
+
+def test_legacy_values_still_decrypt():
+    blob = _mysql_aes_encrypt("12/29")
+    assert not crypto.is_envelope(blob)
+    assert crypto.key_id_of(blob) is None
+    assert crypto.decrypt_field(blob) == "12/29"
+
+
+def test_decrypt_rows_decodes_other_bytes():
+    dek = os.urandom(32)
+    rows = [{'card_number': crypto.encrypt_field("4242424242424242", dek, 9), 'last_four_digits': b"4242"},
+            {'card_number': _mysql_aes_encrypt("5555555555554444"), 'last_four_digits': b"4444"}]
+    crypto.decrypt_rows(rows, ('card_number',), {9: dek})
+    assert rows == [{'card_number': "4242424242424242", 'last_four_digits': "4242"},
+                    {'card_number': "5555555555554444", 'last_four_digits': "4444"}]
+
+
+def test_blind_index_normalizes_and_separates_kinds():
+    assert crypto.blind_index("card_number", "4111 1111 1111 1111") == crypto.blind_index("card_number", "4111111111111111")
+    assert crypto.blind_index("email", " Jane@Example.com") == crypto.blind_index("email", "jane@example.com")
+    assert crypto.blind_index("email", "4111111111111111") != crypto.blind_index("card_number", "4111111111111111")
+    assert crypto.blind_index("card_number", "") is None
@@ -0,0 +1,60 @@
+import mysql.connector
+from models import explain_check
+
+
+class ExplainCursor:
+    """Answers EXPLAIN with `plan`, or fails it for statements on `broken` tables."""
+
+    def __init__(self, plan, broken):
+        self.plan = plan
+        self.broken = broken
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        if any(f" {table} " in sql for table in self.broken):
+            raise mysql.connector.ProgrammingError(msg="You have an error in your SQL syntax")
+        self._rows = self.plan
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class ExplainConnection:
+    def __init__(self, plan=(), broken=()):
+        self._cursor = ExplainCursor(list(plan), broken)
+
+    def cursor(self, **kwargs):
+        return self._cursor
+
+    def close(self):
+        pass
+
+
+def _connect(monkeypatch, **kwargs):
+    monkeypatch.setattr(explain_check.mysql.connector, "connect", lambda **config: ExplainConnection(**kwargs))
+
+
+def test_hot_path_statements_are_collected():
+    statements = [sql for _, sql in explain_check.collect_statements()]
+    assert "SELECT user_id, user_role, status FROM users WHERE username = %s AND password_hash = %s" in statements
+
+
+def test_clean_plans_pass(monkeypatch):
+    _connect(monkeypatch, plan=[{"table": "users", "type": "ref", "rows": 1}])
+    assert explain_check.main([]) == 0
+
+
+def test_full_scans_fail(monkeypatch):
+    _connect(monkeypatch, plan=[{"table": "users", "type": "ALL", "rows": 5000}])
+    assert explain_check.main([]) == 1
+    assert explain_check.main(["--allow", "users"]) == 0
+
+
+def test_skipped_statements_fail_unless_allowed(monkeypatch, capsys):
+    _connect(monkeypatch, plan=[{"table": "users", "type": "ref", "rows": 1}], broken=("users",))
+    assert explain_check.main([]) == 1
+    assert "--allow-skip" in capsys.readouterr().out
+    assert explain_check.main(["--allow-skip"]) == 0
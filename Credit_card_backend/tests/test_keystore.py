@@ -0,0 +1,36 @@
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from utils import keystore
+from utils.crypto import encrypt_field, decrypt_field
+from utils.keystore import wrap_key, unwrap_key, keys_for
+
+# Well clear of the key ids in the app's database, which share the keystore's cache
+KEY_ID = 800
+
+
+def test_data_key_wrapping_is_bound_to_the_merchant():
+    dek = AESGCM.generate_key(bit_length=256)
+    wrapped = wrap_key(dek, 12)
+    assert unwrap_key(wrapped, 12) == dek
+    with pytest.raises(InvalidTag):
+        unwrap_key(wrapped, 13)
+
+
+def test_keys_are_fetched_once_then_cached(sqlite_conn):
+    dek = AESGCM.generate_key(bit_length=256)
+    cur = sqlite_conn.cursor()
+    cur.execute("INSERT INTO data_keys (key_id, merchant_id, wrapped_key, status) VALUES (%s, 2, %s, 'Active')",
+                (KEY_ID, wrap_key(dek, 2)))
+    sqlite_conn.commit()
+    blobs = [encrypt_field("4111111111111111", dek, KEY_ID), encrypt_field("123", dek, KEY_ID), encrypt_field("x")]
+    try:
+        assert keys_for(cur, blobs) == {KEY_ID: dek}
+        assert decrypt_field(blobs[0], keys_for(cur, blobs)) == "4111111111111111"
+        # Served from the cache once the row is gone
+        cur.execute("DELETE FROM data_keys WHERE key_id = %s", (KEY_ID,))
+        sqlite_conn.commit()
+        assert keys_for(cur, blobs) == {KEY_ID: dek}
+    finally:
+        keystore.evict_key(KEY_ID)
+    assert keys_for(cur, blobs) == {}
@@ -0,0 +1,22 @@
+from utils import list_cache
+
+
+def test_list_etags_are_off_by_default(client, login, vault):
+    login(vault['admin']['username'])
+    response = client.get('/merchant/list')
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+
+
+def test_list_etag_changes_after_a_write(client, login, vault, monkeypatch):
+    monkeypatch.setattr(list_cache, "LIST_CACHE_ENABLED", True)
+    login(vault['admin']['username'])
+    first = client.get('/merchant/list')
+    etag = first.headers['ETag']
+    assert client.get('/merchant/list', headers={'If-None-Match': etag}).status_code == 304
+
+    assert client.post('/merchant/create', json={'name': 'Etag Test', 'email': 'etag@example.com'}).status_code == 200
+    after = client.get('/merchant/list', headers={'If-None-Match': etag})
+    assert after.status_code == 200
+    assert after.headers['ETag'] != etag
+    assert 'Etag Test' in [m['business_name'] for m in after.get_json()['merchants']]
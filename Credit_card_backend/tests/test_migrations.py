@@ -0,0 +1,22 @@
+from models.migrations import MIGRATIONS, migrate
+from utils.sqlite_engine import connect
+
+
+def test_hot_path_indexes_tolerate_duplicate_users(tmp_path):
+    conn = connect(path=str(tmp_path / "old.sqlite3"), bootstrap=False)
+    try:
+        assert migrate(conn, 2) == [1, 2]
+        cur = conn.cursor()
+        # The base schema never prevented these
+        cur.executemany("INSERT INTO users (username, email, password_hash) VALUES (%s, %s, 'x')",
+                        [("ada", "ada@example.com"), ("ada", "ada@example.com")])
+        conn.commit()
+        assert migrate(conn) == [version for version, _, _ in MIGRATIONS[2:]]
+        cur.execute("SELECT name, \"unique\" FROM pragma_index_list('users') ORDER BY name")
+        assert cur.fetchall() == [("idx_users_email", 0), ("idx_users_username", 0)]
+    finally:
+        conn.close()
+
+
+def test_migrate_is_idempotent(sqlite_conn):
+    assert migrate(sqlite_conn) == []
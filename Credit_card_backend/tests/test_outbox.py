@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+from utils import outbox
+
+EVENT_SQL = ("INSERT INTO change_events (event_id, event_type, entity_type, entity_id, merchant_id, customer_id, "
+             "created_at) VALUES (%s, %s, 'card', %s, %s, %s, %s)")
+
+
+def _events(conn, *events):
+    cur = conn.cursor()
+    cur.executemany(EVENT_SQL, [(event_id, outbox.CARD_STORED, event_id, merchant_id, None, created_at)
+                                for event_id, merchant_id, created_at in events])
+    conn.commit()
+    return cur
+
+
+def test_horizon_stops_at_a_fresh_gap(sqlite_conn):
+    now = datetime.now()
+    cur = _events(sqlite_conn, (1, 2, now), (2, 2, now), (4, 2, now))
+    # Event 3 may still be committing
+    assert outbox.safe_horizon(cur, 0) == 2
+    events, next_since = outbox.fetch(cur, 0, 10)
+    assert [e['event_id'] for e in events] == [1, 2]
+    assert next_since == 2
+
+
+def test_horizon_passes_a_settled_gap(sqlite_conn):
+    old = datetime.now() - timedelta(minutes=5)
+    cur = _events(sqlite_conn, (1, 2, old), (2, 2, old), (4, 2, old))
+    assert outbox.safe_horizon(cur, 0) == 4
+
+
+def test_full_page_resumes_after_its_last_event(sqlite_conn):
+    now = datetime.now()
+    cur = _events(sqlite_conn, *((i, 2, now) for i in range(1, 6)))
+    events, next_since = outbox.fetch(cur, 0, 2)
+    assert [e['event_id'] for e in events] == [1, 2]
+    assert next_since == 2
+    events, next_since = outbox.fetch(cur, next_since, 10)
+    assert [e['event_id'] for e in events] == [3, 4, 5]
+    assert next_since == 5
+
+
+def test_scoped_consumer_moves_past_other_tenants(sqlite_conn):
+    now = datetime.now()
+    cur = _events(sqlite_conn, (1, 2, now), (2, 3, now), (3, 3, now))
+    events, next_since = outbox.fetch(cur, 0, 10, merchant_id=2)
+    assert [e['event_id'] for e in events] == [1]
+    assert next_since == 3
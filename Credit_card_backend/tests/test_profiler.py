@@ -0,0 +1,28 @@
+import cProfile
+import os
+from flask import Flask, g
+from utils import profiler
+
+app = Flask(__name__)
+
+
+@app.get('/cards')
+def cards():
+    return "ok"
+
+
+def test_overlapping_cprofile_capture_falls_back_to_stack(monkeypatch, tmp_path):
+    def busy(self):
+        # What Python 3.12+ raises while another cProfile capture is running in the process
+        raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(cProfile.Profile, "enable", busy)
+    monkeypatch.setattr(profiler, "_claim", lambda endpoint: "cprofile")
+    monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+    with app.test_request_context('/cards'):
+        profiler.start_request()
+        mode, _, _ = g.profile
+        assert mode == "stack"
+        response = profiler.finish_request(app.make_response("ok"))
+    assert response.status_code == 200
+    assert [n for n in os.listdir(tmp_path) if n.endswith(".folded")]
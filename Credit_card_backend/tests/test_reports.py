@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta, timezone
+
+
+def _card_id(client, number):
+    cards = client.get('/card/list?fields=card_number').get_json()['cards']
+    return next(c['card_id'] for c in cards if c['card_number'] == number)
+
+
+def test_charges_of_a_user_without_a_customers_row_are_reported(client, login, store_card, vault):
+    login(vault['admin']['username'])
+    # Merchant users have no customers row; their cards are encrypted under the master key
+    response, number = store_card(vault['merchants'][0]['merchant_id'])
+    assert response.status_code == 201
+    card_id = _card_id(client, number)
+
+    assert client.post('/charge', json={'card_id': card_id, 'amount': '5.00'}).status_code == 200
+    response = client.post('/charge/batch', json={'charges': [{'card_id': card_id, 'amount': '2.50'}]})
+    assert response.status_code == 201
+    report = client.get(f'/reports/transactions?card_id={card_id}').get_json()
+    assert report['totals'] == [{'currency': 'USD', 'status': 'success', 'count': 2, 'amount': '7.50'}]
+
+
+def test_report_accepts_timezone_offsets(client, login, vault):
+    merchant = vault['merchants'][0]
+    login(merchant['username'])
+    until = datetime.now(timezone.utc) + timedelta(hours=1)
+    since = (until - timedelta(days=7)).astimezone(timezone(timedelta(hours=2)))
+    response = client.get('/reports/transactions', query_string={
+        'since': since.isoformat(), 'until': until.isoformat().replace('+00:00', 'Z')})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['scope_id'] == merchant['merchant_id']
+    assert sum(t['count'] for t in body['totals']) >= 1
+    assert client.get('/reports/transactions?since=last-week').status_code == 400
+    other = vault['merchants'][1]['merchant_id']
+    assert client.get(f'/reports/transactions?merchant_id={other}').status_code == 403
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from utils import rollups
+
+DAY = datetime(2026, 3, 14)
+# (card_id, amount, currency, status, created_at); card 2 belongs to a user without a customers row
+TRANSACTIONS = [
+    (1, "10.00", "USD", "success", DAY.replace(hour=9, minute=5)),
+    (1, "2.505", "USD", "success", DAY.replace(hour=9, minute=59, second=59)),
+    (1, "7.25", "USD", "declined", DAY.replace(hour=10)),
+    (1, "4.00", "EUR", "success", DAY.replace(hour=23, minute=30)),
+    (2, "1.10", "USD", "success", DAY.replace(hour=9, minute=30)),
+    (1, "99.00", "USD", "success", DAY + timedelta(days=1)),
+]
+
+
+def _vault(conn):
+    cur = conn.cursor()
+    cur.execute("INSERT INTO customers (customer_id, merchant_id, first_name) VALUES (3, 2, 'Ada')")
+    cur.executemany("INSERT INTO card_vault (card_id, customer_id, card_number_enc) VALUES (%s, %s, %s)",
+                    [(1, 3, b"x"), (2, 5, b"y")])
+    cur.executemany("INSERT INTO transactions (card_id, amount, currency, status, created_at) VALUES (%s, %s, %s, %s, %s)",
+                    TRANSACTIONS)
+    conn.commit()
+    return cur
+
+
+def _charges(owners):
+    return [(owners[card_id], card_id, created_at, currency, status, amount)
+            for card_id, amount, currency, status, created_at in TRANSACTIONS]
+
+
+def test_apply_folds_charges_into_buckets(sqlite_conn):
+    cur = _vault(sqlite_conn)
+    rollups.apply(cur, _charges({1: 2, 2: None}))
+    rows = rollups.series(cur, 'merchant', 2, 'hour', DAY, DAY + timedelta(days=1), currency='USD')
+    assert [(r['bucket'].hour, r['status'], r['count'], r['amount']) for r in rows] == [
+        (9, 'success', 2, Decimal('12.51')),
+        (10, 'declined', 1, Decimal('7.25')),
+    ]
+    day = rollups.series(cur, 'card', 2, 'day', DAY, DAY + timedelta(days=2))
+    assert [(r['bucket'], r['count'], r['amount']) for r in day] == [(DAY, 1, Decimal('1.10'))]
+
+
+def test_rebuild_day_matches_the_live_rollups(sqlite_conn):
+    cur = _vault(sqlite_conn)
+    rollups.apply(cur, _charges({1: 2, 2: None}))
+    sqlite_conn.commit()
+    expected = {scope: rollups.series(cur, scope, scope_id, 'hour', DAY, DAY + timedelta(days=2))
+                for scope, scope_id in (('merchant', 2), ('card', 1), ('card', 2))}
+
+    cur.execute("DELETE FROM txn_rollups")
+    sqlite_conn.commit()
+    for day in (DAY, DAY + timedelta(days=1)):
+        rollups.rebuild_day(sqlite_conn, day)
+    assert {scope: rollups.series(cur, scope, scope_id, 'hour', DAY, DAY + timedelta(days=2))
+            for scope, scope_id in (('merchant', 2), ('card', 1), ('card', 2))} == expected
+
+
+def test_rebuilding_a_day_twice_does_not_double_count(sqlite_conn):
+    cur = _vault(sqlite_conn)
+    assert rollups.rebuild_day(sqlite_conn, DAY)[0] == 5
+    rollups.rebuild_day(sqlite_conn, DAY)
+    rows = rollups.series(cur, 'merchant', 2, 'day', DAY, DAY + timedelta(days=1), status='success')
+    assert [(r['currency'], r['count'], r['amount']) for r in rows] == [
+        ('EUR', 1, Decimal('4.00')), ('USD', 2, Decimal('12.51'))]
+
+
+def test_bucket_bounds():
+    ts = datetime(2026, 3, 14, 9, 30, 15)
+    assert rollups.floor(ts, 'hour') == datetime(2026, 3, 14, 9)
+    assert rollups.ceil(ts, 'day') == datetime(2026, 3, 15)
+    assert rollups.ceil(datetime(2026, 3, 14), 'day') == datetime(2026, 3, 14)
@@ -0,0 +1,195 @@
+import os
+import queue
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+import rotate_keys
+from utils import keystore
+from utils.crypto import encrypt_field, decrypt_field, key_id_of, MASTER_KEY_ID
+from utils.keystore import wrap_key, unwrap_key, keys_for
+from utils.sqlite_engine import connect
+from test_crypto import _mysql_aes_encrypt
+
+# Well clear of the key ids in the app's database, which share the keystore's cache
+OLD_KEY_ID = 900
+TABLES = ["card_vault", "customers"]
+
+
+@pytest.fixture(autouse=True)
+def _fresh_keystore():
+    # Every test's database numbers its keys from OLD_KEY_ID, so keys cached by another test would be wrong
+    keystore._cache.clear()
+    yield
+    keystore._cache.clear()
+
+
+def _vault(conn):
+    dek = AESGCM.generate_key(bit_length=256)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO data_keys (key_id, merchant_id, wrapped_key, status) VALUES (%s, 2, %s, 'Active')",
+                (OLD_KEY_ID, wrap_key(dek, 2)))
+    cur.execute("INSERT INTO customers (customer_id, merchant_id, first_name, email_enc) VALUES (3, 2, 'Ada', %s)",
+                (encrypt_field("ada@example.com", dek, OLD_KEY_ID),))
+    # Card 2 belongs to a user without a customers row and was written by SQL AES_ENCRYPT
+    cur.executemany("INSERT INTO card_vault (card_id, customer_id, card_number_enc, cvv_enc) VALUES (%s, %s, %s, %s)",
+                    [(1, 3, encrypt_field("4111111111111111", dek, OLD_KEY_ID), encrypt_field("123", dek, OLD_KEY_ID)),
+                     (2, 5, _mysql_aes_encrypt("5555555555554444"), None)])
+    conn.commit()
+    return cur
+
+
+def _workers_connect(monkeypatch, tmp_path):
+    # Each range gets a connection of its own to the test's database, as a worker process would;
+    # main is the sqlite_conn fixture's database and any other shard a file next to it
+    def shard_connect(shard="main"):
+        name = "own" if shard == "main" else shard
+        return connect(path=str(tmp_path / f"{name}.sqlite3"), bootstrap=False)
+    monkeypatch.setattr(rotate_keys, "connect", shard_connect)
+
+
+def _run(ranges, new_master=None, job_id="job", shard="main"):
+    progress = queue.Queue()
+    for table, worker, last_pk, range_end, _, _, done in ranges:
+        if not done:
+            rotate_keys.reencrypt_range(job_id, table, worker, last_pk, range_end, 1, 0, progress, new_master, shard)
+    return [progress.get() for _ in range(progress.qsize())]
+
+
+def test_rotation_reencrypts_under_the_new_key(sqlite_conn, monkeypatch, tmp_path):
+    _workers_connect(monkeypatch, tmp_path)
+    cur = _vault(sqlite_conn)
+    ranges = rotate_keys.plan(sqlite_conn, "job", TABLES, 2, rotate_deks=True)
+    assert {(table, worker) for table, worker, *_ in ranges} == set(rotate_keys.unfinished(sqlite_conn, "job", TABLES))
+    cur.execute("SELECT key_id FROM data_keys WHERE merchant_id = 2 AND status = 'Active'")
+    new_key_id = cur.fetchone()[0]
+    assert new_key_id != OLD_KEY_ID
+
+    progress = _run(ranges)
+    assert sum(rows for rows, _, _ in progress) == 3
+    assert rotate_keys.unfinished(sqlite_conn, "job", TABLES) == []
+
+    cur.execute("SELECT card_id, card_number_enc, cvv_enc FROM card_vault ORDER BY card_id")
+    cards = cur.fetchall()
+    cur.execute("SELECT email_enc FROM customers")
+    email = cur.fetchone()[0]
+    assert [key_id_of(c[1]) for c in cards] == [new_key_id, MASTER_KEY_ID]
+    assert key_id_of(email) == new_key_id
+    keys = keys_for(cur, [cards[0][1], email])
+    assert [decrypt_field(c[1], keys) for c in cards] == ["4111111111111111", "5555555555554444"]
+    assert decrypt_field(cards[0][2], keys) == "123"
+    assert decrypt_field(email, keys) == "ada@example.com"
+
+
+def test_unfinished_ranges_are_reported(sqlite_conn, monkeypatch, tmp_path):
+    _workers_connect(monkeypatch, tmp_path)
+    _vault(sqlite_conn)
+    ranges = rotate_keys.plan(sqlite_conn, "job", TABLES, 2, rotate_deks=False)
+    # As if the worker for every card range died before finishing it
+    _run([r for r in ranges if r[0] != "card_vault"])
+    left = rotate_keys.unfinished(sqlite_conn, "job", TABLES)
+    assert left == [(table, worker) for table, worker, *_ in ranges if table == "card_vault"]
+    # Resuming picks up exactly those
+    _run(rotate_keys.plan(sqlite_conn, "job", TABLES, 2, rotate_deks=False))
+    assert rotate_keys.unfinished(sqlite_conn, "job", TABLES) == []
+
+
+def test_dek_rotation_is_not_repeated_on_resume(sqlite_conn, monkeypatch, tmp_path):
+    _workers_connect(monkeypatch, tmp_path)
+    cur = _vault(sqlite_conn)
+    cur.execute("INSERT INTO data_keys (merchant_id, wrapped_key, status) VALUES (5, %s, 'Active')",
+                (wrap_key(AESGCM.generate_key(bit_length=256), 5),))
+    sqlite_conn.commit()
+    rotate = rotate_keys.rotate_merchant_key
+
+    def killed_after_the_first(db, cur, merchant_id):
+        if merchant_id != 2:
+            raise KeyboardInterrupt
+        return rotate(db, cur, merchant_id)
+
+    monkeypatch.setattr(rotate_keys, "rotate_merchant_key", killed_after_the_first)
+    with pytest.raises(KeyboardInterrupt):
+        rotate_keys.plan(sqlite_conn, "job", TABLES, 2, rotate_deks=True)
+    sqlite_conn.rollback()
+    monkeypatch.setattr(rotate_keys, "rotate_merchant_key", rotate)
+    rotate_keys.plan(sqlite_conn, "job", TABLES, 2, rotate_deks=True)
+    rotate_keys.plan(sqlite_conn, "job", TABLES, 2, rotate_deks=True)
+
+    cur.execute("SELECT merchant_id, status, COUNT(*) FROM data_keys GROUP BY merchant_id, status ORDER BY 1, 2")
+    assert cur.fetchall() == [(2, 'Active', 1), (2, 'Retired', 1), (5, 'Active', 1), (5, 'Retired', 1)]
+
+
+def test_new_master_key_rewraps_and_reencrypts(sqlite_conn, monkeypatch, tmp_path):
+    _workers_connect(monkeypatch, tmp_path)
+    cur = _vault(sqlite_conn)
+    # A card under the master key, for a user without a customers row
+    cur.execute("INSERT INTO card_vault (card_id, customer_id, card_number_enc) VALUES (3, 5, %s)",
+                (encrypt_field("378282246310005"),))
+    sqlite_conn.commit()
+    new_master = os.urandom(32)
+
+    ranges = rotate_keys.plan(sqlite_conn, "job", TABLES, 2, rotate_deks=False, new_master=new_master)
+    progress = _run(ranges, new_master)
+    assert sum(updated for _, updated, _ in progress) == 2
+    assert sum(failed for _, _, failed in progress) == 0
+
+    cur.execute("SELECT merchant_id, wrapped_key FROM data_keys")
+    merchant_id, wrapped = cur.fetchone()
+    dek = unwrap_key(wrapped, merchant_id, new_master)
+    cur.execute("SELECT card_number_enc FROM card_vault ORDER BY card_id")
+    cards = [r[0] for r in cur.fetchall()]
+    # The data key was re-wrapped, so the card under it is left alone
+    assert [key_id_of(c) for c in cards] == [OLD_KEY_ID, MASTER_KEY_ID, MASTER_KEY_ID]
+    assert [decrypt_field(c, {OLD_KEY_ID: dek}, new_master) for c in cards] == [
+        "4111111111111111", "5555555555554444", "378282246310005"]
+
+    # A second job reads the values already moved to the new key
+    keystore._cache.clear()
+    progress = _run(rotate_keys.plan(sqlite_conn, "again", TABLES, 2, False, new_master), new_master, "again")
+    assert sum(failed for _, _, failed in progress) == 0
+    cur.execute("SELECT card_number_enc FROM card_vault WHERE card_id = 3")
+    assert decrypt_field(cur.fetchone()[0], master_key=new_master) == "378282246310005"
+    with pytest.raises(ValueError):
+        rotate_keys.plan(sqlite_conn, "job", TABLES, 2, rotate_deks=False)
+    with pytest.raises(ValueError):
+        rotate_keys.plan(sqlite_conn, "job", TABLES, 2, False, os.urandom(32))
+
+
+def test_shards_are_reencrypted_with_the_data_keys_on_main(sqlite_conn, monkeypatch, tmp_path):
+    _workers_connect(monkeypatch, tmp_path)
+    dek = AESGCM.generate_key(bit_length=256)
+    main_cur = sqlite_conn.cursor()
+    main_cur.execute("INSERT INTO data_keys (key_id, merchant_id, wrapped_key, status) VALUES (%s, 2, %s, 'Active')",
+                     (OLD_KEY_ID, wrap_key(dek, 2)))
+    sqlite_conn.commit()
+    shard = connect(path=str(tmp_path / "s1.sqlite3"))
+    try:
+        cur = shard.cursor()
+        cur.execute("INSERT INTO customers (customer_id, merchant_id, first_name, email_enc) VALUES (3, 2, 'Ada', %s)",
+                    (encrypt_field("ada@example.com", dek, OLD_KEY_ID),))
+        cur.execute("INSERT INTO card_vault (card_id, customer_id, card_number_enc) VALUES (1, 3, %s)",
+                    (_mysql_aes_encrypt("4111111111111111"),))
+        shard.commit()
+
+        ranges = rotate_keys.plan(shard, "job", TABLES, 1, True, keys_conn=sqlite_conn)
+        main_cur.execute("SELECT key_id, wrapped_key FROM data_keys WHERE merchant_id = 2 AND status = 'Active'")
+        new_key_id, wrapped = main_cur.fetchone()
+        progress = _run(ranges, shard="s1")
+        assert sum(updated for _, updated, _ in progress) == 2
+        assert rotate_keys.unfinished(shard, "job", TABLES) == []
+        # The steps are the job's, on main: the next shard does not rotate the keys again
+        assert rotate_keys.unfinished(sqlite_conn, "job", TABLES) == []
+        assert rotate_keys.plan(sqlite_conn, "job", TABLES, 1, True) == []
+        main_cur.execute("SELECT COUNT(*) FROM data_keys")
+        assert main_cur.fetchone()[0] == 2
+
+        cur.execute("SELECT card_number_enc FROM card_vault")
+        card = cur.fetchone()[0]
+        assert key_id_of(card) == new_key_id
+        assert decrypt_field(card, {new_key_id: unwrap_key(wrapped, 2)}) == "4111111111111111"
+    finally:
+        shard.close()
+
+
+def test_unknown_shards_are_refused(capsys):
+    with pytest.raises(SystemExit):
+        rotate_keys.main(["--job-id", "job", "--shard", "nowhere"])
+    assert "unknown shard 'nowhere'" in capsys.readouterr().err
@@ -0,0 +1,44 @@
+from utils.shards import merge_page, merge_streams
+
+
+def _key(row):
+    return row['card_id']
+
+
+def _rows(*ids):
+    return [{'card_id': i} for i in ids]
+
+
+def test_merge_takes_the_lowest_keys_across_shards():
+    pages = {'main': _rows(1, 4, 9), 's2': _rows(2, 3, 5)}
+    rows, last = merge_page(pages, _key, limit=3)
+    assert [r['card_id'] for r in rows] == [1, 2, 3]
+    assert last == 3
+
+
+def test_merge_of_short_pages_ends_the_walk():
+    rows, last = merge_page({'main': _rows(7), 's2': _rows(4)}, _key, limit=3)
+    assert [r['card_id'] for r in rows] == [4, 7]
+    assert last is None
+
+
+def test_next_page_starts_after_the_last_row():
+    pages = {'main': _rows(1, 2, 8, 9), 's2': _rows(3, 4)}
+    rows, last = merge_page(pages, _key, limit=4)
+    assert [r['card_id'] for r in rows] == [1, 2, 3, 4]
+    assert last == 4
+    # The shards' next pages, each read with card_id > 4
+    rows, last = merge_page({'main': _rows(8, 9), 's2': []}, _key, limit=4)
+    assert [r['card_id'] for r in rows] == [8, 9]
+    assert last is None
+
+
+def test_merge_without_a_limit_takes_everything():
+    rows, last = merge_page({'main': _rows(2, 5), 's2': _rows(1)}, _key)
+    assert [r['card_id'] for r in rows] == [1, 2, 5]
+    assert last is None
+
+
+def test_merge_streams_is_ordered():
+    merged = merge_streams({'main': iter(_rows(1, 5)), 's2': iter(_rows(2, 3, 8))}, _key)
+    assert [r['card_id'] for r in merged] == [1, 2, 3, 5, 8]
@@ -0,0 +1,40 @@
+import pytest
+from mysql.connector import errors
+from utils.sqlite_engine import translate
+
+
+def test_placeholders():
+    assert translate("SELECT * FROM users WHERE user_id = %s AND username = %s") == \
+        "SELECT * FROM users WHERE user_id = ? AND username = ?"
+    assert translate("SELECT %(a)s, '100%%'") == "SELECT :a, '100%'"
+
+
+def test_mysql_only_statements():
+    assert translate("SELECT GET_LOCK('schema_migrations', 60)") is None
+    assert translate("SET FOREIGN_KEY_CHECKS = 0") is None
+    assert translate("TRUNCATE TABLE users") == "DELETE FROM users"
+    assert translate("SELECT 1 FROM card_vault WHERE card_id = %s FOR UPDATE") == \
+        "SELECT 1 FROM card_vault WHERE card_id = ?"
+
+
+def test_upsert():
+    sql = translate("INSERT INTO t (k, n) VALUES (%s, %s) ON DUPLICATE KEY UPDATE n = n + VALUES(n), at = NOW()")
+    assert sql == "INSERT INTO t (k, n) VALUES (?, ?) ON CONFLICT DO UPDATE SET n = n + excluded.n, at = CURRENT_TIMESTAMP"
+
+
+def test_errors_surface_as_mysql_errors(sqlite_conn):
+    cur = sqlite_conn.cursor()
+    cur.execute("INSERT INTO idempotency_keys (user_id, idem_key, request_hash, status_code, response_body) "
+                "VALUES (1, 'k', 'h', 200, '{}')")
+    with pytest.raises(errors.IntegrityError):
+        cur.execute("INSERT INTO idempotency_keys (user_id, idem_key, request_hash, status_code, response_body) "
+                    "VALUES (1, 'k', 'h', 200, '{}')")
+    with pytest.raises(errors.DatabaseError):
+        cur.execute("SELECT * FROM no_such_table WHERE x = %s", (1,))
+
+
+def test_dictionary_cursor(sqlite_conn):
+    cur = sqlite_conn.cursor(dictionary=True)
+    cur.execute("INSERT INTO merchants (merchant_name) VALUES (%s)", ("Acme",))
+    cur.execute("SELECT merchant_id, merchant_name, status FROM merchants")
+    assert cur.fetchall() == [{'merchant_id': 1, 'merchant_name': "Acme", 'status': "Active"}]
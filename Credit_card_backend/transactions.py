@@ -1,17 +1,173 @@
-from flask import Blueprint, request, session
+import math
+from datetime import datetime
+from flask import Blueprint, request, session, jsonify
+from mysql.connector import IntegrityError
 from db import get_db
 from utils.decorators import require_role
 from utils.logger import audit_log
+from utils import idempotency, rollups, shards
+from config import CHARGE_BATCH_MAX
 
 transactions_bp = Blueprint('tx', __name__)
 
+
+def _idempotent(handler, payload):
+    """Run `handler(db, cur)` at most once per Idempotency-Key header for this user.
+
+    `handler` does its writes without committing and returns (status, body).
+    The result is stored in the same transaction, so a retry gets the
+    original response instead of creating duplicate rows. A database error
+    rolls the transaction back and becomes a 500.
+    Returns (status, body, replayed).
+    """
+    key = request.headers.get('Idempotency-Key')
+    if key and len(key) > 128:
+        return 400, {"error": "Idempotency-Key must be at most 128 characters"}, False
+    db, cur = get_db()
+    try:
+        if not key:
+            status, body = handler(db, cur)
+            if status >= 400:
+                db.rollback()
+            else:
+                db.commit()
+            return status, body, False
+
+        user_id = session['user_id']
+        req_hash = idempotency.request_hash(payload)
+        stored = idempotency.lookup(cur, user_id, key, req_hash)
+        if stored is not None:
+            return stored[0], stored[1], True
+        status, body = handler(db, cur)
+        if status >= 400:
+            # Failures are not recorded, the client may fix the request and retry
+            db.rollback()
+            return status, body, False
+        try:
+            idempotency.store(cur, user_id, key, req_hash, status, body)
+            db.commit()
+        except IntegrityError:
+            # A concurrent retry with the same key won the race; return its result
+            db.rollback()
+            stored = idempotency.lookup(cur, user_id, key, req_hash)
+            if stored is None:
+                # Not visible (yet) to this transaction; nothing was charged here
+                return 409, {"error": "A request with this Idempotency-Key is in progress, retry it"}, False
+            return stored[0], stored[1], True
+    except idempotency.KeyReuseError:
+        return 422, {"error": "Idempotency-Key was already used with a different request"}, False
+    except shards.ShardMoving:
+        raise
+    except Exception as e:
+        print(f"[CHARGE] error: {e}")
+        try:
+            db.rollback()
+        except Exception:
+            pass
+        return 500, {"error": str(e)}, False
+    idempotency.remember(user_id, key, req_hash, status, body)
+    return status, body, False
+
+
+# Active cards with the merchant that owns them, which the rollups are kept for. Cards stored for a
+# user without a customers row (see /card/store) have no merchant and only get card rollups.
+ACTIVE_CARDS_SQL = """
+    SELECT cv.card_id, c.merchant_id FROM card_vault cv
+    LEFT JOIN customers c ON c.customer_id = cv.customer_id
+    WHERE cv.status = 'Active' AND cv.card_id IN ({ids})"""
+CHARGE_SQL = "INSERT INTO transactions (card_id, amount, currency, status, created_at) VALUES (%s,%s,%s,'success',%s)"
+
+
+def _active_cards(cur, card_ids):
+    """card_id -> merchant_id for the active cards among `card_ids`, on whichever shards hold them."""
+    if shards.enabled():
+        return {card_id: merchant_id for card_id, (merchant_id, _) in shards.locate(ACTIVE_CARDS_SQL, card_ids).items()}
+    ids = sorted(set(card_ids))
+    cur.execute(ACTIVE_CARDS_SQL.format(ids=','.join(['%s'] * len(ids))), tuple(ids))
+    return dict(cur.fetchall())
+
+
+def _respond(status, body, replayed):
+    resp = jsonify(body)
+    resp.status_code = status
+    if replayed:
+        resp.headers['Idempotent-Replayed'] = 'true'
+    return resp
+
+
 @transactions_bp.post('/charge')
 @require_role('admin','merchant')
 def charge():
-    d = request.json
-    db, cur = get_db()
-    cur.execute("INSERT INTO transactions (card_id, amount, currency, status) VALUES (%s,%s,%s,'success')",
-                (d['card_id'], d['amount'], d.get('currency','USD')))
-    db.commit()
-    audit_log(session['user_id'], "CHARGE", "transactions")
-    return {"message": "charged"}
\ No newline at end of file
+    d = request.json or {}
+    try:
+        card_id = int(d['card_id'])
+        amount = float(d['amount'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "card_id and numeric amount are required"}), 400
+    if not math.isfinite(amount):
+        return jsonify({"error": "amount must be a finite number"}), 400
+    if amount <= 0:
+        return jsonify({"error": "amount must be positive"}), 400
+    currency = d.get('currency','USD')
+
+    def handler(db, cur):
+        merchants = _active_cards(cur, [card_id])
+        if card_id not in merchants:
+            return 404, {"error": "Unknown or inactive card_id"}
+        # Stored explicitly (whole seconds, as DATETIME keeps it) so the rollup bucket matches the row
+        now = datetime.now().replace(microsecond=0)
+        cur.execute(CHARGE_SQL, (card_id, amount, currency, now))
+        rollups.apply(cur, [(merchants[card_id], card_id, now, currency, 'success', amount)])
+        return 200, {"message": "charged"}
+
+    status, body, replayed = _idempotent(handler, d)
+    if status < 400 and not replayed:
+        audit_log(session['user_id'], "CHARGE", "transactions")
+    return _respond(status, body, replayed)
+
+
+@transactions_bp.post('/charge/batch')
+@require_role('admin','merchant')
+def charge_batch():
+    """Charge many cards in one transaction.
+
+    Expected JSON: {"charges": [{"card_id": 1, "amount": 10.5, "currency": "USD"}, ...]}
+    Every card_id must be an active card, otherwise nothing is charged.
+    Send an Idempotency-Key header to make retries safe.
+    """
+    d = request.json or {}
+    charges = d.get('charges')
+    if not isinstance(charges, list) or not charges:
+        return jsonify({"error": "charges must be a non-empty list"}), 400
+    if len(charges) > CHARGE_BATCH_MAX:
+        return jsonify({"error": f"at most {CHARGE_BATCH_MAX} charges per batch"}), 400
+
+    rows = []
+    for i, c in enumerate(charges):
+        try:
+            card_id = int(c['card_id'])
+            amount = float(c['amount'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": f"charge {i}: card_id and numeric amount are required"}), 400
+        if not math.isfinite(amount):
+            return jsonify({"error": f"charge {i}: amount must be a finite number"}), 400
+        if amount <= 0:
+            return jsonify({"error": f"charge {i}: amount must be positive"}), 400
+        rows.append((card_id, amount, c.get('currency', 'USD')))
+
+    def handler(db, cur):
+        # One set-based check for every card in the batch
+        merchants = _active_cards(cur, [r[0] for r in rows])
+        missing = sorted({r[0] for r in rows if r[0] not in merchants})
+        if missing:
+            return 404, {"error": "Unknown or inactive card_id(s)", "card_ids": missing}
+        now = datetime.now().replace(microsecond=0)
+        cur.executemany(CHARGE_SQL, [r + (now,) for r in rows])
+        rollups.apply(cur, [(merchants[card_id], card_id, now, currency, 'success', amount)
+                            for card_id, amount, currency in rows])
+        return 201, {"message": "charged", "count": len(rows)}
+
+    status, body, replayed = _idempotent(handler, charges)
+    if status < 400 and not replayed:
+        audit_log(session['user_id'], "CHARGE", "transactions", new_value=f"batch of {len(rows)} charges")
+    return _respond(status, body, replayed)
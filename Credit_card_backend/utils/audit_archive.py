@@ -0,0 +1,369 @@
+"""Monthly partitions for audit_logs and archival of old months to compressed segment files.
+
+On MySQL, audit_logs is RANGE COLUMNS-partitioned on created_at, one
+partition per month (p202610 holds October 2026) plus pmax for anything
+later. Migration 7 converts the table; `ensure_partitions` keeps months
+ahead of the clock.
+
+`archive` walks the month boundaries older than the hot window. For each
+boundary B it:
+1. streams every row with created_at < B into a gzip NDJSON segment,
+2. records the row count and SHA-256 in a JSON manifest,
+3. removes exactly those rows.
+After the first month only late arrivals are left below B, for example
+audit events replayed from the spool. On a partitioned table the rows go
+with DROP PARTITION, done under LOCK TABLES once the count still matches.
+Otherwise (SQLite, or MySQL before migration 7) they are deleted in
+batches by log_id, read back from the segment.
+
+A segment only counts once its manifest exists. `read_archive` applies the
+same filters as /audit (utils.audit_filters) and skips segments whose time
+span cannot match.
+"""
+import gzip
+import hashlib
+import json
+import os
+import zlib
+from datetime import datetime
+from utils.audit_filters import matches, overlaps
+
+COLUMNS = ('log_id', 'created_at', 'user_id', 'table_name', 'action_type', 'record_id',
+           'old_value', 'new_value', 'ip_address')
+MAX_PARTITION = "pmax"
+DELETE_BATCH = 1000
+FETCH_BATCH = 1000
+_HASH_CHUNK = 1024 * 1024
+
+
+class ArchiveError(Exception):
+    """A segment failed verification or the table changed underneath an archive run."""
+
+
+def _is_sqlite(cur):
+    return getattr(cur, "dialect", None) == "sqlite"
+
+
+def _oldest(cur):
+    cur.execute("SELECT MIN(created_at) FROM audit_logs")
+    oldest = cur.fetchone()[0]
+    # SQLite loses the column type on aggregates and returns the stored text
+    return datetime.fromisoformat(oldest) if isinstance(oldest, str) else oldest
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(bound):
+    # The partition below `bound` holds the month before it
+    return f"p{add_months(bound, -1):%Y%m}"
+
+
+# ---------------------------------------------------------------------------
+# Partitions (MySQL only)
+# ---------------------------------------------------------------------------
+
+def partitions(cur):
+    """[(name, upper bound or None for MAXVALUE, approximate rows)] in order; [] if not partitioned."""
+    if _is_sqlite(cur):
+        return []
+    cur.execute(
+        "SELECT partition_name, partition_description, table_rows FROM information_schema.partitions "
+        "WHERE table_schema = DATABASE() AND table_name = 'audit_logs' AND partition_name IS NOT NULL "
+        "ORDER BY partition_ordinal_position"
+    )
+    result = []
+    for name, description, rows in cur.fetchall():
+        description = description.decode() if isinstance(description, (bytes, bytearray)) else description
+        bound = None if description == "MAXVALUE" else datetime.fromisoformat(description.strip("'"))
+        result.append((name, bound, rows))
+    return result
+
+
+def _partition_clause(bound):
+    return f"PARTITION {partition_name(bound)} VALUES LESS THAN ('{bound:%Y-%m-%d %H:%M:%S}')"
+
+
+def partition_table(cur, ahead):
+    """Convert audit_logs to monthly partitions covering its oldest row through `ahead` months from now.
+
+    MySQL requires the partitioning column in every unique key, so the
+    primary key becomes (log_id, created_at). Rebuilds the table.
+    """
+    if _is_sqlite(cur) or partitions(cur):
+        return
+    oldest = _oldest(cur) or datetime.now()
+    bound, last = add_months(month_start(oldest), 1), add_months(month_start(datetime.now()), ahead + 1)
+    clauses = []
+    while bound <= last:
+        clauses.append(_partition_clause(bound))
+        bound = add_months(bound, 1)
+    clauses.append(f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    cur.execute("ALTER TABLE audit_logs DROP PRIMARY KEY, ADD PRIMARY KEY (log_id, created_at)")
+    cur.execute(f"ALTER TABLE audit_logs PARTITION BY RANGE COLUMNS(created_at) ({', '.join(clauses)})")
+
+
+def ensure_partitions(cur, ahead):
+    """Split pmax so there is a partition for every month up to `ahead` months from now; returns the new names."""
+    bounds = [bound for _, bound, _ in partitions(cur) if bound is not None]
+    if not bounds:
+        return []
+    bound, last = add_months(bounds[-1], 1), add_months(month_start(datetime.now()), ahead + 1)
+    clauses = []
+    while bound <= last:
+        clauses.append(_partition_clause(bound))
+        bound = add_months(bound, 1)
+    if clauses:
+        cur.execute(f"ALTER TABLE audit_logs REORGANIZE PARTITION {MAX_PARTITION} INTO "
+                    f"({', '.join(clauses)}, PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE))")
+    return [c.split()[1] for c in clauses]
+
+
+# ---------------------------------------------------------------------------
+# Segments
+# ---------------------------------------------------------------------------
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _segment_base(directory, bound):
+    # A month can get more than one segment when late rows arrive after it was archived
+    month = add_months(bound, -1)
+    seq = 1
+    while os.path.exists(os.path.join(directory, f"audit-{month:%Y%m}-{seq:03d}.json")):
+        seq += 1
+    return os.path.join(directory, f"audit-{month:%Y%m}-{seq:03d}")
+
+
+def _record(row):
+    record = dict(zip(COLUMNS, row))
+    if isinstance(record['created_at'], datetime):
+        record['created_at'] = record['created_at'].isoformat()
+    return record
+
+
+def export_segment(conn, bound, directory):
+    """Write every row with created_at < bound to a new segment; returns its manifest, or None if there were none."""
+    os.makedirs(directory, exist_ok=True)
+    base = _segment_base(directory, bound)
+    data_path, tmp_path = base + ".ndjson.gz", base + ".ndjson.gz.tmp"
+    rows, first, last, min_id, max_id = 0, None, None, None, None
+    cur = conn.cursor(buffered=False)
+    try:
+        cur.execute(f"SELECT {', '.join(COLUMNS)} FROM audit_logs WHERE created_at < %s "
+                    "ORDER BY created_at, log_id", (bound,))
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as out:
+            while True:
+                batch = cur.fetchmany(FETCH_BATCH)
+                if not batch:
+                    break
+                for row in batch:
+                    record = _record(row)
+                    out.write(json.dumps(record, default=str) + "\n")
+                    first = first or record['created_at']
+                    last = record['created_at']
+                    min_id = record['log_id'] if min_id is None else min(min_id, record['log_id'])
+                    max_id = record['log_id'] if max_id is None else max(max_id, record['log_id'])
+                    rows += 1
+    finally:
+        cur.close()
+    if not rows:
+        os.remove(tmp_path)
+        return None
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, data_path)
+
+    manifest = {
+        "segment": os.path.basename(base),
+        "file": os.path.basename(data_path),
+        "upper_bound": bound.isoformat(),
+        "rows": rows,
+        "first_created_at": first,
+        "last_created_at": last,
+        "min_log_id": min_id,
+        "max_log_id": max_id,
+        "sha256": _file_sha256(data_path),
+        "bytes": os.path.getsize(data_path),
+        "archived_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    tmp_manifest = base + ".json.tmp"
+    with open(tmp_manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_manifest, base + ".json")
+    return dict(manifest, path=data_path)
+
+
+def discard_segment(manifest):
+    """Remove a segment whose rows were left in the table (e.g. after a failed count check)."""
+    base = manifest["path"][:-len(".ndjson.gz")]
+    for path in (base + ".json", manifest["path"]):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def segments(directory):
+    """Manifests of the complete segments in `directory`, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    result = []
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith("audit-") and name.endswith(".json")):
+            continue
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest["path"] = os.path.join(directory, manifest["file"])
+        result.append(manifest)
+    return result
+
+
+def read_segment(manifest, verify=True):
+    """Yield a segment's records; with verify, raise ArchiveError at the end if the checksum or count is off."""
+    digest, rows = hashlib.sha256(), 0
+
+    class _Hashing:
+        def __init__(self, raw):
+            self.raw = raw
+
+        def read(self, size=-1):
+            data = self.raw.read(size)
+            digest.update(data)
+            return data
+
+    with open(manifest["path"], "rb") as raw:
+        try:
+            with gzip.GzipFile(fileobj=_Hashing(raw) if verify else raw, mode="rb") as f:
+                for line in f:
+                    rows += 1
+                    yield json.loads(line)
+        except (OSError, EOFError, zlib.error, ValueError) as e:
+            raise ArchiveError(f"segment {manifest['segment']} is unreadable: {e}") from e
+        if verify:
+            # Hash anything the decompressor did not need to read
+            for chunk in iter(lambda: raw.read(_HASH_CHUNK), b""):
+                digest.update(chunk)
+    if verify and (digest.hexdigest() != manifest["sha256"] or rows != manifest["rows"]):
+        raise ArchiveError(f"segment {manifest['segment']} failed verification")
+
+
+def verify_segment(manifest):
+    for _ in read_segment(manifest, verify=True):
+        pass
+
+
+def read_archive(directory, filters, verify=False):
+    """Yield archived records matching `filters` (see utils.audit_filters), oldest segment first."""
+    for manifest in segments(directory):
+        if not overlaps(filters, manifest["first_created_at"], manifest["last_created_at"]):
+            continue
+        for record in read_segment(manifest, verify):
+            if matches(filters, record):
+                yield record
+
+
+# ---------------------------------------------------------------------------
+# Archival
+# ---------------------------------------------------------------------------
+
+def archive_bounds(cur, hot_months, now=None):
+    """Month boundaries whose rows are past the hot window (the current month plus hot_months - 1 before it)."""
+    cutoff = add_months(month_start(now or datetime.now()), -(hot_months - 1))
+    parts = partitions(cur)
+    if parts:
+        return [bound for _, bound, _ in parts if bound is not None and bound <= cutoff]
+    oldest = _oldest(cur)
+    if oldest is None:
+        return []
+    bounds, bound = [], add_months(month_start(oldest), 1)
+    while bound <= cutoff:
+        bounds.append(bound)
+        bound = add_months(bound, 1)
+    return bounds
+
+
+def _drop_partition(conn, bound, expected):
+    cur = conn.cursor(buffered=True)
+    try:
+        # Hold off writers so nothing lands in the partition between the count and the drop
+        cur.execute("LOCK TABLES audit_logs WRITE")
+        try:
+            cur.execute("SELECT COUNT(*) FROM audit_logs WHERE created_at < %s", (bound,))
+            found = cur.fetchone()[0]
+            if found != expected:
+                raise ArchiveError(f"{found} rows below {bound:%Y-%m-%d} but {expected} were exported")
+            cur.execute(f"ALTER TABLE audit_logs DROP PARTITION {partition_name(bound)}")
+        finally:
+            cur.execute("UNLOCK TABLES")
+    finally:
+        cur.close()
+
+
+def _delete_exported(conn, manifest):
+    cur = conn.cursor(buffered=True)
+    deleted, ids = 0, []
+    try:
+        # Reading the segment back also verifies it before anything is removed
+        for record in read_segment(manifest, verify=True):
+            ids.append(record["log_id"])
+            if len(ids) == DELETE_BATCH:
+                deleted += _delete_ids(conn, cur, ids)
+                ids = []
+        if ids:
+            deleted += _delete_ids(conn, cur, ids)
+    finally:
+        cur.close()
+    return deleted
+
+
+def _delete_ids(conn, cur, ids):
+    cur.execute(f"DELETE FROM audit_logs WHERE log_id IN ({','.join(['%s'] * len(ids))})", tuple(ids))
+    conn.commit()
+    return cur.rowcount
+
+
+def archive(conn, directory, hot_months, dry_run=False, log=print):
+    """Archive and remove every month past the hot window; returns the manifests written."""
+    cur = conn.cursor(buffered=True)
+    try:
+        partitioned = bool(partitions(cur))
+        bounds = archive_bounds(cur, hot_months)
+        if dry_run:
+            for bound in bounds:
+                cur.execute("SELECT COUNT(*) FROM audit_logs WHERE created_at < %s", (bound,))
+                log(f"[ARCHIVE] would archive {cur.fetchone()[0]} rows below {bound:%Y-%m-%d}")
+            return []
+    finally:
+        cur.close()
+
+    written = []
+    for bound in bounds:
+        manifest = export_segment(conn, bound, directory)
+        if partitioned:
+            if manifest:
+                verify_segment(manifest)
+            try:
+                _drop_partition(conn, bound, manifest["rows"] if manifest else 0)
+            except ArchiveError:
+                if manifest:
+                    discard_segment(manifest)
+                raise
+            log(f"[ARCHIVE] {partition_name(bound)}: {manifest['rows'] if manifest else 0} rows archived, partition dropped")
+        elif manifest:
+            deleted = _delete_exported(conn, manifest)
+            log(f"[ARCHIVE] below {bound:%Y-%m-%d}: {manifest['rows']} rows archived, {deleted} deleted")
+        if manifest:
+            written.append(manifest)
+    return written
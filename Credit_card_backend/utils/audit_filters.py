@@ -0,0 +1,66 @@
+from utils.validation import parse_timestamp as _parse_time
+
+# Filter name -> parser; each column has a (column, created_at) index (migration 6)
+FIELDS = {'user_id': int, 'table_name': str, 'action_type': str, 'record_id': int}
+
+
+def parse_filters(args):
+    """Read user_id, table_name, action_type, record_id, since and until from a mapping.
+
+    `args` is request.args or a dict from the command line; empty values are
+    ignored. since is inclusive and until exclusive.
+    Raises ValueError with a client-facing message on bad input.
+    """
+    filters = {}
+    for name, parse in FIELDS.items():
+        value = args.get(name)
+        if value is None or value == '':
+            continue
+        try:
+            filters[name] = parse(value)
+        except ValueError:
+            raise ValueError(f"{name} must be an integer")
+    for name in ('since', 'until'):
+        value = args.get(name)
+        if value:
+            filters[name] = _parse_time(name, value)
+    return filters
+
+
+def filter_sql(filters):
+    """WHERE clauses and params for the live audit_logs table."""
+    clauses, params = [], []
+    for name in FIELDS:
+        if name in filters:
+            clauses.append(f"{name} = %s")
+            params.append(filters[name])
+    if 'since' in filters:
+        clauses.append("created_at >= %s")
+        params.append(filters['since'])
+    if 'until' in filters:
+        clauses.append("created_at < %s")
+        params.append(filters['until'])
+    return clauses, params
+
+
+def matches(filters, record):
+    """The same test as filter_sql, applied to an archived record (created_at as ISO text)."""
+    for name in FIELDS:
+        if name in filters and record.get(name) != filters[name]:
+            return False
+    if 'since' in filters or 'until' in filters:
+        created_at = _parse_time('created_at', record['created_at'])
+        if 'since' in filters and created_at < filters['since']:
+            return False
+        if 'until' in filters and created_at >= filters['until']:
+            return False
+    return True
+
+
+def overlaps(filters, first, last):
+    """False when a time range [first, last] cannot contain a row matching since/until."""
+    if 'since' in filters and last is not None and _parse_time('last', last) < filters['since']:
+        return False
+    if 'until' in filters and first is not None and _parse_time('first', first) >= filters['until']:
+        return False
+    return True
@@ -1,5 +1,202 @@
 import hashlib
-from ..config import AES_KEY
+import hmac
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from config import AES_KEY, BLIND_INDEX_KEY, CRYPTO_WORKERS, CRYPTO_PARALLEL_MIN
+from utils.metrics import add_timing
+
+# Ciphertext layout (all fields big-endian):
+#   magic "CV" | version (1 byte) | key_id (4 bytes) | nonce (12 bytes) | ciphertext + GCM tag
+# The header is passed as associated data, so the version and key id are authenticated too.
+MAGIC = b"CV"
+VERSION = 1
+HEADER = struct.Struct(">2sBI")
+NONCE_SIZE = 12
+TAG_SIZE = 16
+# key_id 0 is the master key itself; other ids refer to data keys
+MASTER_KEY_ID = 0
+
+
+class DecryptionError(Exception):
+    """An envelope failed authentication: it was tampered with, corrupted, or wrapped under another key."""
+
 
 def sha256_hash(text):
-    return hashlib.sha256(text.encode()).hexdigest()
\ No newline at end of file
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _derive_master_key(secret):
+    # A 64 char hex AES_KEY is used as-is (AES-256); anything else is hashed down to 32 bytes
+    try:
+        key = bytes.fromhex(secret)
+        if len(key) in (16, 24, 32):
+            return key
+    except ValueError:
+        pass
+    return hashlib.sha256(secret.encode()).digest()
+
+
+def _mysql_aes_key(secret, size=16):
+    # MySQL folds the AES_ENCRYPT key into `size` bytes by XOR-ing it in cyclically
+    folded = bytearray(size)
+    for i, b in enumerate(secret.encode()):
+        folded[i % size] ^= b
+    return bytes(folded)
+
+
+MASTER_KEY = _derive_master_key(AES_KEY)
+_LEGACY_KEY = _mysql_aes_key(AES_KEY)
+
+# Blind indexes: keyed HMAC-SHA256 of a normalised value, stored next to the
+# ciphertext so equality lookups hit an index instead of decrypting every row.
+# Each kind gets its own subkey, so equal values in different columns don't match.
+_BLIND_INDEX_BASE = (_derive_master_key(BLIND_INDEX_KEY) if BLIND_INDEX_KEY
+                     else hmac.new(MASTER_KEY, b"blind-index", hashlib.sha256).digest())
+_BLIND_INDEX_NORMALIZE = {
+    "card_number": lambda v: "".join(ch for ch in str(v) if ch.isdigit()),
+    "email": lambda v: str(v).strip().lower(),
+}
+_BLIND_INDEX_KEYS = {kind: hmac.new(_BLIND_INDEX_BASE, kind.encode(), hashlib.sha256).digest()
+                     for kind in _BLIND_INDEX_NORMALIZE}
+
+
+def is_envelope(blob):
+    """True if `blob` carries this module's header (as opposed to legacy SQL AES_ENCRYPT output)."""
+    return (blob is not None and len(blob) >= HEADER.size + NONCE_SIZE + TAG_SIZE
+            and bytes(blob[:2]) == MAGIC and blob[2] == VERSION)
+
+
+def key_id_of(blob):
+    """Return the key id stored in an envelope header, or None for legacy/empty values."""
+    if not is_envelope(blob):
+        return None
+    return HEADER.unpack_from(bytes(blob[:HEADER.size]))[2]
+
+
+def encrypt_field(value, key=None, key_id=MASTER_KEY_ID):
+    """Encrypt a text value with AES-GCM; returns bytes ready for a VARBINARY/BLOB column."""
+    if value is None:
+        return None
+    if key is None:
+        key, key_id = MASTER_KEY, MASTER_KEY_ID
+    start = time.perf_counter()
+    header = HEADER.pack(MAGIC, VERSION, key_id)
+    nonce = os.urandom(NONCE_SIZE)
+    blob = header + nonce + AESGCM(key).encrypt(nonce, str(value).encode('utf-8'), header)
+    add_timing("crypto", time.perf_counter() - start)
+    return blob
+
+
+def blind_index(kind, value):
+    """32-byte HMAC of `value` for the `kind` column ('card_number' or 'email'); None for empty values."""
+    if value is None:
+        return None
+    normalized = _BLIND_INDEX_NORMALIZE[kind](value)
+    if not normalized:
+        return None
+    return hmac.new(_BLIND_INDEX_KEYS[kind], normalized.encode('utf-8'), hashlib.sha256).digest()
+
+
+def decrypt_legacy(blob, secret_key=None):
+    """Decrypt a value written by MySQL's AES_ENCRYPT (default aes-128-ecb mode)."""
+    key = _LEGACY_KEY if secret_key is None else _mysql_aes_key(secret_key)
+    if not blob or len(blob) % 16:
+        return None
+    decryptor = Cipher(algorithms.AES(key), modes.ECB()).decryptor()
+    padded = decryptor.update(bytes(blob)) + decryptor.finalize()
+    pad = padded[-1]
+    if pad < 1 or pad > 16 or padded[-pad:] != bytes([pad]) * pad:
+        return None
+    return padded[:-pad]
+
+
+def decrypt_bytes(blob, keys=None, master_key=None):
+    """Decrypt to raw bytes. `keys` maps key_id -> key bytes; the master key is always known.
+
+    `master_key` replaces MASTER_KEY for key_id 0, for rotate_keys.py --new-master-key.
+
+    Legacy values that cannot be decrypted give None, like SQL AES_DECRYPT does.
+    An envelope whose tag does not verify raises DecryptionError.
+    """
+    if blob is None:
+        return None
+    if not is_envelope(blob):
+        return decrypt_legacy(blob)
+    blob = bytes(blob)
+    key_id = HEADER.unpack_from(blob)[2]
+    if key_id == MASTER_KEY_ID:
+        key = MASTER_KEY if master_key is None else master_key
+    else:
+        key = (keys or {}).get(key_id)
+    if key is None:
+        raise KeyError(f"data key {key_id} is not available")
+    nonce = blob[HEADER.size:HEADER.size + NONCE_SIZE]
+    try:
+        return AESGCM(key).decrypt(nonce, blob[HEADER.size + NONCE_SIZE:], blob[:HEADER.size])
+    except InvalidTag:
+        raise DecryptionError(f"envelope under key {key_id} failed authentication") from None
+
+
+def _to_text(v):
+    if isinstance(v, (bytes, bytearray)):
+        try:
+            return v.decode('utf-8')
+        except Exception:
+            return v.hex()
+    return v
+
+
+def decrypt_field(blob, keys=None, master_key=None):
+    return _to_text(decrypt_bytes(blob, keys, master_key))
+
+
+def _decrypt_chunk(records, fields, keys):
+    for r in records:
+        for k, v in r.items():
+            if k in fields:
+                r[k] = decrypt_field(v, keys)
+            elif isinstance(v, (bytes, bytearray)):
+                r[k] = _to_text(v)
+    return records
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Threads don't survive fork, so each worker process gets its own executor
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="crypto")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def decrypt_rows(records, fields, keys=None):
+    """Decrypt `fields` in a list of row dicts in place and decode any other bytes values.
+
+    OpenSSL releases the GIL while it works, so large result sets are split
+    across a thread pool; small ones are done inline to avoid the hand-off cost.
+    """
+    fields = set(fields)
+    start = time.perf_counter()
+    try:
+        if CRYPTO_WORKERS <= 1 or len(records) * max(len(fields), 1) < CRYPTO_PARALLEL_MIN:
+            return _decrypt_chunk(records, fields, keys)
+        size = -(-len(records) // CRYPTO_WORKERS)
+        chunks = [records[i:i + size] for i in range(0, len(records), size)]
+        for _ in _get_executor().map(lambda c: _decrypt_chunk(c, fields, keys), chunks):
+            pass
+        return records
+    finally:
+        add_timing("crypto", time.perf_counter() - start)
@@ -1,5 +1,5 @@
 from functools import wraps 
-from flask import session, jsonify
+from flask import g, session, jsonify
 
 def require_role(*roles):
     def decorator(f):
@@ -13,4 +13,13 @@ def require_role(*roles):
                 return jsonify({"error": "You're not allowed here!"}), 403
             return f(*args, **kwargs)
         return wrapper 
-    return decorator
\ No newline at end of file
+    return decorator
+
+
+def read_only(f):
+    """Mark a view that never writes, so get_db() may serve it from the read replica (utils/replica.py)."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return f(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,54 @@
+import hashlib
+import json
+from config import IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL
+from utils.cache import LRUCache
+
+# Results of idempotent requests live in `idempotency_keys` (unique on user + key)
+# and, for a few minutes, in this in-memory cache so quick client retries
+# are answered without a round trip to the database.
+_recent = LRUCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL)
+
+
+class KeyReuseError(Exception):
+    """The idempotency key was already used for a different request body."""
+
+
+def request_hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def lookup(cur, user_id, key, req_hash):
+    """Return the stored (status_code, body) for this key, or None if it is new."""
+    entry = _recent.get((user_id, key))
+    if entry is None:
+        cur.execute(
+            "SELECT request_hash, status_code, response_body FROM idempotency_keys WHERE user_id = %s AND idem_key = %s",
+            (user_id, key)
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        entry = (row[0], row[1], json.loads(row[2]))
+        _recent.put((user_id, key), entry)
+    stored_hash, status_code, body = entry
+    if stored_hash != req_hash:
+        raise KeyReuseError(key)
+    return status_code, body
+
+
+def store(cur, user_id, key, req_hash, status_code, body):
+    """Record the result in the caller's transaction; the unique index rejects a concurrent duplicate."""
+    cur.execute(
+        "INSERT INTO idempotency_keys (user_id, idem_key, request_hash, status_code, response_body) "
+        "VALUES (%s, %s, %s, %s, %s)",
+        (user_id, key, req_hash, status_code, json.dumps(body))
+    )
+
+
+def remember(user_id, key, req_hash, status_code, body):
+    """Cache a result once its transaction has committed."""
+    _recent.put((user_id, key), (req_hash, status_code, body))
+
+
+def idempotency_cache_stats():
+    return _recent.snapshot()
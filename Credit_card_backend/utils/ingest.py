@@ -0,0 +1,173 @@
+import csv
+import io
+import json
+from collections import defaultdict
+from config import BULK_BATCH_SIZE, BULK_MAX_ERRORS
+from db import shard_connection
+from utils.crypto import encrypt_field, blind_index
+from utils.keystore import get_merchant_key
+from utils.logger import audit_log
+from utils.list_cache import bump
+from utils import outbox, shards
+from utils.validation import card_error
+
+FORMATS = ('csv', 'ndjson')
+REQUIRED = ('customer_id', 'card', 'exp', 'cvv')
+
+INSERT_SQL = """
+    INSERT INTO card_vault (customer_id, card_number_enc, card_holder_enc, expiry_date_enc, cvv_enc, last_four_digits, status, is_default, card_number_bidx)
+    VALUES (%s, %s, %s, %s, %s, %s, 'Active', 0, %s)"""
+
+
+def read_records(stream, fmt):
+    """Yield (row_number, record) from a binary stream without reading it all into memory.
+
+    CSV needs a header row with customer_id,card,exp,cvv[,cardholderName].
+    Unparseable lines are yielded as (row_number, None).
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        for n, record in enumerate(csv.DictReader(text), start=1):
+            yield n, record
+        return
+    n = 0
+    for line in text:
+        if not line.strip():
+            continue
+        n += 1
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield n, record if isinstance(record, dict) else None
+
+
+def _check(record):
+    if record is None:
+        return None, "Unparseable row"
+    if any(not record.get(f) for f in REQUIRED):
+        return None, "Missing required fields"
+    customer_id = str(record['customer_id']).strip()
+    if not customer_id.isdigit():
+        return None, "Invalid customer_id"
+    card = str(record['card']).replace(' ', '')
+    cvv = str(record['cvv']).strip()
+    error = card_error(card, cvv)
+    if error:
+        return None, error
+    return (int(customer_id), card, str(record['exp']).strip(), cvv, record.get('cardholderName') or 'Card'), None
+
+
+class IngestReport:
+    def __init__(self, max_errors=BULK_MAX_ERRORS):
+        self.max_errors = max_errors
+        self.rows = self.inserted = self.failed = self.batches = 0
+        self.errors = []
+
+    def fail(self, row_no, error):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row_no, "error": error})
+
+    def as_dict(self):
+        return {"rows": self.rows, "inserted": self.inserted, "failed": self.failed, "batches": self.batches,
+                "errors": self.errors, "errors_truncated": self.failed > len(self.errors)}
+
+
+def _insert_batch(db, cur, batch, report, actor_user_id):
+    ids = sorted({c[0] for _, c in batch})
+    cur.execute(
+        "SELECT u.user_id, c.merchant_id FROM users u LEFT JOIN customers c ON c.customer_id = u.user_id "
+        f"WHERE u.user_id IN ({','.join(['%s'] * len(ids))})",
+        tuple(ids)
+    )
+    merchants = dict(cur.fetchall())
+    if not shards.enabled():
+        _insert_rows(db, cur, cur, batch, merchants, report, actor_user_id)
+        return
+    # Customers rows live on their merchant's shard, and so must the cards
+    located = shards.locate(shards.CUSTOMER_SQL, [u for u, m in merchants.items() if m is None])
+    merchants.update({c: m for c, (m, _) in located.items()})
+    groups = defaultdict(list)
+    for row_no, values in batch:
+        merchant_id = merchants.get(values[0])
+        try:
+            shard = shards.shard_of(merchant_id, for_write=True) if merchant_id is not None else shards.MAIN
+        except shards.ShardMoving as e:
+            report.fail(row_no, str(e))
+            continue
+        groups[shard].append((row_no, values))
+    for shard, rows in groups.items():
+        if shard == shards.MAIN:
+            _insert_rows(db, cur, cur, rows, merchants, report, actor_user_id)
+            continue
+        with shard_connection(shard) as (shard_conn, shard_cur):
+            _insert_rows(shard_conn, shard_cur, cur, rows, merchants, report, actor_user_id)
+
+
+def _insert_rows(db, cur, key_cur, batch, merchants, report, actor_user_id):
+    """Insert one shard's part of a batch on its connection; data keys come from main through key_cur."""
+    # Cards already in the vault for the same customer, found through the blind index in one query
+    bidx = {row_no: blind_index('card_number', c[1]) for row_no, c in batch}
+    cur.execute(
+        f"SELECT customer_id, card_number_bidx FROM card_vault WHERE status = 'Active' AND card_number_bidx IN ({','.join(['%s'] * len(bidx))})",
+        tuple(bidx.values())
+    )
+    seen = {(customer_id, bytes(b)) for customer_id, b in cur.fetchall()}
+    rows, row_nos = [], []
+    for row_no, (customer_id, card, exp, cvv, holder) in batch:
+        if customer_id not in merchants:
+            report.fail(row_no, "User not found")
+            continue
+        if (customer_id, bidx[row_no]) in seen:
+            report.fail(row_no, "Duplicate card")
+            continue
+        seen.add((customer_id, bidx[row_no]))
+        key_id, key = get_merchant_key(key_cur, merchants[customer_id])
+        rows.append((customer_id, encrypt_field(card, key, key_id), encrypt_field(holder, key, key_id),
+                     encrypt_field(exp, key, key_id), encrypt_field(cvv, key, key_id), card[-4:], bidx[row_no]))
+        row_nos.append(row_no)
+    if not rows:
+        return
+    try:
+        # mysql.connector turns this into one multi-row INSERT
+        cur.executemany(INSERT_SQL, rows)
+        # Multi-row INSERT ids need not be consecutive, so find the new cards through the blind index
+        added = {(r[0], r[6]) for r in rows}
+        cur.execute(
+            "SELECT card_id, customer_id, card_number_bidx FROM card_vault "
+            f"WHERE status = 'Active' AND card_number_bidx IN ({','.join(['%s'] * len(added))})",
+            tuple(b for _, b in added)
+        )
+        outbox.record_many(cur, outbox.CARD_STORED, [(card_id, merchants[customer_id], customer_id)
+                                                      for card_id, customer_id, b in cur.fetchall()
+                                                      if (customer_id, bytes(b)) in added])
+        db.commit()
+        bump('card_vault')
+    except Exception as e:
+        db.rollback()
+        for row_no in row_nos:
+            report.fail(row_no, f"Batch insert failed: {e}")
+        return
+    report.inserted += len(rows)
+    report.batches += 1
+    audit_log(actor_user_id, "INSERT", "card_vault", new_value=f"bulk insert of {len(rows)} cards")
+
+
+def ingest_cards(db, cur, records, actor_user_id, batch_size=BULK_BATCH_SIZE):
+    """Validate and insert (row_number, record) pairs, one transaction per batch."""
+    report = IngestReport()
+    batch = []
+    for row_no, record in records:
+        report.rows += 1
+        values, error = _check(record)
+        if error:
+            report.fail(row_no, error)
+            continue
+        batch.append((row_no, values))
+        if len(batch) >= batch_size:
+            _insert_batch(db, cur, batch, report, actor_user_id)
+            batch = []
+    if batch:
+        _insert_batch(db, cur, batch, report, actor_user_id)
+    return report
@@ -0,0 +1,133 @@
+import os
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from config import DEK_CACHE_SIZE, DEK_CACHE_TTL
+from utils.cache import LRUCache
+from utils.crypto import MASTER_KEY, MASTER_KEY_ID, NONCE_SIZE, key_id_of, decrypt_rows
+
+# Per-merchant data encryption keys (DEKs) are stored in `data_keys` wrapped
+# with the master key. Rows encrypted under a DEK carry its key_id in the
+# ciphertext header, so retired keys keep working until data is re-encrypted.
+_cache = LRUCache(DEK_CACHE_SIZE, DEK_CACHE_TTL)
+
+
+def dek_cache_stats():
+    return _cache.snapshot()
+
+
+def _aad(merchant_id):
+    return f"dek:{merchant_id}".encode()
+
+
+def wrap_key(dek, merchant_id, master_key=MASTER_KEY):
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + AESGCM(master_key).encrypt(nonce, dek, _aad(merchant_id))
+
+
+def unwrap_key(wrapped, merchant_id, master_key=MASTER_KEY):
+    wrapped = bytes(wrapped)
+    return AESGCM(master_key).decrypt(wrapped[:NONCE_SIZE], wrapped[NONCE_SIZE:], _aad(merchant_id))
+
+
+def _create_key(merchant_id):
+    # Committed on its own connection: a DEK must never disappear with a
+    # rolled-back request while it is already cached and in use.
+    from db import get_pool
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        cur = conn.cursor()
+        dek = AESGCM.generate_key(bit_length=256)
+        cur.execute(
+            "INSERT INTO data_keys (merchant_id, wrapped_key, status) VALUES (%s, %s, 'Active')",
+            (merchant_id, wrap_key(dek, merchant_id))
+        )
+        key_id = cur.lastrowid
+        conn.commit()
+        cur.close()
+    finally:
+        pool.release(conn)
+    return key_id, dek
+
+
+def get_merchant_key(cur, merchant_id):
+    """Return (key_id, key) to encrypt new data for `merchant_id`, creating a DEK on first use.
+
+    Data that has no merchant is encrypted under the master key.
+    """
+    if merchant_id is None:
+        return MASTER_KEY_ID, MASTER_KEY
+    merchant_id = int(merchant_id)
+    cached = _cache.get(("merchant", merchant_id))
+    if cached is not None:
+        return cached
+    cur.execute(
+        "SELECT key_id, wrapped_key FROM data_keys WHERE merchant_id = %s AND status = 'Active' "
+        "ORDER BY key_id DESC LIMIT 1",
+        (merchant_id,)
+    )
+    row = cur.fetchone()
+    if row:
+        key_id, dek = row[0], unwrap_key(row[1], merchant_id)
+    else:
+        key_id, dek = _create_key(merchant_id)
+    _cache.put(("merchant", merchant_id), (key_id, dek))
+    _cache.put(("key", key_id), dek)
+    return key_id, dek
+
+
+def keys_for(cur, blobs, master_key=MASTER_KEY):
+    """Map every key id referenced by `blobs` to its unwrapped key, with one query for cache misses."""
+    keys, missing = {}, set()
+    for blob in blobs:
+        key_id = key_id_of(blob)
+        if key_id is None or key_id == MASTER_KEY_ID or key_id in keys or key_id in missing:
+            continue
+        dek = _cache.get(("key", key_id))
+        if dek is None:
+            missing.add(key_id)
+        else:
+            keys[key_id] = dek
+    if missing:
+        ids = sorted(missing)
+        cur.execute(
+            f"SELECT key_id, merchant_id, wrapped_key FROM data_keys WHERE key_id IN ({','.join(['%s'] * len(ids))})",
+            tuple(ids)
+        )
+        for key_id, merchant_id, wrapped in cur.fetchall():
+            dek = unwrap_key(wrapped, merchant_id, master_key)
+            _cache.put(("key", key_id), dek)
+            keys[key_id] = dek
+    return keys
+
+
+def decrypt_records(cur, records, fields):
+    """Resolve the data keys a result set needs, then decrypt it with utils.crypto.decrypt_rows."""
+    keys = keys_for(cur, (r.get(f) for r in records for f in fields))
+    return decrypt_rows(records, fields, keys)
+
+
+def rotate_merchant_key(db, cur, merchant_id):
+    """Retire the merchant's active DEK and issue a new one. Old keys stay readable."""
+    merchant_id = int(merchant_id)
+    cur.execute(
+        "UPDATE data_keys SET status = 'Retired', retired_at = NOW() WHERE merchant_id = %s AND status = 'Active'",
+        (merchant_id,)
+    )
+    dek = AESGCM.generate_key(bit_length=256)
+    cur.execute(
+        "INSERT INTO data_keys (merchant_id, wrapped_key, status) VALUES (%s, %s, 'Active')",
+        (merchant_id, wrap_key(dek, merchant_id))
+    )
+    key_id = cur.lastrowid
+    db.commit()
+    evict_merchant(merchant_id)
+    return key_id
+
+
+def evict_merchant(merchant_id):
+    """Drop the cached active key for a merchant so the next write picks up a rotated DEK."""
+    _cache.evict(("merchant", int(merchant_id)))
+
+
+def evict_key(key_id):
+    _cache.evict(("key", key_id))
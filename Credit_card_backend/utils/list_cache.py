@@ -0,0 +1,192 @@
+"""Conditional GETs and a write-invalidated response cache for the list endpoints.
+
+Every table a list endpoint reads has a version counter. Write paths call
+`bump()` after they commit. A list response's ETag is a hash of the request
+(endpoint, path and query, role, user) and the versions of the tables it
+reads, so `If-None-Match` is answered with a 304 before the view runs and
+without a database connection.
+
+Non-sensitive bodies (nothing decrypted) are also kept in a bounded LRU
+keyed by that ETag, so a poll that comes back without a validator is
+served from memory until the next write.
+
+The counters live in a small memory-mapped file (TABLE_VERSIONS_PATH)
+shared by every worker on the host, and only there: a write on another
+host does not bump them. So ETags and cached bodies are served only with
+LIST_CACHE_ENABLED, which is for deployments whose instances all run on
+one host, like the single container the Dockerfile builds; otherwise the
+list views respond as if undecorated. Versions are read before the view
+queries and bumped after the writer commits, so a body is never cached
+under a version newer than its data. Writes made outside the app are
+picked up within LIST_CACHE_TTL seconds: the TTL window is part of the ETag.
+
+Each bump also records its time. A view served from the read replica
+(utils/replica.py) gets neither an ETag nor a cached body while the
+replica may not have applied the latest bumped write yet.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from functools import wraps
+from flask import Response, g, request, session, make_response
+from config import LIST_CACHE_ENABLED, LIST_CACHE_SIZE, LIST_CACHE_TTL, LIST_CACHE_MAX_BODY, TABLE_VERSIONS_PATH
+from utils.cache import LRUCache
+
+TABLES = ('merchants', 'customers', 'card_vault')
+# Slot 0 holds a random value written when the file is created, so counters
+# that restart from zero (e.g. after a reboot) never reproduce an old ETag
+_SLOTS = ('nonce',) + TABLES
+_COUNTER = struct.Struct("<Q")
+# Counters, then the time of each table's last bump in microseconds
+_SIZE = _COUNTER.size * (len(_SLOTS) + len(TABLES))
+_MASK = (1 << 64) - 1
+
+
+def _stamp_offset(table):
+    return _COUNTER.size * (len(_SLOTS) + TABLES.index(table))
+
+
+class TableVersions:
+    """Per-table write counters and times in a memory-mapped file; reads are a memory access, bumps take a file lock."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def _mapped(self):
+        # A forked worker shares the parent's open file, and flock() would not exclude between them
+        if self._pid == os.getpid():
+            return self._map
+        with self._lock:
+            if self._pid != os.getpid():
+                if self._fd is not None:
+                    self._map.close()
+                    os.close(self._fd)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size < _SIZE:
+                        os.ftruncate(fd, 0)
+                        os.write(fd, os.urandom(_COUNTER.size) + bytes(_SIZE - _COUNTER.size))
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                self._fd, self._map, self._pid = fd, mmap.mmap(fd, _SIZE), os.getpid()
+        return self._map
+
+    def get(self, tables):
+        m = self._mapped()
+        return tuple(_COUNTER.unpack_from(m, _COUNTER.size * _SLOTS.index(t))[0] for t in ('nonce',) + tuple(tables))
+
+    def written_at(self, tables):
+        """Time of the most recent bump of any of `tables` (0 if never bumped)."""
+        m = self._mapped()
+        return max(_COUNTER.unpack_from(m, _stamp_offset(t))[0] for t in tables) / 1e6
+
+    def bump(self, tables):
+        m = self._mapped()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = int(time.time() * 1e6)
+                for t in tables:
+                    offset = _COUNTER.size * _SLOTS.index(t)
+                    _COUNTER.pack_into(m, offset, (_COUNTER.unpack_from(m, offset)[0] + 1) & _MASK)
+                    _COUNTER.pack_into(m, _stamp_offset(t), now)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+_versions = TableVersions(TABLE_VERSIONS_PATH)
+_bodies = LRUCache(LIST_CACHE_SIZE, LIST_CACHE_TTL)
+_stats_lock = threading.Lock()
+_stats = {"not_modified": 0, "stored": 0, "too_large": 0, "replica_behind": 0}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def bump(*tables):
+    """Invalidate ETags and cached bodies that depend on `tables`. Call after the write has committed."""
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        raise KeyError(f"no version counter for {', '.join(sorted(unknown))}")
+    _versions.bump(tables)
+
+
+def _etag(tables):
+    identity = (request.endpoint, request.full_path, session.get('user_role'), session.get('user_id'),
+                _versions.get(tables), int(time.time() // LIST_CACHE_TTL))
+    return hashlib.sha256(repr(identity).encode()).hexdigest()[:32]
+
+
+def _validated(response, etag):
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate it on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def conditional_list(*tables, store=True):
+    """Give a GET list view strong ETags derived from the versions of `tables`.
+
+    Place it under @require_role. With store=True the serialized body is
+    cached as well, unless the view decrypted anything (see
+    utils.projection, which records the fields in g.secret_fields).
+    Streamed and non-200 responses pass through untouched, as do
+    responses read from a replica that may be missing the latest write,
+    and every response while LIST_CACHE_ENABLED is off.
+    """
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        raise KeyError(f"no version counter for {', '.join(sorted(unknown))}")
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not LIST_CACHE_ENABLED:
+                return view(*args, **kwargs)
+            etag = _etag(tables)
+            if request.if_none_match.contains_weak(etag):
+                _count("not_modified")
+                return _validated(Response(status=304), etag)
+            if store:
+                body = _bodies.get(etag)
+                if body is not None:
+                    return _validated(Response(body, mimetype='application/json'), etag)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            through = g.get('replica_through')
+            if through is not None and through < _versions.written_at(tables):
+                # Validating this body would let a stale read outlive the write that bumped the version
+                _count("replica_behind")
+                return response
+            if store and not g.get('secret_fields'):
+                body = response.get_data()
+                if len(body) <= LIST_CACHE_MAX_BODY:
+                    _bodies.put(etag, body)
+                    _count("stored")
+                else:
+                    _count("too_large")
+            return _validated(response, etag)
+        return wrapper
+    return decorator
+
+
+def list_cache_stats():
+    data = _bodies.snapshot()
+    with _stats_lock:
+        data.update(_stats)
+    data["enabled"] = int(LIST_CACHE_ENABLED)
+    return data
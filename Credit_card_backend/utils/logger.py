@@ -1,14 +1,243 @@
-from db import get_db
+import atexit
+import glob
+import json
+import os
+import queue
+import re
+import threading
+import time
+from db import get_db, get_pool
 from datetime import datetime
-from flask import request 
+from flask import request, has_request_context
+from config import (AUDIT_ASYNC, AUDIT_QUEUE_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL,
+                    AUDIT_QUEUE_FULL, AUDIT_BLOCK_TIMEOUT, AUDIT_SPOOL_DIR)
 
-def audit_log(user_id, action_type, table_name, old_value="", new_value="", record_id=None):
-    db, cur = get_db()
-    ip_address = request.remote_addr
-    cur.execute(
+INSERT_SQL = """
+    INSERT INTO audit_logs (user_id, table_name, action_type, record_id, old_value, new_value, ip_address, created_at)
+    VALUES (%s,%s,%s,%s,%s,%s,%s,%s)"""
+
+# audit-spool-<owner pid>.ndjson, renamed to ...ndjson.replaying-<pid> by the worker replaying it
+_SPOOL_NAME = re.compile(r"audit-spool-(\d+)\.ndjson(?:\.replaying-(\d+))?")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AuditWriter:
+    """Background writer that batches audit events into multi-row INSERTs.
+
+    Events go on a bounded queue and a daemon thread flushes them with
+    executemany when AUDIT_BATCH_SIZE is reached or AUDIT_FLUSH_INTERVAL
+    passes. Batches that cannot be written are appended to a per-process
+    spool file and replayed once the DB is reachable again: by the worker
+    that wrote it, or by any worker once the writer has died. Pids are
+    only meaningful on one host, so the spool directory must not be shared
+    between hosts.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=1.0, queue_size=10000,
+                 on_full='block', block_timeout=0.5, spool_dir=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_full = on_full
+        self.block_timeout = block_timeout
+        self.spool_dir = spool_dir
+        self.pid = os.getpid()
+        self.spool_path = os.path.join(spool_dir, f"audit-spool-{self.pid}.ndjson") if spool_dir else None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._spool_lock = threading.Lock()
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "spooled": 0, "replayed": 0,
+                      "dropped": 0, "blocked": 0, "errors": 0}
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            if self.on_full == 'drop':
+                self.stats["dropped"] += 1
+                return
+            if self.on_full == 'block':
+                self.stats["blocked"] += 1
+                try:
+                    self._queue.put(event, timeout=self.block_timeout)
+                except queue.Full:
+                    self._spool([event])
+                    return
+            else:
+                self._spool([event])
+                return
+        self.stats["enqueued"] += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+
+    def _collect(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, rows):
+        pool = get_pool()
+        conn = pool.acquire()
+        try:
+            cur = conn.cursor()
+            cur.executemany(INSERT_SQL, rows)
+            conn.commit()
+            cur.close()
+        except Exception:
+            pool.release(conn, discard=True)
+            raise
+        pool.release(conn)
+
+    def _flush(self, batch):
+        try:
+            self._write(batch)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[AUDIT] write of {len(batch)} events failed, spooling: {e}")
+            self._spool(batch)
+            return
+        self._replay_spools()
+
+    def _spool(self, rows):
+        if not self.spool_path:
+            self.stats["dropped"] += len(rows)
+            return
+        with self._spool_lock:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            with open(self.spool_path, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(list(row), default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        self.stats["spooled"] += len(rows)
+
+    def _spool_files(self):
+        """Spool files this worker may replay: its own, and those whose writer or replayer has died.
+
+        Files already renamed to this pid come first, so claiming another
+        file under the same name never overwrites one not yet replayed.
         """
-        INSERT INTO audit_logs (user_id, table_name, action_type, record_id, old_value, new_value, ip_address)
-        VALUES (%s,%s,%s,%s,%s,%s,%s)""",
-        (user_id, table_name, action_type, record_id, old_value, new_value, ip_address)
-    )
-    db.commit()
\ No newline at end of file
+        files = []
+        for path in glob.glob(os.path.join(self.spool_dir, "audit-spool-*")):
+            match = _SPOOL_NAME.fullmatch(os.path.basename(path))
+            if not match:
+                continue
+            owner, replayer = match.groups()
+            holder = int(replayer or owner)
+            if holder == self.pid or not _pid_alive(holder):
+                claimed = os.path.join(self.spool_dir, f"audit-spool-{owner}.ndjson.replaying-{self.pid}")
+                files.append((path != claimed, path, claimed))
+        return [(path, claimed) for _, path, claimed in sorted(files)]
+
+    def _replay_spools(self):
+        if not self.spool_dir or not os.path.isdir(self.spool_dir):
+            return
+        for path, claimed in self._spool_files():
+            if path != claimed:
+                # Claim the file with an atomic rename so two workers never replay it twice.
+                # Our own spool is renamed under the lock, so new events go to a fresh file.
+                with self._spool_lock:
+                    try:
+                        os.rename(path, claimed)
+                    except OSError:
+                        continue
+            with open(claimed, encoding='utf-8') as f:
+                rows = [tuple(json.loads(line)) for line in f if line.strip()]
+            try:
+                for i in range(0, len(rows), self.batch_size):
+                    self._write(rows[i:i + self.batch_size])
+            except Exception as e:
+                # Give the rows back; those already written may be replayed again next time
+                print(f"[AUDIT] spool replay failed: {e}")
+                self._spool(rows[i:])
+                os.remove(claimed)
+                return
+            os.remove(claimed)
+            self.stats["replayed"] += len(rows)
+
+    def close(self, timeout=5.0):
+        """Stop the thread and write out everything still queued (spooling on failure)."""
+        self._stop.set()
+        self._thread.join(timeout)
+        pending = []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(pending), self.batch_size):
+            self._flush(pending[i:i + self.batch_size])
+
+    def snapshot(self):
+        data = dict(self.stats)
+        data.update({"queued": self._queue.qsize(), "pid": self.pid})
+        return data
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    # One writer thread per worker process; threads don't survive a fork
+    global _writer
+    if _writer is None or _writer.pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer.pid != os.getpid():
+                _writer = AuditWriter(AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_QUEUE_SIZE,
+                                      AUDIT_QUEUE_FULL, AUDIT_BLOCK_TIMEOUT, AUDIT_SPOOL_DIR)
+    return _writer
+
+
+def shutdown():
+    """Flush pending audit events; registered with atexit and gunicorn's worker_exit."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None and writer.pid == os.getpid():
+        writer.close()
+
+
+atexit.register(shutdown)
+
+
+def audit_stats():
+    return get_writer().snapshot() if AUDIT_ASYNC else {"async": False}
+
+
+def audit_log(user_id, action_type, table_name, old_value="", new_value="", record_id=None):
+    ip_address = request.remote_addr if has_request_context() else None
+    row = (user_id, table_name, action_type, record_id, old_value, new_value, ip_address, datetime.now())
+    if AUDIT_ASYNC:
+        get_writer().submit(row)
+        return
+    db, cur = get_db(primary=True)
+    cur.execute(INSERT_SQL, row)
+    db.commit()
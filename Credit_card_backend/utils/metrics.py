@@ -0,0 +1,194 @@
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_app_context
+from flask.json.provider import DefaultJSONProvider
+from config import METRICS_DIR, METRICS_DUMP_INTERVAL, SERVER_TIMING_HEADER
+
+# Request phases reported in Server-Timing and aggregated per endpoint
+PHASES = ("db_connect", "db_query", "crypto", "serialize")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """In-process Prometheus-style counters and fixed-bucket histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), v] for (name, labels), v in self.counters.items()],
+                "histograms": [[name, list(labels), list(h)] for (name, labels), h in self.histograms.items()],
+            }
+
+
+registry = Registry()
+_registry_pid = os.getpid()
+_last_dump = 0.0
+
+
+def _registry():
+    # Counters inherited over fork belong to the parent; start fresh in each worker
+    global registry, _registry_pid
+    if _registry_pid != os.getpid():
+        registry, _registry_pid = Registry(), os.getpid()
+    return registry
+
+
+def add_timing(phase, seconds):
+    """Charge `seconds` to a phase of the current request (no-op outside a request)."""
+    if has_app_context():
+        timings = g.get('timings')
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(phase, time.perf_counter() - start)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that charges every jsonify/dumps to the serialize phase."""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            add_timing("serialize", time.perf_counter() - start)
+
+
+def _endpoint():
+    return request.endpoint or "unmatched"
+
+
+def start_request():
+    g.timings = {}
+    g.request_start = time.perf_counter()
+
+
+def finish_request(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    timings = g.get('timings') or {}
+    endpoint, method = _endpoint(), request.method
+
+    reg = _registry()
+    reg.inc("http_requests_total", {"endpoint": endpoint, "method": method, "status": str(response.status_code)})
+    reg.observe("http_request_duration_seconds", {"endpoint": endpoint, "method": method}, total)
+    for phase, seconds in timings.items():
+        reg.observe("http_request_phase_seconds", {"endpoint": endpoint, "phase": phase}, seconds)
+
+    if SERVER_TIMING_HEADER:
+        parts = [f"{p};dur={timings[p] * 1000:.2f}" for p in PHASES if p in timings]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        response.headers['Server-Timing'] = ", ".join(parts)
+
+    if METRICS_DIR and time.time() - _last_dump > METRICS_DUMP_INTERVAL:
+        dump()
+    return response
+
+
+def dump():
+    """Write this worker's counters to METRICS_DIR so /metrics can sum across gunicorn workers."""
+    global _last_dump
+    _last_dump = time.time()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"metrics-{os.getpid()}.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_registry().snapshot(), f)
+    os.replace(tmp, path)
+
+
+def _merged_snapshot():
+    if not METRICS_DIR:
+        return _registry().snapshot()
+    dump()
+    counters, histograms = {}, {}
+    for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, v in snap["counters"]:
+            key = (name, tuple(tuple(l) for l in labels))
+            counters[key] = counters.get(key, 0) + v
+        for name, labels, h in snap["histograms"]:
+            key = (name, tuple(tuple(l) for l in labels))
+            prev = histograms.get(key)
+            histograms[key] = h if prev is None else [a + b for a, b in zip(prev, h)]
+    return {"counters": [[n, list(l), v] for (n, l), v in counters.items()],
+            "histograms": [[n, list(l), h] for (n, l), h in histograms.items()]}
+
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                          for k, v in items) + "}"
+
+
+def render(gauges=None):
+    """Prometheus text exposition of all request metrics plus `gauges` {name: {labels: value}}."""
+    snap = _merged_snapshot()
+    lines = []
+    typed = set()
+    for name, labels, value in sorted(snap["counters"]):
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_fmt_labels(labels)} {value}")
+    for name, labels, h in sorted(snap["histograms"]):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        for bound, count in zip(BUCKETS, h):
+            lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {h[-1]}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {h[-2]}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {h[-1]}")
+    for name, series in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in series.items():
+            lines.append(f"{name}{_fmt_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    app.json = TimedJSONProvider(app)
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,93 @@
+"""Outbox of vault writes, read incrementally through /changes (changes.py).
+
+Write paths call `record` (or `record_many`) on their own cursor before
+they commit, so an event exists exactly when its write does. Events carry
+ids and the owning merchant/customer only; /changes attaches each
+entity's current state when it is read, masked unless fields are asked for.
+
+event_id comes from AUTO_INCREMENT, which hands out ids before commit:
+a slow transaction can commit id 41 after id 42 is already visible. A
+consumer that had moved past 42 would never see 41. `safe_horizon`
+therefore stops at the first gap in the sequence until the gap is
+CHANGES_GAP_WAIT seconds old. After that it treats the missing ids as
+rolled back. With merchant shards (utils/shards.py) each shard has its own
+outbox, and ids step by the server's auto_increment_increment.
+"""
+from datetime import datetime, timedelta
+from config import CHANGES_GAP_WAIT, CHANGES_SCAN_MAX, DB_ENGINE, DB_SHARDS
+
+CARD_STORED = "card.stored"
+CARD_DEACTIVATED = "card.deactivated"
+CUSTOMER_ADDED = "customer.added"
+MERCHANT_CREATED = "merchant.created"
+ENTITY_TYPES = {CARD_STORED: "card", CARD_DEACTIVATED: "card", CUSTOMER_ADDED: "customer",
+                MERCHANT_CREATED: "merchant"}
+
+INSERT_SQL = """
+    INSERT INTO change_events (event_type, entity_type, entity_id, merchant_id, customer_id, created_at)
+    VALUES (%s, %s, %s, %s, %s, %s)"""
+
+
+def _row(event_type, entity_id, merchant_id, customer_id, now):
+    return (event_type, ENTITY_TYPES[event_type], entity_id, merchant_id, customer_id, now)
+
+
+def record(cur, event_type, entity_id, merchant_id=None, customer_id=None):
+    """Add one event in the caller's transaction."""
+    cur.execute(INSERT_SQL, _row(event_type, entity_id, merchant_id, customer_id, datetime.now()))
+
+
+def record_many(cur, event_type, events):
+    """Add (entity_id, merchant_id, customer_id) events of one type with a single multi-row INSERT."""
+    now = datetime.now()
+    cur.executemany(INSERT_SQL, [_row(event_type, e, m, c, now) for e, m, c in events])
+
+
+def _id_step(cur):
+    # Shard servers space their AUTO_INCREMENT ids apart so customer and card ids stay unique
+    if not DB_SHARDS or DB_ENGINE == 'sqlite':
+        return 1
+    cur.execute("SELECT @@auto_increment_increment")
+    return int(cur.fetchone()[0])
+
+
+def safe_horizon(cur, since):
+    """Highest event_id a consumer at `since` can move to without skipping an in-flight event.
+
+    Scans at most CHANGES_SCAN_MAX events past `since`.
+    """
+    step = _id_step(cur)
+    cur.execute("SELECT event_id, created_at FROM change_events WHERE event_id > %s ORDER BY event_id LIMIT %s",
+                (since, CHANGES_SCAN_MAX))
+    horizon = since
+    settled = datetime.now() - timedelta(seconds=CHANGES_GAP_WAIT)
+    for event_id, created_at in cur.fetchall():
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        if event_id > horizon + step and created_at > settled:
+            break
+        horizon = event_id
+    return horizon
+
+
+def fetch(cur, since, limit, merchant_id=None, customer_id=None):
+    """Events after `since` up to the safe horizon, optionally scoped to one merchant or customer.
+
+    Returns (events, next_since). next_since moves to the horizon when the
+    page is not full, so scoped consumers skip past other tenants' events.
+    """
+    horizon = safe_horizon(cur, since)
+    sql = ("SELECT event_id, event_type, entity_type, entity_id, merchant_id, customer_id, created_at "
+           "FROM change_events WHERE event_id > %s AND event_id <= %s")
+    params = (since, horizon)
+    if merchant_id is not None:
+        sql += " AND merchant_id = %s"
+        params += (merchant_id,)
+    if customer_id is not None:
+        sql += " AND customer_id = %s"
+        params += (customer_id,)
+    cur.execute(sql + " ORDER BY event_id LIMIT %s", params + (limit,))
+    columns = [desc[0] for desc in cur.description]
+    events = [dict(zip(columns, r)) for r in cur.fetchall()]
+    next_since = events[-1]['event_id'] if len(events) == limit else horizon
+    return events, next_since
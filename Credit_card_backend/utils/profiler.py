@@ -0,0 +1,228 @@
+"""Opt-in request profiler for live workers.
+
+Only when PROFILE_ENABLED is set are hooks registered on the app, so a
+disabled profiler costs nothing per request. Once enabled, a request is
+profiled if either:
+
+  * profiling is armed for its endpoint via POST /admin/profile, which
+    allows the next N matching requests in any worker, or
+  * a random draw falls under PROFILE_SAMPLE_RATE.
+
+Two modes are supported. 'cprofile' writes .pstats files for
+`python -m pstats` or snakeviz. 'stack' samples the request thread every
+PROFILE_SAMPLE_INTERVAL_MS and writes collapsed stacks (.folded) for
+flamegraph.pl or speedscope. Captures go to PROFILE_DIR, which keeps
+the newest PROFILE_KEEP files.
+
+On Python 3.12+ only one cProfile capture can run in a process at a
+time; a request that would overlap another gets a 'stack' capture.
+"""
+import cProfile
+import fcntl
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request
+from config import (PROFILE_ENABLED, PROFILE_DIR, PROFILE_KEEP, PROFILE_SAMPLE_RATE, PROFILE_MODE,
+                    PROFILE_SAMPLE_INTERVAL_MS)
+
+MODES = ("cprofile", "stack")
+EXTENSIONS = (".pstats", ".folded")
+ARM_FILE = os.path.join(PROFILE_DIR, "armed.json")
+LOCK_FILE = os.path.join(PROFILE_DIR, ".lock")
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer and counts collapsed stacks."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class _Locked:
+    # Serialises arm-file updates across gunicorn workers
+    def __enter__(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        self._f = open(LOCK_FILE, "a")
+        fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._f, fcntl.LOCK_UN)
+        self._f.close()
+
+
+def _read_arm():
+    try:
+        with open(ARM_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_arm(state):
+    tmp = ARM_FILE + f".{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, ARM_FILE)
+
+
+def arm(endpoint, count, mode=PROFILE_MODE, ttl=600):
+    """Profile the next `count` requests to `endpoint` (any worker), for at most `ttl` seconds."""
+    state = {"endpoint": endpoint, "remaining": count, "mode": mode, "expires": time.time() + ttl}
+    with _Locked():
+        _write_arm(state)
+    return state
+
+
+def disarm():
+    with _Locked():
+        try:
+            os.remove(ARM_FILE)
+        except FileNotFoundError:
+            pass
+
+
+def armed():
+    state = _read_arm()
+    if state and state["expires"] < time.time():
+        return None
+    return state
+
+
+def _claim(endpoint):
+    """Take one armed slot for `endpoint`; returns the mode to profile with, or None."""
+    # Cheap unlocked check first: most requests don't match
+    try:
+        os.stat(ARM_FILE)
+    except FileNotFoundError:
+        return None
+    state = _read_arm()
+    if not state or state["endpoint"] != endpoint:
+        return None
+    with _Locked():
+        state = _read_arm()
+        if not state or state["endpoint"] != endpoint:
+            return None
+        if state["remaining"] <= 0 or state["expires"] < time.time():
+            os.remove(ARM_FILE)
+            return None
+        state["remaining"] -= 1
+        if state["remaining"] == 0:
+            os.remove(ARM_FILE)
+        else:
+            _write_arm(state)
+        return state["mode"]
+
+
+def start_request():
+    endpoint = request.endpoint
+    if endpoint is None or endpoint.startswith("admin."):
+        return
+    mode = _claim(endpoint)
+    if mode is None and PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        mode = PROFILE_MODE
+    if mode is None:
+        return
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ runs one cProfile per process at a time ("Another profiling tool is
+            # already active"); sample this request's stack instead of failing it
+            mode = "stack"
+    if mode == "stack":
+        profiler = StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        profiler.start()
+    g.profile = (mode, profiler, time.perf_counter())
+
+
+def finish_request(response):
+    capture = g.pop('profile', None)
+    if capture is None:
+        return response
+    mode, profiler, start = capture
+    if mode == "cprofile":
+        profiler.disable()
+    else:
+        profiler.stop()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    endpoint = re.sub(r"[^\w.-]", "_", request.endpoint)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{endpoint}-{elapsed_ms:.0f}ms"
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if mode == "cprofile":
+            profiler.dump_stats(os.path.join(PROFILE_DIR, name + ".pstats"))
+        else:
+            profiler.write(os.path.join(PROFILE_DIR, name + ".folded"))
+        _rotate()
+    except OSError as e:
+        print(f"[PROFILE] could not write capture {name}: {e}")
+    return response
+
+
+def _rotate():
+    files = list_captures()
+    for c in files[PROFILE_KEEP:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, c["name"]))
+        except FileNotFoundError:
+            pass
+
+
+def list_captures():
+    """Captures in PROFILE_DIR, newest first."""
+    try:
+        names = [n for n in os.listdir(PROFILE_DIR) if n.endswith(EXTENSIONS)]
+    except FileNotFoundError:
+        return []
+    files = []
+    for n in names:
+        try:
+            st = os.stat(os.path.join(PROFILE_DIR, n))
+        except FileNotFoundError:
+            continue
+        files.append({"name": n, "size": st.st_size, "created": st.st_mtime})
+    files.sort(key=lambda c: c["created"], reverse=True)
+    return files
+
+
+def init_app(app):
+    if not PROFILE_ENABLED:
+        return
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,34 @@
+from flask import g, request
+
+VIEWS = ('masked', 'full')
+
+
+def requested_secrets(secrets):
+    """Parse ?view= and ?fields= into the encrypted fields a list endpoint should decrypt.
+
+    `secrets` maps each encrypted output field to its SQL column. The
+    default view=masked decrypts nothing: rows carry only plaintext columns
+    (ids, last_four_digits, status). view=full returns every encrypted field.
+    fields=a,b returns just those, whatever the view.
+    The result is kept in g.secret_fields so response caches can tell
+    masked bodies from decrypted ones.
+    Raises ValueError with a client-facing message on bad input.
+    """
+    view = request.args.get('view', 'masked')
+    if view not in VIEWS:
+        raise ValueError(f"view must be one of: {', '.join(VIEWS)}")
+    fields = request.args.get('fields')
+    if fields:
+        wanted = {f.strip() for f in fields.split(',') if f.strip()}
+        unknown = sorted(wanted - set(secrets))
+        if unknown:
+            raise ValueError(f"unknown field(s) {', '.join(unknown)}; available: {', '.join(secrets)}")
+        g.secret_fields = tuple(f for f in secrets if f in wanted)
+    else:
+        g.secret_fields = tuple(secrets) if view == 'full' else ()
+    return g.secret_fields
+
+
+def secret_columns(secrets, fields):
+    """Extra SELECT-list entries (with a leading comma) for the requested encrypted fields."""
+    return "".join(f", {secrets[f]} AS {f}" for f in fields)
@@ -0,0 +1,143 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from flask import g, request, has_app_context, has_request_context
+from config import SLOW_QUERY_MS, N_PLUS_ONE_THRESHOLD, QUERY_STATS_MAX
+
+_COMMENTS = re.compile(r"/\*.*?\*/|--[^\n]*", re.S)
+_STRINGS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBERS = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PARAMS = re.compile(r"%\(\w+\)s|%s|\?")
+_IN_LISTS = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+_VALUES_LISTS = re.compile(r"\)\s*(?:,\s*\((?:\s*\?\s*,?)+\))+")
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """Normalise a statement so calls that differ only in literals/placeholders group together.
+
+    "SELECT * FROM t WHERE id IN (%s,%s) AND x = 'a'" -> "SELECT * FROM t WHERE id IN (?+) AND x = ?"
+    """
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _COMMENTS.sub(" ", sql)
+    sql = _STRINGS.sub("?", sql)
+    sql = _PARAMS.sub("?", sql)
+    sql = _NUMBERS.sub("?", sql)
+    sql = _IN_LISTS.sub("IN (?+)", sql)
+    sql = _VALUES_LISTS.sub(")", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+def _route():
+    if has_request_context():
+        return request.endpoint or request.path
+    return "-"
+
+
+class QueryStats:
+    """Per-fingerprint call counts and timings for this worker process."""
+
+    def __init__(self, max_size=QUERY_STATS_MAX):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # fingerprint -> stats dict
+        self.dropped = 0
+
+    def record(self, fp, seconds, rows, route):
+        with self._lock:
+            e = self._entries.get(fp)
+            if e is None:
+                e = self._entries[fp] = {"count": 0, "total_s": 0.0, "max_s": 0.0, "rows": 0,
+                                         "slow": 0, "n_plus_one": 0, "routes": {}}
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.dropped += 1
+            else:
+                self._entries.move_to_end(fp)
+            e["count"] += 1
+            e["total_s"] += seconds
+            e["max_s"] = max(e["max_s"], seconds)
+            e["rows"] += max(rows or 0, 0)
+            if seconds * 1000 >= SLOW_QUERY_MS:
+                e["slow"] += 1
+            e["routes"][route] = e["routes"].get(route, 0) + 1
+
+    def flag_n_plus_one(self, fp):
+        with self._lock:
+            e = self._entries.get(fp)
+            if e is not None:
+                e["n_plus_one"] += 1
+
+    def top(self, sort="total_s", limit=50):
+        with self._lock:
+            items = [dict(e, fingerprint=fp, routes=dict(e["routes"])) for fp, e in self._entries.items()]
+        for e in items:
+            e["mean_s"] = e["total_s"] / e["count"] if e["count"] else 0.0
+        items.sort(key=lambda e: e.get(sort, 0), reverse=True)
+        return items[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self.dropped = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {"fingerprints": len(self._entries), "max_size": self.max_size, "dropped": self.dropped,
+                    "queries": sum(e["count"] for e in self._entries.values())}
+
+
+stats = QueryStats()
+_stats_pid = os.getpid()
+
+
+def get_stats():
+    # A forked worker starts with empty stats rather than a copy of the master's
+    global stats, _stats_pid
+    if _stats_pid != os.getpid():
+        stats, _stats_pid = QueryStats(), os.getpid()
+    return stats
+
+
+def record(sql, seconds, rows=None):
+    """Account one executed statement: global stats, slow log and the current request's counts."""
+    fp = fingerprint(sql)
+    route = _route()
+    get_stats().record(fp, seconds, rows, route)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        print(f"[SLOW QUERY] {seconds * 1000:.1f}ms route={route} {fp}")
+    if has_app_context():
+        counts = g.get('query_counts')
+        if counts is not None:
+            counts[fp] = counts.get(fp, 0) + 1
+
+
+def start_request():
+    g.query_counts = {}
+
+
+def finish_request(response):
+    """Flag statements repeated more than N_PLUS_ONE_THRESHOLD times and report the request's query count."""
+    counts = g.pop('query_counts', None)
+    if counts is None:
+        return response
+    route = _route()
+    for fp, n in counts.items():
+        if n > N_PLUS_ONE_THRESHOLD:
+            get_stats().flag_n_plus_one(fp)
+            print(f"[N+1] route={route} ran {n}x: {fp}")
+    response.headers['X-Query-Count'] = str(sum(counts.values()))
+    return response
+
+
+def query_stats():
+    return get_stats().snapshot()
+
+
+def init_app(app):
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,120 @@
+"""Read-replica lag tracking behind db.get_db().
+
+Views marked @read_only (utils/decorators.py) read from the replica in
+DB_READ_CONFIG; everything else, and anything that must write, uses the
+primary. Each worker measures replica lag with SHOW REPLICA STATUS at
+most every DB_READ_LAG_CHECK_INTERVAL seconds. A measurement gives a
+wall-clock point the replica has applied every earlier commit through
+(`applied_through`). That point decides every routing question:
+
+- A replica that is further behind than DB_READ_MAX_LAG, has replication
+  stopped, or cannot be reached is not read until a later check succeeds.
+- A session that wrote after that point reads from the primary, so it
+  always sees its own writes (db.py records the time of each write).
+- utils/list_cache.py does not cache or validate a body read from the
+  replica while a write to its tables may still be missing there.
+
+The read user needs REPLICATION CLIENT for the lag check. Run the replica
+with super_read_only so a write routed there by mistake fails loudly.
+
+Trying it with two local MySQL 8 instances:
+
+    docker network create vault
+    docker run -d --name vault-primary --network vault -p 3306:3306 -e MYSQL_ROOT_PASSWORD=pw \\
+        -e MYSQL_DATABASE=credit_card_vault mysql:8 --server-id=1 --gtid-mode=ON --enforce-gtid-consistency=ON
+    docker run -d --name vault-replica --network vault -p 3307:3306 -e MYSQL_ROOT_PASSWORD=pw \\
+        mysql:8 --server-id=2 --gtid-mode=ON --enforce-gtid-consistency=ON
+    docker exec vault-replica mysql -uroot -ppw -e "CHANGE REPLICATION SOURCE TO SOURCE_HOST='vault-primary',
+        SOURCE_USER='root', SOURCE_PASSWORD='pw', SOURCE_AUTO_POSITION=1, GET_SOURCE_PUBLIC_KEY=1;
+        START REPLICA; SET GLOBAL super_read_only = ON"
+    DB_HOST=127.0.0.1 DB_PORT=3306 DB_PASS=pw DB_READ_HOST=127.0.0.1 DB_READ_PORT=3307 python app.py
+
+`STOP REPLICA SQL_THREAD` on vault-replica sends reads back to the
+primary within one check interval; `START REPLICA SQL_THREAD` restores them.
+"""
+import threading
+import time
+from mysql.connector import Error as MySQLError
+
+
+class ReplicaMonitor:
+    """A replica's connection pool plus this worker's latest lag measurement."""
+
+    def __init__(self, pool, max_lag, interval):
+        self.pool = pool
+        self.max_lag = max_lag
+        self.interval = interval
+        self._check_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._checked_at = 0.0
+        self._applied_through = None
+        self.stats = {"checks": 0, "check_errors": 0, "lag_seconds": -1, "usable": False,
+                      "reads": 0, "lagging": 0, "pinned": 0}
+
+    def applied_through(self):
+        """Time before which every primary commit is visible on the replica, or None while it must not be read.
+
+        Re-measures when the last check is older than the interval. Only one
+        thread measures; the others keep using the previous value meanwhile.
+        """
+        now = time.time()
+        if now - self._checked_at >= self.interval and self._check_lock.acquire(blocking=False):
+            try:
+                self._check(now)
+            finally:
+                self._check_lock.release()
+        return self._applied_through
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _check(self, now):
+        self._checked_at = now
+        try:
+            lag = self._measure()
+            failed = False
+        except Exception as e:
+            print(f"[DB] replica lag check failed, reading from the primary: {e}")
+            lag, failed = None, True
+        usable = lag is not None and lag <= self.max_lag
+        with self._stats_lock:
+            self.stats["checks"] += 1
+            self.stats["check_errors"] += failed
+            self.stats["lag_seconds"] = -1 if lag is None else lag
+            self.stats["usable"] = usable
+        # The lag is reported in whole seconds, so allow one more
+        self._applied_through = now - lag - 1 if usable else None
+
+    def _measure(self):
+        """Seconds behind the source, None when replication is stopped, 0 when the server is not a replica."""
+        conn = self.pool.acquire()
+        discard = False
+        try:
+            cur = conn.cursor(buffered=True)
+            try:
+                cur.execute("SHOW REPLICA STATUS")
+            except MySQLError:
+                # Before MySQL 8.0.22
+                cur.execute("SHOW SLAVE STATUS")
+            row = cur.fetchone()
+            columns = [desc[0] for desc in cur.description or ()]
+            cur.close()
+        except Exception:
+            discard = True
+            raise
+        finally:
+            self.pool.release(conn, discard=discard)
+        if row is None:
+            # e.g. a second DSN on the primary itself: nothing to wait for
+            return 0
+        status = dict(zip(columns, row))
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        return None if lag is None else int(lag)
+
+    def snapshot(self):
+        with self._stats_lock:
+            data = dict(self.stats)
+        data["usable"] = int(data["usable"])
+        data.update({"pool_" + k: v for k, v in self.pool.snapshot().items() if k != "pid"})
+        return data
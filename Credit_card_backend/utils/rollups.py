@@ -0,0 +1,134 @@
+"""Transaction totals per merchant and per card, by hour and by day, kept up to date as charges happen.
+
+`apply` is called by the charge handlers on their own cursor before they
+commit, so a rollup row changes exactly when its transactions do. It
+folds a batch into one delta per (scope, id, period, bucket, currency,
+status) and upserts the deltas with a single executemany. Deltas are
+written in key order so concurrent charges for the same merchant queue
+on the hot bucket row instead of deadlocking.
+
+/reports/transactions (reports.py) reads only this table: a report costs
+one range scan over at most REPORT_MAX_BUCKETS buckets, however many
+transactions are behind them.
+
+Rows written around the charge handlers (bulk loads, manual fixes, or
+history from before migration 9) are folded in by `rebuild_day`,
+one day at a time; see rebuild_rollups.py.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from utils import shards
+
+SCOPES = ('merchant', 'card')
+# ?interval= name -> stored period code and bucket width
+PERIODS = {'hour': ('h', timedelta(hours=1)), 'day': ('d', timedelta(days=1))}
+CENT = Decimal('0.01')
+
+UPSERT_SQL = """
+    INSERT INTO txn_rollups (scope, scope_id, period, bucket, currency, status, txn_count, amount_total)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE txn_count = txn_count + VALUES(txn_count),
+                            amount_total = amount_total + VALUES(amount_total)"""
+
+# Transactions with the merchant that owns the card, in the shape `apply` takes
+SOURCE_SQL = """
+    SELECT c.merchant_id, t.card_id, t.created_at, t.currency, t.status, t.amount
+    FROM transactions t
+    JOIN card_vault cv ON cv.card_id = t.card_id
+    LEFT JOIN customers c ON c.customer_id = cv.customer_id
+    WHERE t.created_at >= %s AND t.created_at < %s"""
+# With merchant shards the cards are elsewhere; their merchants are found with shards.locate
+SHARDED_SOURCE_SQL = """
+    SELECT card_id, created_at, currency, status, amount FROM transactions
+    WHERE created_at >= %s AND created_at < %s"""
+
+
+def floor(ts, interval):
+    """Start of the `interval` bucket containing `ts`."""
+    ts = ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0) if interval == 'day' else ts
+
+
+def ceil(ts, interval):
+    """End of the `interval` bucket containing `ts`, or `ts` itself on a boundary."""
+    start = floor(ts, interval)
+    return start if start == ts else start + PERIODS[interval][1]
+
+
+def apply(cur, charges):
+    """Add charges to the rollups in the caller's transaction.
+
+    `charges` yields (merchant_id, card_id, created_at, currency, status, amount).
+    created_at must be the value stored on the transaction row, at whole seconds.
+    Returns the number of rollup rows touched.
+    """
+    deltas = defaultdict(lambda: [0, Decimal(0)])
+    for merchant_id, card_id, created_at, currency, status, amount in charges:
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        # Round as DECIMAL(12, 2) does, so the totals equal SUM(amount)
+        amount = Decimal(str(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+        for interval, (period, _) in PERIODS.items():
+            bucket = floor(created_at, interval)
+            for scope, scope_id in (('merchant', merchant_id), ('card', card_id)):
+                if scope_id is None:
+                    continue
+                delta = deltas[(scope, scope_id, period, bucket, currency, status)]
+                delta[0] += 1
+                delta[1] += amount
+    if deltas:
+        cur.executemany(UPSERT_SQL, [key + tuple(delta) for key, delta in sorted(deltas.items())])
+    return len(deltas)
+
+
+def series(cur, scope, scope_id, interval, since, until, currency=None, status=None):
+    """Rollup rows for one merchant or card with since <= bucket < until, oldest first."""
+    clauses = ["scope = %s", "scope_id = %s", "period = %s", "bucket >= %s", "bucket < %s"]
+    params = [scope, scope_id, PERIODS[interval][0], since, until]
+    if currency:
+        clauses.append("currency = %s")
+        params.append(currency)
+    if status:
+        clauses.append("status = %s")
+        params.append(status)
+    cur.execute("SELECT bucket, currency, status, txn_count, amount_total FROM txn_rollups "
+                f"WHERE {' AND '.join(clauses)} ORDER BY bucket, currency, status", tuple(params))
+    rows = []
+    for bucket, currency, status, count, amount in cur.fetchall():
+        if isinstance(bucket, str):
+            bucket = datetime.fromisoformat(bucket)
+        rows.append({'bucket': bucket, 'currency': currency, 'status': status,
+                     'count': int(count), 'amount': Decimal(amount).quantize(CENT)})
+    return rows
+
+
+def rebuild_day(conn, day):
+    """Recompute every rollup bucket of one calendar day from the transactions table and commit.
+
+    Charges made on that day while this runs are lost from the rollups or
+    counted twice, so only rebuild days that are no longer taking charges.
+    A day's transactions are held in memory while they are folded.
+    Returns (transactions read, rollup rows written).
+    """
+    day = floor(day, 'day')
+    next_day = day + timedelta(days=1)
+    cur = conn.cursor(buffered=True)
+    try:
+        cur.execute("DELETE FROM txn_rollups WHERE bucket >= %s AND bucket < %s", (day, next_day))
+        if shards.enabled():
+            cur.execute(SHARDED_SOURCE_SQL, (day, next_day))
+            txns = cur.fetchall()
+            owners = shards.locate(shards.CARD_SQL, {t[0] for t in txns})
+            charges = [(owners[t[0]][0],) + tuple(t) for t in txns if t[0] in owners]
+        else:
+            cur.execute(SOURCE_SQL, (day, next_day))
+            charges = cur.fetchall()
+        written = apply(cur, charges)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return len(charges), written
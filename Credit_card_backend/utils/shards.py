@@ -0,0 +1,245 @@
+"""Merchant shards: which database holds a merchant's customers and cards.
+
+The primary is shard "main". DB_SHARDS names the others. `merchant_shards`
+on main maps a merchant to its shard; merchants without a row live on
+main, so an empty DB_SHARDS is the single-database layout. Each worker
+caches map entries for SHARD_MAP_TTL seconds.
+
+What lives where:
+
+- On the merchant's shard: its customers and card_vault rows, the
+  change_events written with them (so an event still commits exactly when
+  its write does), and a copy of its merchants row for the joins.
+- On main only: users, the master merchants list, data_keys, transactions
+  and their rollups, idempotency keys, the audit log and merchant_shards.
+
+Data keys stay on main, so code that decrypts rows read from a shard
+looks the keys up through `key_cursor()`.
+
+A merchant-scoped request uses `db.get_db(merchant_id)`. Views that cover
+many merchants run their query on every shard in parallel with `fan_out`
+and merge the pages with `merge_page` or `merge_streams`. Rows are also
+filtered by ownership: while shard_admin.py moves a merchant, its rows
+exist on both shards for a moment, and only the copy on the shard the map
+names is returned. Writes for a merchant in the 'moving' state fail with
+ShardMoving (503 with Retry-After) until the move has flipped the map.
+
+Ids must stay unique across shards (card and customer ids are global:
+sessions, transactions and /card/<id> use them). On MySQL give every shard
+the same auto_increment_increment and its own auto_increment_offset;
+`python shard_admin.py check` verifies that.
+"""
+import heapq
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import DB_SHARDS, SHARD_MAP_TTL, SHARD_MAP_CACHE_SIZE, SHARD_FAN_OUT_WORKERS
+from utils.cache import LRUCache
+from utils.metrics import timed
+
+MAIN = 'main'
+ACTIVE = 'active'
+MOVING = 'moving'
+
+# The shard-local owner of a customer / card, for `locate`; a card of a user without a customers row has none
+CUSTOMER_SQL = "SELECT customer_id, merchant_id FROM customers WHERE customer_id IN ({ids})"
+CARD_SQL = ("SELECT cv.card_id, c.merchant_id FROM card_vault cv LEFT JOIN customers c ON c.customer_id = cv.customer_id "
+            "WHERE cv.card_id IN ({ids})")
+
+_map = LRUCache(SHARD_MAP_CACHE_SIZE, SHARD_MAP_TTL)
+
+
+class ShardMoving(Exception):
+    """A write hit a merchant whose data is being copied to another shard."""
+
+    def __init__(self, merchant_id):
+        super().__init__(f"merchant {merchant_id} is being moved between shards, retry shortly")
+        self.merchant_id = merchant_id
+
+
+def enabled():
+    return bool(DB_SHARDS)
+
+
+def names():
+    return (MAIN,) + tuple(DB_SHARDS)
+
+
+def shard_map_stats():
+    return _map.snapshot()
+
+
+def shards_of(merchant_ids):
+    """{merchant_id: (shard, state)} for every id, from the cache or one query on main's primary."""
+    if not DB_SHARDS:
+        return {int(m): (MAIN, ACTIVE) for m in merchant_ids}
+    found, missing = {}, []
+    for m in {int(m) for m in merchant_ids}:
+        entry = _map.get(m)
+        if entry is None:
+            missing.append(m)
+        else:
+            found[m] = entry
+    if missing:
+        # Imported here: db.get_db routes through this module
+        from db import get_pool
+        pool = get_pool()
+        conn = pool.acquire()
+        try:
+            cur = conn.cursor(buffered=True)
+            cur.execute(f"SELECT merchant_id, shard, state FROM merchant_shards "
+                        f"WHERE merchant_id IN ({','.join(['%s'] * len(missing))})", tuple(missing))
+            rows = {m: (shard, state) for m, shard, state in cur.fetchall()}
+            cur.close()
+        finally:
+            pool.release(conn)
+        for m in missing:
+            entry = rows.get(m, (MAIN, ACTIVE))
+            if entry[0] not in names():
+                raise LookupError(f"merchant {m} is mapped to shard {entry[0]!r}, which is not in DB_SHARDS")
+            _map.put(m, entry)
+            found[m] = entry
+    return found
+
+
+def shard_of(merchant_id, for_write=False):
+    """Name of the shard holding `merchant_id`'s data. Raises ShardMoving for a write during a move."""
+    shard, state = shards_of((merchant_id,))[int(merchant_id)]
+    if for_write and state == MOVING:
+        # Re-read next time rather than waiting out the TTL for the move to finish
+        _map.evict(int(merchant_id))
+        raise ShardMoving(merchant_id)
+    return shard
+
+
+def evict(merchant_id=None):
+    """Forget cached map entries (one merchant, or all)."""
+    if merchant_id is None:
+        _map.clear()
+    else:
+        _map.evict(int(merchant_id))
+
+
+def key_cursor():
+    """Cursor for data key lookups (keystore) on main.
+
+    With shards the primary's: data a shard has committed may need a key
+    that a lagging replica of main does not have yet.
+    """
+    from db import get_db
+    return get_db(primary=bool(DB_SHARDS))[1]
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Threads don't survive fork, so each worker process gets its own executor
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=SHARD_FAN_OUT_WORKERS, thread_name_prefix="shard")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _run_on(shard, fn):
+    from db import shard_connection
+    with shard_connection(shard) as (conn, cur):
+        return fn(shard, cur)
+
+
+def fan_out(fn, targets=None):
+    """Run `fn(shard, cursor)` on every shard (or `targets`) in parallel; returns {shard: result}.
+
+    Each shard gets a connection of its own. With one shard and a request
+    in progress, `fn` runs inline on the request's connection instead.
+    """
+    from flask import has_request_context
+    from db import shard_db
+    targets = list(targets or names())
+    if len(targets) == 1 and has_request_context():
+        shard = targets[0]
+        return {shard: fn(shard, shard_db(shard)[1])}
+    with timed("db_query"):
+        futures = {shard: _get_executor().submit(_run_on, shard, fn) for shard in targets}
+        return {shard: future.result() for shard, future in futures.items()}
+
+
+def _owned(shard, rows, merchant_of):
+    owners = shards_of({merchant_of(r) for r in rows if merchant_of(r) is not None})
+    for r in rows:
+        m = merchant_of(r)
+        # Rows without a merchant (cards of a customer no merchant owns) stay where they are
+        if m is None or owners[int(m)][0] == shard:
+            yield r
+
+
+def merge_page(pages, key, limit=None, merchant_of=None):
+    """Merge per-shard pages, each sorted by `key` and at most `limit` long, into one page.
+
+    Past the last key of any full page a shard may have more rows, so the
+    merged page stops there. Rows of merchants that the map places on
+    another shard are dropped (`merchant_of(row)` gives a row's merchant).
+    Returns (rows, last_key): last_key is where the next page starts, or
+    None when every shard is exhausted.
+    """
+    bound = None
+    streams = []
+    for shard, rows in pages.items():
+        if limit and len(rows) == limit:
+            last = key(rows[-1])
+            bound = last if bound is None else min(bound, last)
+        if merchant_of is not None and DB_SHARDS:
+            rows = list(_owned(shard, rows, merchant_of))
+        streams.append(rows)
+    merged = []
+    for row in heapq.merge(*streams, key=key):
+        if bound is not None and key(row) > bound:
+            break
+        merged.append(row)
+        if limit and len(merged) == limit:
+            return merged, key(row)
+    return merged, bound
+
+
+def merge_streams(streams, key, merchant_of=None):
+    """Merge {shard: iterator of rows sorted by `key`} lazily, with the ownership filter of merge_page."""
+    def owned(shard, rows):
+        for r in rows:
+            m = merchant_of(r) if merchant_of is not None and DB_SHARDS else None
+            if m is None or shards_of((m,))[int(m)][0] == shard:
+                yield r
+    yield from heapq.merge(*(owned(shard, rows) for shard, rows in streams.items()), key=key)
+
+
+def locate(sql, ids):
+    """{id: (merchant_id, shard)} for customer or card ids (CUSTOMER_SQL / CARD_SQL), searching every shard.
+
+    Ids that exist nowhere are left out. A row copied by an unfinished
+    move only counts on the shard the map names.
+    """
+    ids = sorted({int(i) for i in ids})
+    if not ids:
+        return {}
+    query = sql.format(ids=','.join(['%s'] * len(ids)))
+
+    def run(shard, cur):
+        cur.execute(query, tuple(ids))
+        return cur.fetchall()
+
+    found = {}
+    for shard, rows in fan_out(run).items():
+        for entity_id, merchant_id in _owned(shard, rows, lambda r: r[1]):
+            found[entity_id] = (merchant_id, shard)
+    return found
+
+
+def customer_shard(customer_id):
+    """Shard holding a customer's cards; main for customers without a customers row (no merchant)."""
+    if not DB_SHARDS:
+        return MAIN
+    return locate(CUSTOMER_SQL, (customer_id,)).get(int(customer_id), (None, MAIN))[1]
@@ -0,0 +1,266 @@
+"""Embedded SQLite engine behind the same connection/cursor API the app uses for MySQL.
+
+Selected with DB_ENGINE=sqlite. db.get_pool() then pools these connections
+instead of mysql.connector ones, so every blueprint runs unchanged: the full
+request path, including app-tier encryption, can be load-tested on one box
+without a database server, separating Python overhead from database latency.
+
+Statements are translated on the fly (see `translate`): %s / %(name)s
+placeholders, NOW(), ON DUPLICATE KEY UPDATE, MySQL-only column types in
+DDL, and a few statements with no SQLite equivalent that become no-ops. The schema comes from
+models/migrations.py and is applied on the first connection.
+
+SQLITE_PATH=:memory: (the default) keeps the database in shared-cache memory
+for the life of the process, which suits single-worker runs. For concurrent
+writers use a file in WAL mode, e.g. SQLITE_PATH=/dev/shm/vault.sqlite3.
+"""
+import fcntl
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from mysql.connector import errors
+from config import SQLITE_PATH
+
+DIALECT = "sqlite"
+MEMORY_URI = "file:vault?mode=memory&cache=shared"
+BUSY_TIMEOUT_MS = 5000
+
+sqlite3.register_adapter(datetime, lambda v: v.isoformat(" "))
+sqlite3.register_adapter(date, lambda v: v.isoformat())
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_converter("DATETIME", lambda v: datetime.fromisoformat(v.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda v: datetime.fromisoformat(v.decode()))
+sqlite3.register_converter("DATE", lambda v: date.fromisoformat(v.decode()))
+sqlite3.register_converter("DECIMAL", lambda v: Decimal(v.decode()))
+
+# Statements that only tune or lock a MySQL server; they succeed without doing anything here
+_NOOPS = re.compile(
+    r"^\s*(SET\s|ALTER\s+TABLE\s+\w+\s+MODIFY\s|SELECT\s+(GET_LOCK|RELEASE_LOCK)\s*\()", re.I)
+_TRUNCATE = re.compile(r"^\s*TRUNCATE\s+TABLE\s+(\w+)", re.I)
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+_DDL_TYPES = (
+    (re.compile(r"\b(?:BIG)?INT(?:EGER)?\s+AUTO_INCREMENT\s+PRIMARY\s+KEY", re.I), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    (re.compile(r"\bENUM\s*\([^)]*\)", re.I), "TEXT"),
+    (re.compile(r"\bVARBINARY\s*\(\d+\)", re.I), "BLOB"),
+    (re.compile(r"\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP", re.I), ""),
+)
+_FOR_UPDATE = re.compile(r"\s+FOR\s+UPDATE\b", re.I)
+_NOW = re.compile(r"\bNOW\(\)", re.I)
+_UPSERT = re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.I)
+_VALUES_REF = re.compile(r"\bVALUES\((\w+)\)", re.I)
+
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """Rewrite one MySQL statement for SQLite; returns None for statements that are no-ops here."""
+    if _NOOPS.match(sql):
+        return None
+    m = _TRUNCATE.match(sql)
+    if m:
+        return f"DELETE FROM {m.group(1)}"
+    if re.match(r"^\s*(CREATE|ALTER)\s", sql, re.I):
+        for pattern, replacement in _DDL_TYPES:
+            sql = pattern.sub(replacement, sql)
+    sql = _FOR_UPDATE.sub("", _NOW.sub("CURRENT_TIMESTAMP", sql))
+    upsert = _UPSERT.search(sql)
+    if upsert:
+        # VALUES(col) in the update list is SQLite's excluded.col
+        sql = sql[:upsert.start()] + "ON CONFLICT DO UPDATE SET" + _VALUES_REF.sub(r"excluded.\1", sql[upsert.end():])
+    return _PLACEHOLDER.sub(lambda p: "%" if p.group(0) == "%%" else (f":{p.group(1)}" if p.group(1) else "?"), sql)
+
+
+def _wrap(e):
+    # Surface the same exception classes as mysql.connector so callers' except clauses keep working
+    if isinstance(e, sqlite3.IntegrityError):
+        cls = errors.IntegrityError
+    elif isinstance(e, sqlite3.OperationalError):
+        cls = errors.OperationalError
+    elif isinstance(e, sqlite3.ProgrammingError):
+        cls = errors.ProgrammingError
+    else:
+        cls = errors.DatabaseError
+    return cls(msg=f"sqlite: {e}")
+
+
+class Cursor:
+    """DB-API cursor with mysql.connector's extras (dictionary rows, column_names, with_rows)."""
+
+    dialect = DIALECT
+
+    def __init__(self, conn, dictionary=False):
+        self._cur = conn.cursor()
+        self._dictionary = dictionary
+        self._noop = False
+
+    def _prepare(self, operation, params):
+        if isinstance(operation, (bytes, bytearray)):
+            operation = operation.decode("utf-8")
+        # Without params mysql.connector sends the text as-is, so a bare % is literal
+        sql = translate(operation) if params is not None else translate(operation.replace("%", "%%"))
+        return sql, () if params is None else params
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        sql, params = self._prepare(operation, params)
+        self._noop = sql is None
+        try:
+            if self._noop:
+                # Keep fetchone() working for callers that expect a result, e.g. GET_LOCK's 1
+                self._cur.execute("SELECT 1")
+            else:
+                self._cur.execute(sql, params)
+        except sqlite3.Error as e:
+            raise _wrap(e) from e
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        sql, _ = self._prepare(operation, ())
+        if sql is None:
+            return
+        try:
+            self._cur.executemany(sql, list(seq_params))
+        except sqlite3.Error as e:
+            raise _wrap(e) from e
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    def fetchone(self):
+        try:
+            return self._row(self._cur.fetchone())
+        except sqlite3.Error as e:
+            raise _wrap(e) from e
+
+    def fetchmany(self, size=1):
+        try:
+            return [self._row(r) for r in self._cur.fetchmany(size)]
+        except sqlite3.Error as e:
+            raise _wrap(e) from e
+
+    def fetchall(self):
+        try:
+            return [self._row(r) for r in self._cur.fetchall()]
+        except sqlite3.Error as e:
+            raise _wrap(e) from e
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def column_names(self):
+        return tuple(d[0] for d in self._cur.description or ())
+
+    @property
+    def with_rows(self):
+        return self._cur.description is not None
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    def close(self):
+        self._cur.close()
+
+
+class Connection:
+    """Wraps sqlite3.Connection with the parts of MySQLConnection that db.py and the app call."""
+
+    dialect = DIALECT
+    unread_result = False
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._open = True
+
+    def cursor(self, buffered=None, dictionary=False, **kwargs):
+        # SQLite reads rows lazily either way, and a second cursor never blocks the first
+        return Cursor(self._raw, dictionary=dictionary)
+
+    def commit(self):
+        try:
+            self._raw.commit()
+        except sqlite3.Error as e:
+            raise _wrap(e) from e
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def start_transaction(self, *args, **kwargs):
+        self._raw.execute("BEGIN")
+
+    def consume_results(self):
+        pass
+
+    def cmd_reset_connection(self):
+        self._raw.rollback()
+
+    def ping(self, reconnect=False, *args, **kwargs):
+        if not self._open:
+            raise errors.InterfaceError(msg="sqlite: connection is closed")
+
+    def is_connected(self):
+        return self._open
+
+    def close(self):
+        self._open = False
+        self._raw.close()
+
+
+_bootstrap_lock = threading.Lock()
+_bootstrapped = set()
+_keeper = None  # holds the shared in-memory database open while pooled connections come and go
+
+
+def _open(path):
+    memory = path == ":memory:"
+    raw = sqlite3.connect(MEMORY_URI if memory else path, uri=memory, check_same_thread=False,
+                          timeout=BUSY_TIMEOUT_MS / 1000, detect_types=sqlite3.PARSE_DECLTYPES)
+    raw.execute("PRAGMA foreign_keys = OFF")
+    if not memory:
+        raw.execute("PRAGMA journal_mode = WAL")
+        raw.execute("PRAGMA synchronous = NORMAL")
+    return Connection(raw)
+
+
+def _bootstrap(path):
+    global _keeper
+    from models.migrations import migrate
+    with _bootstrap_lock:
+        if path in _bootstrapped:
+            return
+        if path == ":memory:":
+            _keeper = _open(path)
+            migrate(_keeper)
+        else:
+            # Several gunicorn workers may open a new file at once; let one of them create the schema
+            with open(path + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                conn = _open(path)
+                try:
+                    migrate(conn)
+                finally:
+                    conn.close()
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        _bootstrapped.add(path)
+
+
+def connect(path=None, bootstrap=True, **kwargs):
+    """Open a connection, creating the schema on first use in this process.
+
+    Extra keyword arguments (MySQL connection settings) are accepted and ignored.
+    """
+    path = path or SQLITE_PATH
+    if bootstrap:
+        _bootstrap(path)
+    return _open(path)
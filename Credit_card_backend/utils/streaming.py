@@ -0,0 +1,99 @@
+import csv
+import io
+from flask import Response, request, stream_with_context, current_app
+from config import MAX_PAGE_SIZE, STREAM_BATCH_SIZE
+from db import streaming_cursor
+from utils.keystore import decrypt_records
+from utils import shards
+
+STREAM_MODES = ('ndjson', 'json')
+
+
+def page_args():
+    """Parse the ?limit=&after=&stream= query arguments shared by the list endpoints.
+
+    Returns (limit, after, stream); limit is None when the caller wants everything.
+    Raises ValueError with a client-facing message on bad input.
+    """
+    limit = request.args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError("limit must be a positive integer")
+        limit = min(int(limit), MAX_PAGE_SIZE)
+    stream = request.args.get('stream')
+    if stream is not None and stream not in STREAM_MODES:
+        raise ValueError(f"stream must be one of: {', '.join(STREAM_MODES)}")
+    return limit, request.args.get('after') or None, stream
+
+
+def fetch_batches(cur, size=STREAM_BATCH_SIZE):
+    while True:
+        rows = cur.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+
+def stream_query(sql, params, fields, shard=shards.MAIN):
+    """Yield row dicts for `sql` from an unbuffered cursor, decrypting `fields` batch by batch.
+
+    Data keys are looked up on the request cursor while the stream's own
+    connection is busy. It is fetched inside the generator: Flask tears
+    the view's context down (closing g.cursor) before a streamed body is
+    iterated. Pass no fields to get the raw rows.
+    """
+    with streaming_cursor(shard) as cur:
+        cur.execute(sql, params)
+        columns = [desc[0] for desc in cur.description]
+        for rows in fetch_batches(cur):
+            batch = [dict(zip(columns, r)) for r in rows]
+            if fields:
+                decrypt_records(shards.key_cursor(), batch, fields)
+            yield from batch
+
+
+def stream_shards(sql, params, fields, key, merchant_of=None):
+    """stream_query on every shard at once, merged in `key` order (see shards.merge_streams)."""
+    if not shards.enabled():
+        return stream_query(sql, params, fields)
+    return shards.merge_streams({s: stream_query(sql, params, fields, s) for s in shards.names()}, key, merchant_of)
+
+
+def stream_response(records, key, mode):
+    """Stream `records` as NDJSON (one object per line) or as a chunked {"<key>": [...]} document."""
+    dumps = current_app.json.dumps
+
+    def ndjson():
+        for r in records:
+            yield dumps(r) + "\n"
+
+    def chunked_json():
+        yield '{"%s": [' % key
+        first = True
+        for r in records:
+            yield ("" if first else ",") + dumps(r)
+            first = False
+        yield "]}"
+
+    if mode == 'ndjson':
+        return Response(stream_with_context(ndjson()), mimetype='application/x-ndjson')
+    return Response(stream_with_context(chunked_json()), mimetype='application/json')
+
+
+def csv_response(records, columns):
+    """Stream `records` as CSV with a header row, reusing one small buffer for every line."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def line(values):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(values)
+        return buf.getvalue()
+
+    def rows():
+        yield line(columns)
+        for r in records:
+            yield line([r.get(c) for c in columns])
+
+    return Response(stream_with_context(rows()), mimetype='text/csv')
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+
+def card_error(card, cvv):
+    """Return an error message if the card number or CVV is malformed, else None."""
+    card, cvv = str(card), str(cvv)
+    if not card.isdigit() or len(card) < 13 or len(card) > 19:
+        return "Invalid card number"
+    if not cvv.isdigit() or len(cvv) < 3 or len(cvv) > 4:
+        return "Invalid CVV"
+    return None
+
+
+def parse_timestamp(name, value):
+    """Parse an ISO 8601 timestamp as the naive local time the app stores (datetime.now()).
+
+    A value with an offset (e.g. ...Z or +02:00) is converted to local time,
+    so it compares with stored timestamps. Raises ValueError with a
+    client-facing message on bad input.
+    """
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be an ISO 8601 timestamp")
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
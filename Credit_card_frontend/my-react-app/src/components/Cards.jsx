@@ -5,7 +5,7 @@ function Cards() {
     const [cards, setCards] = useState([]);
 
     const fetchCards = async () => {
-        const res = await api.get("/customer/my_cards"); // Fetch only the logged-in customer's cards
+        const res = await api.get("/customer/my_cards?fields=card_number,expiry_date"); // Fetch only the logged-in customer's cards
         setCards(res.data.cards);
     };
 
@@ -27,7 +27,7 @@ function Dashboard({ user, role, onLogout }) {
   const fetchAdminData = async () => {
     setLoading(true);
     try {
-      const response = await fetch("/admin/all_data", { credentials: "include" });
+      const response = await fetch("/admin/all_data?fields=email,card_number,expiry_date", { credentials: "include" });
       const result = await response.json();
       setAdminData(result.data);
     } catch (err) {